@@ -0,0 +1,270 @@
+"""
+Family activity feed: what changed for the children a relative follows.
+
+Relatives who accepted an invite (family_access) follow that child. The write
+routes call record() after their own commit with a compact event (a new
+growth measurement, a milestone marked done, a capsule sealed or opened),
+which is appended to activity_events and, in the same transaction, pushed as
+a row into the timeline of every *warm* follower. Reading a page of the feed
+is then one indexed range scan of the reader's own timeline, no matter how
+many children and families they follow.
+
+Pushing to everyone would make a write cost as much as the family is large,
+and most of that work would go to people who never look. So fan-out is
+bounded: only followers who opened the feed within ACTIVITY_ACTIVE_DAYS are
+pushed to, the most recent readers first, at most ACTIVITY_FANOUT_MAX per
+event. Every other follower turns *cold* and reads by pull instead: the
+latest events of the children they follow, straight from activity_events.
+A cold reader becomes warm again on their next visit.
+
+A reader's `since` is the first event id pushed to them: their timeline is
+complete from there on, and anything older is pulled. Pagination is by
+event id (?before=<id>), so pages stay stable while new events arrive.
+
+All feed tables live in the catalog database, as relatives follow children
+of other families, which may sit in other shards.
+"""
+import hashlib
+import logging
+import os
+import time
+
+from db import each_database, get_catalog_db
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+# Followers pushed to per event; the rest read by pull
+ACTIVITY_FANOUT_MAX = int(os.environ.get('ACTIVITY_FANOUT_MAX', '50'))
+# Followers who have not opened the feed for this long turn cold
+ACTIVITY_ACTIVE_DAYS = int(os.environ.get('ACTIVITY_ACTIVE_DAYS', '30'))
+# Timeline rows kept per reader; older pages are pulled
+ACTIVITY_TIMELINE_MAX = int(os.environ.get('ACTIVITY_TIMELINE_MAX', '500'))
+ACTIVITY_PAGE_SIZE = int(os.environ.get('ACTIVITY_PAGE_SIZE', '20'))
+# A warm reader's read_at is refreshed at most this often
+READ_REFRESH_SECONDS = 3600
+
+# kind -> (icon, label)
+KINDS = {
+    'growth': ('📏', 'Pengukuran baru'),
+    'milestone': ('⭐', 'Milestone tercapai'),
+    'capsule_sealed': ('🔒', 'Kapsul waktu disegel'),
+    'capsule_opened': ('💌', 'Kapsul waktu dibuka'),
+}
+
+_EVENT_COLUMNS = 'e.id, e.child_id, e.child_name, e.kind, e.summary, e.created_at'
+
+
+def record(child_id, child_name, kind, summary, actor_id=None):
+    """Append an event and push it to the child's warm followers.
+
+    Called after the change itself was committed; the feed is a side
+    channel, so a failure is logged instead of failing the request.
+    """
+    db = get_catalog_db()
+    try:
+        cur = db.execute('''
+            INSERT INTO activity_events (child_id, child_name, actor_id, kind, summary)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (child_id, child_name, actor_id, kind, summary))
+        event_id = cur.lastrowid
+        _fan_out(db, child_id, event_id)
+        db.commit()
+        return event_id
+    except Exception:
+        db.rollback()
+        logger.exception('Could not record %s activity of child %s', kind, child_id)
+        return None
+
+
+def _fan_out(db, child_id, event_id):
+    cutoff = int(time.time()) - ACTIVITY_ACTIVE_DAYS * 86400
+    warm = [r['user_id'] for r in db.execute('''
+        SELECT r.user_id FROM activity_follows f
+        JOIN activity_readers r ON r.user_id = f.user_id
+        WHERE f.child_id = ? AND r.since IS NOT NULL AND r.read_at >= ?
+        ORDER BY r.read_at DESC LIMIT ?
+    ''', (child_id, cutoff, ACTIVITY_FANOUT_MAX))]
+    if warm:
+        db.executemany('INSERT INTO activity_timeline (user_id, event_id, child_id) VALUES (?, ?, ?)',
+                       [(user_id, event_id, child_id) for user_id in warm])
+    # Everyone else who was warm misses this event: their timeline is no
+    # longer complete, so they pull until their next visit
+    marks = ','.join('?' * len(warm))
+    skip = f'AND user_id NOT IN ({marks})' if warm else ''
+    db.execute(f'''
+        UPDATE activity_readers SET since = NULL
+        WHERE since IS NOT NULL {skip}
+          AND user_id IN (SELECT user_id FROM activity_follows WHERE child_id = ?)
+    ''', (*warm, child_id))
+
+
+def follow(db, user_id, child_id):
+    """Start following a child (an accepted invite). Does not commit."""
+    if db.execute('SELECT 1 FROM activity_follows WHERE user_id=? AND child_id=?',
+                  (user_id, child_id)).fetchone():
+        return False
+    db.execute('INSERT INTO activity_follows (user_id, child_id) VALUES (?, ?)', (user_id, child_id))
+    # A warm timeline must hold every event of every followed child from
+    # `since` on, including the ones recorded before this follow
+    db.execute('''
+        INSERT INTO activity_timeline (user_id, event_id, child_id)
+        SELECT r.user_id, e.id, e.child_id FROM activity_readers r
+        JOIN activity_events e ON e.child_id = ? AND e.id >= r.since
+        WHERE r.user_id = ? AND r.since IS NOT NULL
+    ''', (child_id, user_id))
+    return True
+
+
+def unfollow(db, user_id, child_id):
+    """Stop following a child (revoked access). Does not commit."""
+    db.execute('DELETE FROM activity_follows WHERE user_id=? AND child_id=?', (user_id, child_id))
+    db.execute('DELETE FROM activity_timeline WHERE user_id=? AND child_id=?', (user_id, child_id))
+
+
+def forget_child(child_id):
+    """Remove a deleted child's events and follows from the feed."""
+    db = get_catalog_db()
+    for table in ('activity_timeline', 'activity_follows', 'activity_events'):
+        db.execute(f'DELETE FROM {table} WHERE child_id=?', (child_id,))
+    db.commit()
+
+
+def feed_etag(db, user_id, before, salt=''):
+    """Validator of a feed page, computed without reading any event rows.
+
+    The page changes when an event of a followed child is added or a follow
+    comes or goes; both show in the follow count and the newest event id.
+    """
+    row = db.execute('''
+        SELECT COUNT(*) AS follows, MAX(
+            (SELECT MAX(e.id) FROM activity_events e WHERE e.child_id = f.child_id)) AS newest
+        FROM activity_follows f WHERE f.user_id = ?
+    ''', (user_id,)).fetchone()
+    key = f"{user_id}:{row['follows']}:{row['newest']}:{before}:{salt}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _pull(db, user_id, before, limit):
+    return db.execute(f'''
+        SELECT {_EVENT_COLUMNS} FROM activity_events e
+        JOIN activity_follows f ON f.child_id = e.child_id AND f.user_id = ?
+        WHERE e.id < ? ORDER BY e.id DESC LIMIT ?
+    ''', (user_id, before, limit)).fetchall()
+
+
+def seen(db, user_id):
+    """Note that a reader opened the feed; returns their `since`, None if cold.
+
+    A warm reader's read_at is refreshed (at most every READ_REFRESH_SECONDS)
+    so fan-out keeps reaching them; a cold one is made warm from the next
+    event on. Also called when the page is answered with 304.
+    """
+    now = int(time.time())
+    reader = db.execute('SELECT since, read_at FROM activity_readers WHERE user_id=?',
+                        (user_id,)).fetchone()
+    if reader is not None and reader['since'] is not None:
+        if now - reader['read_at'] >= READ_REFRESH_SECONDS:
+            db.execute('UPDATE activity_readers SET read_at=? WHERE user_id=?', (now, user_id))
+            db.commit()
+        return reader['since']
+    since = '(SELECT COALESCE(MAX(id), 0) + 1 FROM activity_events)'
+    if reader is None:
+        db.execute(f'INSERT INTO activity_readers (user_id, since, read_at) VALUES (?, {since}, ?)',
+                   (user_id, now))
+    else:
+        db.execute(f'UPDATE activity_readers SET since = {since}, read_at = ? WHERE user_id = ?',
+                   (now, user_id))
+    db.commit()
+    return None
+
+
+def page(db, user_id, before=None, size=None):
+    """One page of a reader's feed, newest first: (events, next `before` or None)."""
+    size = size or ACTIVITY_PAGE_SIZE
+    upper = before if before is not None else 2 ** 62
+    since = seen(db, user_id)
+    if since is None:
+        events = _pull(db, user_id, upper, size + 1)
+    else:
+        events = db.execute(f'''
+            SELECT {_EVENT_COLUMNS} FROM activity_timeline t
+            JOIN activity_events e ON e.id = t.event_id
+            WHERE t.user_id = ? AND t.event_id >= ? AND t.event_id < ?
+            ORDER BY t.event_id DESC LIMIT ?
+        ''', (user_id, since, upper, size + 1)).fetchall()
+        if len(events) <= size:
+            # The timeline ends at `since`; older events come from pull
+            events += _pull(db, user_id, min(upper, since), size + 1 - len(events))
+    more = len(events) > size
+    events = events[:size]
+    return events, (events[-1]['id'] if more else None)
+
+
+def sync_follows():
+    """Rebuild follows from accepted family_access rows in every database.
+
+    Adds follows that are missing (e.g. invites accepted before the feed
+    existed) and drops those whose access was revoked. Returns (added, removed).
+    """
+    accepted = set()
+    for db in each_database():
+        accepted.update((r['user_id'], r['child_id']) for r in db.execute('''
+            SELECT fa.user_id, fa.child_id FROM family_access fa
+            JOIN children c ON c.id = fa.child_id
+            WHERE fa.status = 'accepted' AND fa.user_id IS NOT NULL
+        '''))
+    catalog = get_catalog_db()
+    current = {(r['user_id'], r['child_id'])
+               for r in catalog.execute('SELECT user_id, child_id FROM activity_follows')}
+    added = removed = 0
+    for user_id, child_id in accepted - current:
+        added += follow(catalog, user_id, child_id)
+    for user_id, child_id in current - accepted:
+        unfollow(catalog, user_id, child_id)
+        removed += 1
+    catalog.commit()
+    return added, removed
+
+
+def trim():
+    """Cap every timeline at ACTIVITY_TIMELINE_MAX rows.
+
+    The reader's `since` moves up to the oldest row kept, so the events
+    below it are pulled again. Rows below `since` (left over from a cold
+    spell) go too. Returns the number of rows deleted.
+    """
+    db = get_catalog_db()
+    crowded = db.execute('''
+        SELECT user_id FROM activity_timeline GROUP BY user_id HAVING COUNT(*) > ?
+    ''', (ACTIVITY_TIMELINE_MAX,)).fetchall()
+    for row in crowded:
+        oldest = db.execute('''
+            SELECT event_id FROM activity_timeline WHERE user_id = ?
+            ORDER BY event_id DESC LIMIT 1 OFFSET ?
+        ''', (row['user_id'], ACTIVITY_TIMELINE_MAX - 1)).fetchone()['event_id']
+        db.execute('UPDATE activity_readers SET since = ? WHERE user_id = ? AND since < ?',
+                   (oldest, row['user_id'], oldest))
+        db.commit()
+    cur = db.execute('''
+        DELETE FROM activity_timeline WHERE NOT EXISTS (
+            SELECT 1 FROM activity_readers r
+            WHERE r.user_id = activity_timeline.user_id AND r.since IS NOT NULL
+              AND activity_timeline.event_id >= r.since)
+    ''')
+    db.commit()
+    return max(cur.rowcount, 0)
+
+
+@job('activity-sync-follows', every=86400, per_database=False)
+def sync_follows_job():
+    added, removed = sync_follows()
+    if added or removed:
+        logger.info('Activity follows synced: %s added, %s removed', added, removed)
+
+
+@job('activity-trim', every=3600, per_database=False)
+def trim_job():
+    deleted = trim()
+    if deleted:
+        logger.info('Activity timelines trimmed: %s rows', deleted)
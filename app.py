@@ -1,33 +1,460 @@
-from flask import Flask, render_template, request, redirect, url_for, session, g, flash
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, session, g, flash, abort, send_file
 import os
-from datetime import datetime
-from db import get_db, init_db, close_connection
+import base64
+import io
+import click
+import hashlib
+import secrets
+from datetime import datetime, date, timedelta
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import secure_filename
+from db import (get_db, get_catalog_db, use_database, use_user_database, each_database, init_db,
+                ensure_schema, close_connection, add_server_timing, DB_TYPE, DB_SHARDING, DATABASE_DIR)
+from migrations import status as migration_status
+from immunization_schedule import materialize_schedule, due_doses, count_due, record_doses
+import worker
+from notifications import (subscribe as push_subscribe, unsubscribe as push_unsubscribe,
+                           enqueue_due_events, deliver_pending, VAPID_PUBLIC_KEY)
+from bulk_entry import (KINDS as BULK_KINDS, ChildResolver, iter_form_rows, iter_csv_rows,
+                        insert_rows, csv_template)
+import assets
+from page_cache import cached_page, compress_response, template_version
+import milestone_cards
+import growth_report
+import purge
+import sharding
+import backup
+import cold_storage
+import audio_pipeline
+import dates
+import profiler
+import storage
+import activity
+import roster
+import media_store
+from models import owned_child, owned_capsule, stream
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'dev-secret')
 app.teardown_appcontext(close_connection)
+app.after_request(compress_response)
+app.after_request(add_server_timing)
+profiler.init_app(app)
+
+# Uploads may live in an S3 bucket, and sealed capsule media in a
+# cold-storage pack, instead of on disk
+_send_static = app.view_functions['static']
+
+
+def static_with_cold_storage(filename):
+    try:
+        return _send_static(filename=filename)
+    except NotFound:
+        response = cold_storage.serve(filename)
+        if response is not None:
+            return response
+        key = media_store.url_to_key('/static/' + filename)
+        url = media_store.get_store().url(key) if key else None
+        if url is None:
+            raise
+        # The browser fetches the bytes from the bucket, not from us
+        response = redirect(url)
+        response.headers['Cache-Control'] = f'private, max-age={media_store.MEDIA_URL_EXPIRES // 4}'
+        return response
+
+
+app.view_functions['static'] = static_with_cold_storage
+
+# Run scheduled jobs (reminders, push delivery) inside the web process.
+# Otherwise run `flask --app app worker` as a separate process.
+BACKGROUND_WORKER = os.environ.get('BACKGROUND_WORKER', '0') == '1'
+
+# Doses listed on the dashboard card; the rest are summarized as a count
+DASHBOARD_DUE_MAX = 8
 
 # Custom Jinja filter for calculating days until a date
 @app.template_filter('days_until')
-def days_until_filter(date_str):
-    """Calculate days until a date string."""
-    if not date_str:
-        return 0
+def days_until_filter(value):
+    """Days until a date (epoch day or ISO string); prefer precomputed values."""
     try:
-        if isinstance(date_str, str):
-            target = datetime.strptime(date_str, '%Y-%m-%d')
-        else:
-            target = date_str
-        delta = target - datetime.now()
-        return max(0, delta.days)
-    except:
+        return dates.days_until(value)
+    except dates.DateError:
         return 0
 
-# Initialize the database inside an application context
-with app.app_context():
-    init_db()
+@app.template_filter('waveform_peaks')
+def waveform_peaks_filter(waveform):
+    """Stored waveform peaks as bar heights between 0 and 1."""
+    return audio_pipeline.decode_peaks(waveform)
+
+@app.template_filter('duration')
+def duration_filter(ms):
+    """Milliseconds as m:ss."""
+    seconds = int(ms or 0) // 1000
+    return f'{seconds // 60}:{seconds % 60:02d}'
+
+@app.template_global()
+def asset_url(path):
+    """URL of a fingerprinted build of a static file, or the plain one if not built."""
+    hashed = assets.hashed_name(path)
+    if hashed:
+        return url_for('serve_asset', filename=hashed)
+    return url_for('static', filename=path)
+
+# The schema is verified lazily on the first request of each worker instead
+# of at import time, so `flask` CLI calls and gunicorn --preload stay cheap.
+@app.before_request
+def _ensure_schema():
+    ensure_schema()
+    # Started after fork; the worker lock keeps it to one process
+    if BACKGROUND_WORKER:
+        worker.start_background(app, DATABASE_DIR)
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema."""
+    init_db(log=click.echo)
+
+
+@app.cli.command('db-migrate')
+@click.option('--dry-run', is_flag=True, help='Print the SQL without executing it.')
+@click.option('--target', type=int, default=None, help='Stop after this migration version.')
+def db_migrate_command(dry_run, target):
+    """Apply pending schema migrations."""
+    init_db(dry_run=dry_run, target=target, log=click.echo)
+
+
+@app.cli.command('materialize-schedules')
+def materialize_schedules_command():
+    """Create the national immunization schedule for every existing child."""
+    created = total = 0
+    for db in each_database():
+        children_rows = db.execute('SELECT id, dob FROM children').fetchall()
+        for child in children_rows:
+            created += materialize_schedule(db, child['id'], child['dob'])
+        db.commit()
+        total += len(children_rows)
+    click.echo(f'{created} doses scheduled for {total} children.')
+
+
+@app.cli.command('worker')
+@click.option('--once', 'once', default=None, help='Run a single job by name and exit.')
+def worker_command(once):
+    """Run the background job scheduler."""
+    if once:
+        if once not in worker.JOBS:
+            raise click.BadParameter(f'unknown job, choose from: {", ".join(sorted(worker.JOBS))}')
+        worker.run_job(app, once)
+        return
+    worker.run_forever(app, DATABASE_DIR)
+
+
+@app.cli.command('push-enqueue')
+def push_enqueue_command():
+    """Queue due reminders (vaccines, capsule unlocks, letters)."""
+    queued = sum(enqueue_due_events(db) for db in each_database())
+    click.echo(f'{queued} notifications queued.')
+
+
+@app.cli.command('push-deliver')
+def push_deliver_command():
+    """Deliver one batch of queued push notifications."""
+    for db in each_database():
+        click.echo(deliver_pending(db))
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and precompress CSS/JS into static/dist."""
+    assets.build(log=click.echo)
+
+
+@app.cli.command('render-cards')
+@click.option('--theme', 'themes', multiple=True, type=click.Choice(sorted(milestone_cards.PALETTES)),
+              help='Theme(s) to render, default peach.')
+@click.option('--evict', is_flag=True, help='Trim the card cache to CARD_CACHE_MAX_MB afterwards.')
+def render_cards_command(themes, evict):
+    """Pre-render milestone cards for every achieved milestone."""
+    rendered = sum(milestone_cards.prerender(db, themes=list(themes) or None)
+                   for db in each_database())
+    click.echo(f'{rendered} cards rendered.')
+    if evict:
+        click.echo(f'{milestone_cards.evict()} cached cards evicted.')
+
+
+@app.cli.command('growth-report')
+@click.option('--user', 'user_id', type=int, help='Only the children of this account, e.g. a posyandu.')
+@click.option('--child', 'child_ids', type=int, multiple=True, help='Only these children.')
+@click.option('--format', 'fmt', type=click.Choice(['html', 'pdf']), default='html')
+@click.option('--workers', type=int, default=None, help='Rendering processes, default one per CPU.')
+@click.option('--evict', is_flag=True, help='Trim the report cache to REPORT_CACHE_MAX_MB afterwards.')
+def growth_report_command(user_id, child_ids, fmt, workers, evict):
+    """Pre-render printable growth reports (KMS), e.g. before a posyandu session."""
+    if fmt == 'pdf' and not growth_report.pdf_available():
+        raise click.ClickException('PDF reports need WeasyPrint (pip install weasyprint).')
+    databases = [use_user_database(user_id)] if user_id is not None else each_database()
+    total = rendered = 0
+    for db in databases:
+        paths, count = growth_report.prerender(db, child_ids=list(child_ids) or None, user_id=user_id,
+                                               fmt=fmt, workers=workers)
+        total += len(paths)
+        rendered += count
+    click.echo(f'{rendered} reports rendered, {total - rendered} already up to date.')
+    if evict:
+        click.echo(f'{growth_report.evict()} cached reports evicted.')
+
+
+@app.cli.command('purge-reconcile')
+@click.option('--dry-run', is_flag=True, help='Only report what would be cleaned up.')
+def purge_reconcile_command(dry_run):
+    """Remove orphaned rows and queue unreferenced upload files."""
+    report = purge.reconcile(dry_run=dry_run)
+    for name, count in report.items():
+        click.echo(f'{name:<20} {count}')
+    if not dry_run:
+        processed, deleted, failed = purge.run_janitor(get_catalog_db())
+        click.echo(f'{deleted} files deleted, {failed} failed.')
+
+
+@app.cli.command('storage-report')
+@click.option('--limit', type=int, default=20)
+@click.option('--children', 'by_child', is_flag=True, help='List children instead of families.')
+def storage_report_command(limit, by_child):
+    """Families (or children) using the most upload space."""
+    totals = storage.totals()
+    line = f"{storage.format_size(totals['bytes'])} in {totals['files']} files counted"
+    if totals['disk_used'] is not None:
+        line += (f"; disk {storage.format_size(totals['disk_used'])} "
+                 f"of {storage.format_size(totals['disk_total'])} used")
+    click.echo(line)
+    quota = storage.STORAGE_QUOTA_MB * storage.MB
+    if by_child:
+        for child_id, name, user_id, size, files in storage.top_children(limit):
+            click.echo(f'child {child_id:<6} {name[:24]:<24} user {user_id:<6} '
+                       f'{storage.format_size(size):>10} {files:>6} files')
+        return
+    for user_id, username, size, files, children_count in storage.top_families(limit):
+        share = f'{100 * size / quota:5.1f}% of quota' if quota else ''
+        click.echo(f'user {user_id:<6} {username[:24]:<24} {storage.format_size(size):>10} '
+                   f'{files:>6} files {children_count:>3} children  {share}')
+
+
+@app.cli.command('storage-reconcile')
+@click.option('--pause', type=float, default=None, help='Seconds between batches (default STORAGE_SCAN_PAUSE).')
+def storage_reconcile_command(pause):
+    """Re-measure media files and repair the per-family storage counters."""
+    for db in each_database():
+        click.echo(storage.reconcile(db, pause=pause))
+
+
+@app.cli.command('media-migrate')
+@click.option('--workers', type=int, default=None, help='Parallel copies (default MEDIA_MIGRATE_WORKERS).')
+@click.option('--delete-local', is_flag=True, help='Remove each local file once its copy is verified.')
+def media_migrate_command(workers, delete_local):
+    """Copy static/uploads (and cold-storage packs) into the configured S3 bucket."""
+    target = media_store.get_store()
+    if target.name == 'local':
+        raise click.ClickException('Set MEDIA_STORE=s3 and the S3_* variables first.')
+    report = media_store.migrate(media_store.LocalStore(), target, workers, delete_local, log=click.echo)
+    click.echo(f"{report['copied']} copied ({storage.format_size(report['bytes'])}), "
+               f"{report['skipped']} already there, {report['failed']} failed")
+    # Archived media go straight from their packs into the bucket
+    for db in each_database():
+        cold_storage.rehydrate(db, log=click.echo, everything=True)
+    if report['failed']:
+        raise click.ClickException('Some files were not copied; run the command again.')
+
+
+@app.cli.command('activity-sync')
+def activity_sync_command():
+    """Rebuild feed follows from accepted invites and trim the timelines."""
+    added, removed = activity.sync_follows()
+    click.echo(f'Follows: {added} added, {removed} removed')
+    click.echo(f'Timeline rows trimmed: {activity.trim()}')
+
+
+@app.cli.command('posyandu-create')
+@click.argument('name')
+@click.option('--coordinator', required=True, help='Username of the coordinator.')
+def posyandu_create_command(name, coordinator):
+    """Create a posyandu group and print its join code."""
+    catalog = get_catalog_db()
+    user = catalog.execute('SELECT id FROM users WHERE username=?', (coordinator,)).fetchone()
+    if not user:
+        raise click.ClickException(f'Unknown user {coordinator}')
+    group_id, code = roster.create_group(catalog, name, user['id'])
+    click.echo(f'Group {group_id} "{name}" created, join code {code}')
+
+
+@app.cli.command('posyandu-enroll')
+@click.argument('group_id', type=int)
+@click.option('--owner', required=True, help='Username whose children all join the group.')
+def posyandu_enroll_command(group_id, owner):
+    """Put every child of an account in a posyandu group."""
+    catalog = get_catalog_db()
+    if not roster.group_name(catalog, group_id):
+        raise click.ClickException(f'Unknown group {group_id}')
+    user = catalog.execute('SELECT id FROM users WHERE username=?', (owner,)).fetchone()
+    if not user:
+        raise click.ClickException(f'Unknown user {owner}')
+    enrolled = roster.enroll_family(use_user_database(user['id']), group_id, user['id'])
+    click.echo(f'{enrolled} children enrolled.')
+
+
+@app.cli.command('backup')
+def backup_command():
+    """Back up the database(s) and new uploads, verify, rotate old snapshots."""
+    try:
+        backup.create_snapshot(log=click.echo)
+    except backup.BackupError as e:
+        raise click.ClickException(str(e))
+
+
+@app.cli.command('backup-list')
+def backup_list_command():
+    """List backup snapshots."""
+    for name in backup.list_snapshots():
+        manifest = backup.load_manifest(name)
+        size = sum(d['size'] for d in manifest['databases'].values())
+        click.echo(f"{name}  {len(manifest['databases'])} db ({size} bytes)  "
+                   f"{len(manifest['media'])} media")
+
+
+@app.cli.command('backup-verify')
+@click.argument('name')
+@click.option('--deep', is_flag=True, help='Re-hash every media file too.')
+def backup_verify_command(name, deep):
+    """Check that a snapshot restores cleanly."""
+    try:
+        problems = backup.verify_snapshot(name, deep=deep)
+    except (backup.BackupError, FileNotFoundError) as e:
+        raise click.ClickException(str(e))
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise click.ClickException(f'{len(problems)} problems found')
+    click.echo(f'{name}: OK')
+
+
+@app.cli.command('backup-restore')
+@click.argument('name')
+@click.argument('target_dir')
+def backup_restore_command(name, target_dir):
+    """Restore a snapshot into an empty directory (never over the live data)."""
+    try:
+        backup.restore(name, target_dir, log=click.echo)
+    except backup.BackupError as e:
+        raise click.ClickException(str(e))
+
+
+@app.cli.command('cold-storage')
+@click.option('--archive', 'do_archive', is_flag=True, help='Pack eligible sealed-capsule media now.')
+@click.option('--rehydrate', 'do_rehydrate', is_flag=True, help='Restore media that is due now.')
+@click.option('--capsule', type=int, default=None, help='Rehydrate this capsule regardless of date.')
+def cold_storage_command(do_archive, do_rehydrate, capsule):
+    """Cold-storage packs: status, archive or rehydrate."""
+    for db in each_database():
+        if do_archive:
+            click.echo(f'{cold_storage.archive(db, log=click.echo)} files archived.')
+        if capsule:
+            click.echo(f'{cold_storage.rehydrate_capsule(db, capsule)} files of capsule {capsule} rehydrated.')
+        if do_rehydrate:
+            click.echo(f'{cold_storage.rehydrate(db, log=click.echo)} files rehydrated.')
+        stats = cold_storage.stats(db)
+        click.echo(f"{stats['packs']} packs, {stats['files']} files, {stats['size']} bytes")
+
+
+@app.cli.command('audio-transcode')
+@click.option('--limit', type=int, default=100, help='Process at most this many recordings per database.')
+@click.option('--retry-failed', is_flag=True, help='Also retry recordings that failed before.')
+def audio_transcode_command(limit, retry_failed):
+    """Normalize, transcode and compute waveforms of capsule recordings."""
+    if not audio_pipeline.available():
+        raise click.ClickException(f'{audio_pipeline.AUDIO_FFMPEG} not found (set AUDIO_FFMPEG)')
+    for db in each_database():
+        processed = audio_pipeline.process_pending(db, limit=limit, retry_failed=retry_failed)
+        stats = audio_pipeline.storage_stats(db)
+        minutes = stats['duration_ms'] / 60000 or 1
+        click.echo(f"{processed} processed, {stats['done']} done, {stats['pending']} pending; "
+                   f"{stats['original_bytes'] / minutes / 1024:.0f} KB/min before, "
+                   f"{stats['current_bytes'] / minutes / 1024:.0f} KB/min now")
+
+
+@app.cli.command('profile-list')
+@click.option('--limit', type=int, default=20)
+def profile_list_command(limit):
+    """Most recent request profiles (PROFILE_TOKEN / PROFILE_SAMPLE_RATE)."""
+    for name in reversed(profiler.profiles()[-limit:]):
+        click.echo(name)
+
+
+@app.cli.command('profile-flamegraph')
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--output', '-o', default=None, help='SVG file (default: next to the profile).')
+def profile_flamegraph_command(patterns, output):
+    """Render one or more profiles (names or globs, e.g. '*-growth_list-*') as an SVG flame graph."""
+    stacks, files = profiler.load(patterns)
+    if not files:
+        raise click.ClickException(f'No profiles match in {profiler.PROFILE_DIR}')
+    title = os.path.basename(files[0]) if len(files) == 1 else f'{len(files)} profiles: {" ".join(patterns)}'
+    output = output or os.path.join(profiler.PROFILE_DIR,
+                                    os.path.basename(files[0]) + '.svg' if len(files) == 1 else 'merged.svg')
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(profiler.flamegraph_svg(stacks, title=title))
+    click.echo(f'{sum(stacks.values())} samples from {len(files)} profiles -> {output}')
+
+
+@app.cli.command('shard-status')
+def shard_status_command():
+    """Families and children per shard (DB_SHARDING=1)."""
+    if not DB_SHARDING:
+        raise click.UsageError('DB_SHARDING is not enabled.')
+    for name, families, children_count in sharding.shard_stats():
+        click.echo(f'{name:<10} {families:>6} families {children_count:>7} children')
+
+
+@app.cli.command('shard-move')
+@click.argument('user_id', type=int)
+@click.argument('shard')
+def shard_move_command(user_id, shard):
+    """Move one family to another shard while the app keeps running."""
+    if not DB_SHARDING:
+        raise click.UsageError('DB_SHARDING is not enabled.')
+    sharding.move_user(user_id, shard, log=click.echo)
+
+
+@app.cli.command('shard-rebalance')
+@click.option('--limit', type=int, default=None, help='Move at most this many families.')
+def shard_rebalance_command(limit):
+    """Move families still in the main database to their hash bucket."""
+    if not DB_SHARDING:
+        raise click.UsageError('DB_SHARDING is not enabled.')
+    click.echo(f'{sharding.rebalance(limit=limit, log=click.echo)} families moved.')
+
+
+@app.cli.command('db-status')
+def db_status_command():
+    """List migrations and whether they have been applied."""
+    for m, state in migration_status(get_db(), DB_TYPE):
+        click.echo(f'{m.version:03d} {m.name:<50} {state}')
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Serve fingerprinted assets, preferring the precompressed variants."""
+    path, encoding = assets.resolve(filename, request.headers.get('Accept-Encoding', ''))
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=assets.content_type(filename), conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    # The name changes with the content, so it never needs revalidating
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 
 @app.route('/')
+@cached_page
 def index():
     """Landing page for unauthenticated users, redirect to dashboard for authenticated."""
     user_id = session.get('user_id')
@@ -46,13 +473,7 @@ def dashboard():
     
     # Total children
     cur = db.execute('SELECT COUNT(*) as total FROM children WHERE user_id=?', (user_id,))
-    row = cur.fetchone()
-    total_children = 0
-    if row:
-        try:
-            total_children = row['total']
-        except Exception:
-            total_children = row[0]
+    total_children = cur.fetchone()['total']
     
     # Get latest growth records
     cur = db.execute('''
@@ -60,7 +481,7 @@ def dashboard():
         FROM children c 
         LEFT JOIN growth g ON c.id = g.child_id 
         WHERE c.user_id = ? 
-        ORDER BY g.record_date DESC LIMIT 5
+        ORDER BY g.record_day DESC LIMIT 5
     ''', (user_id,))
     latest_growth = cur.fetchall()
     
@@ -86,23 +507,35 @@ def dashboard():
     ''', (user_id,))
     immunization_data = cur.fetchall()
     
+    # Overdue doses and doses due in the next 7 days (one range scan)
+    week_ahead = (date.today() + timedelta(days=7)).isoformat()
+    due_this_week = due_doses(db, None, week_ahead, user_id=user_id, limit=DASHBOARD_DUE_MAX)
+    due_more = 0
+    if len(due_this_week) == DASHBOARD_DUE_MAX:
+        due_more = count_due(db, None, week_ahead, user_id=user_id) - DASHBOARD_DUE_MAX
+    
     return render_template('index.html', 
                          total_children=total_children,
                          latest_growth=latest_growth,
                          milestone_data=milestone_data,
-                         immunization_data=immunization_data)
+                         immunization_data=immunization_data,
+                         due_this_week=due_this_week,
+                         due_more=due_more,
+                         today=date.today().isoformat())
 
 @app.route('/register', methods=['GET','POST'])
+@cached_page
 def register():
     db = get_db()
     if request.method=='POST':
         username = request.form['username']
         password = request.form['password']
-        import hashlib
         pw_hash = hashlib.sha256(password.encode()).hexdigest()
         try:
-            db.execute('INSERT INTO users (username,password) VALUES (?,?)', (username, pw_hash))
+            cur = db.execute('INSERT INTO users (username,password) VALUES (?,?)', (username, pw_hash))
             db.commit()
+            if DB_SHARDING:
+                sharding.assign_new_user(db, cur.lastrowid)
             flash('Registrasi berhasil. Silakan login.')
             return redirect(url_for('login'))
         except Exception:
@@ -110,22 +543,20 @@ def register():
     return render_template('register.html')
 
 @app.route('/login', methods=['GET','POST'])
+@cached_page
 def login():
     db = get_db()
     if request.method=='POST':
         username = request.form['username']
         password = request.form['password']
-        import hashlib
         pw_hash = hashlib.sha256(password.encode()).hexdigest()
         cur = db.execute('SELECT id FROM users WHERE username=? AND password=?', (username, pw_hash))
         row = cur.fetchone()
         if row:
-            # mysql cursor with dictionary=True returns a dict, sqlite3.Row supports mapping access
-            try:
-                user_id = row['id']
-            except Exception:
-                user_id = row[0]
-            session['user_id'] = user_id
+            session['user_id'] = row['id']
+            # Shows the roster link; the roster itself checks the group
+            if roster.coordinated_groups(get_catalog_db(), row['id']):
+                session['coordinator'] = True
             return redirect(url_for('dashboard'))
         else:
             flash('Login gagal. Periksa username/password.')
@@ -134,6 +565,7 @@ def login():
 @app.route('/logout')
 def logout():
     session.pop('user_id', None)
+    session.pop('coordinator', None)
     return redirect(url_for('login'))
 
 @app.route('/children')
@@ -143,7 +575,7 @@ def children():
     if not user_id:
         return redirect(url_for('login'))
     cur = db.execute('SELECT id,name,dob,gender FROM children WHERE user_id=?', (user_id,))
-    children = cur.fetchall()
+    children = stream(cur)
     return render_template('children.html', children=children)
 
 @app.route('/children/add', methods=['GET','POST'])
@@ -154,10 +586,15 @@ def add_child():
         return redirect(url_for('login'))
     if request.method=='POST':
         name = request.form['name']
-        dob = request.form['dob']
+        try:
+            dob = dates.normalize(request.form['dob'])
+        except dates.DateError as e:
+            flash(str(e))
+            return render_template('add_child.html')
         gender = request.form['gender']
-        db.execute('INSERT INTO children (user_id,name,dob,gender) VALUES (?,?,?,?)',
-                   (user_id,name,dob,gender))
+        cur = db.execute('INSERT INTO children (user_id,name,dob,gender) VALUES (?,?,?,?)',
+                         (user_id,name,dob,gender))
+        materialize_schedule(db, cur.lastrowid, dob)
         db.commit()
         return redirect(url_for('children'))
     return render_template('add_child.html')
@@ -170,23 +607,40 @@ def edit_child(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id,name,dob,gender FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id, 'id, name, dob, gender, posyandu_id')
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
+    posyandu_name = roster.group_name(get_catalog_db(), child['posyandu_id'])
     
     if request.method=='POST':
         name = request.form['name']
-        dob = request.form['dob']
+        try:
+            dob = dates.normalize(request.form['dob'])
+        except dates.DateError as e:
+            flash(str(e))
+            return render_template('edit_child.html', child=child, posyandu_name=posyandu_name)
         gender = request.form['gender']
-        db.execute('UPDATE children SET name=?,dob=?,gender=? WHERE id=? AND user_id=?',
-                   (name, dob, gender, child_id, user_id))
+        posyandu_id = child['posyandu_id']
+        code = request.form.get('posyandu_code', '').strip()
+        if request.form.get('leave_posyandu'):
+            posyandu_id = None
+        elif code:
+            group = roster.group_by_code(get_catalog_db(), code)
+            if not group:
+                flash('Kode posyandu tidak ditemukan.')
+                return render_template('edit_child.html', child=child, posyandu_name=posyandu_name)
+            posyandu_id = group['id']
+        db.execute('UPDATE children SET name=?,dob=?,gender=?,posyandu_id=? WHERE id=? AND user_id=?',
+                   (name, dob, gender, posyandu_id, child_id, user_id))
+        if dob != child['dob']:
+            # Re-date pending doses to the corrected date of birth
+            materialize_schedule(db, child_id, dob)
         db.commit()
         flash('Data anak berhasil diupdate.')
         return redirect(url_for('children'))
     
-    return render_template('edit_child.html', child=child)
+    return render_template('edit_child.html', child=child, posyandu_name=posyandu_name)
 
 @app.route('/children/<int:child_id>/delete', methods=['POST'])
 def delete_child(child_id):
@@ -196,19 +650,15 @@ def delete_child(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership before deleting
-    cur = db.execute('SELECT id FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id, 'id')
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
-    # Delete related records (growth, development, immunization)
-    db.execute('DELETE FROM growth WHERE child_id=?', (child_id,))
-    db.execute('DELETE FROM development WHERE child_id=?', (child_id,))
-    db.execute('DELETE FROM immunization WHERE child_id=?', (child_id,))
-    # Delete child
-    db.execute('DELETE FROM children WHERE id=?', (child_id,))
-    db.commit()
+    # Child, all dependent rows and (queued) uploaded files, in one transaction
+    purge.purge_child(db, child_id)
+    activity.forget_child(child_id)
+    growth_report.forget(child_id)
     flash('Data anak berhasil dihapus.')
     return redirect(url_for('children'))
 
@@ -220,18 +670,51 @@ def growth_list(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id,name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id, 'id, name, data_version')
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
     # Get growth records
-    cur = db.execute('SELECT id,record_date,weight,height,head_circ FROM growth WHERE child_id=? ORDER BY record_date DESC', (child_id,))
-    rows = cur.fetchall()
-    # Convert Row objects to dicts for JSON serialization
-    records = [dict(row) if hasattr(row, 'keys') else {'id': row[0], 'record_date': row[1], 'weight': row[2], 'height': row[3], 'head_circ': row[4]} for row in rows]
-    return render_template('growth_list.html', child=child, records=records)
+    cur = db.execute('SELECT id,record_date,weight,height,head_circ FROM growth WHERE child_id=? ORDER BY record_day DESC', (child_id,))
+    records = cur.fetchall()
+    # Chart series, oldest first
+    chart = {'dates': [r['record_date'] for r in reversed(records)],
+             'weights': [r['weight'] for r in reversed(records)],
+             'heights': [r['height'] for r in reversed(records)]}
+    # Versioned report URLs, so the browser can cache each report for good
+    version = growth_report.report_version(child['data_version'])
+    report_urls = {fmt: url_for('growth_report_view', child_id=child_id, fmt=fmt, v=version)
+                   for fmt in growth_report.formats()}
+    return render_template('growth_list.html', child=child, records=records, chart=chart,
+                           report_urls=report_urls)
+
+@app.route('/children/<int:child_id>/report.<fmt>')
+def growth_report_view(child_id, fmt):
+    """Printable growth report (KMS), rendered and cached per data version."""
+    db = get_db()
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    if fmt not in growth_report.formats():
+        abort(404)
+    
+    child = owned_child(db, child_id, user_id, 'id, name, data_version')
+    if not child:
+        abort(404)
+    # A cache hit needs nothing but the version read above
+    path = growth_report.cached(child_id, child['data_version'], fmt)
+    if path is None:
+        path = growth_report.get_report(growth_report.load_report_data(db, child_id), fmt)
+    version = growth_report.report_version(child['data_version'])
+    response = send_file(path, mimetype=growth_report.MIMETYPES[fmt], conditional=True,
+                         etag=f'{child_id}-{version}-{fmt}',
+                         download_name=f"kms-{child['name'].replace(' ', '-')}.{fmt}")
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/children/<int:child_id>/growth/add', methods=['GET','POST'])
 def add_growth(child_id):
@@ -241,14 +724,17 @@ def add_growth(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id,name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
     if request.method=='POST':
-        record_date = request.form['record_date']
+        try:
+            record_date = dates.normalize(request.form['record_date'])
+        except dates.DateError as e:
+            flash(str(e))
+            return render_template('add_growth.html', child=child)
         weight = request.form['weight']
         height = request.form['height']
         head_circ = request.form.get('head_circ', '')
@@ -256,6 +742,8 @@ def add_growth(child_id):
         db.execute('INSERT INTO growth (child_id,record_date,weight,height,head_circ) VALUES (?,?,?,?,?)',
                    (child_id, record_date, weight, height, head_circ if head_circ else None))
         db.commit()
+        activity.record(child_id, child['name'], 'growth',
+                        f'Berat {weight} kg, tinggi {height} cm', user_id)
         flash('Data pertumbuhan berhasil ditambahkan.')
         return redirect(url_for('growth_list', child_id=child_id))
     
@@ -269,14 +757,13 @@ def milestone_list(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id,name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
     # Get milestone records
-    cur = db.execute('SELECT id,milestone,status,noted FROM development WHERE child_id=? ORDER BY id DESC', (child_id,))
+    cur = db.execute('SELECT id,milestone,status,noted,created_at FROM development WHERE child_id=? ORDER BY id DESC', (child_id,))
     milestones = cur.fetchall()
     
     # Calculate progress
@@ -284,7 +771,19 @@ def milestone_list(child_id):
     done = sum(1 for m in milestones if m['status'] == 'done') if milestones else 0
     progress = int((done / total * 100)) if total > 0 else 0
     
-    return render_template('milestone_list.html', child=child, milestones=milestones, progress=progress)
+    # Versioned card URLs, so the browser can cache each card for good
+    theme = milestone_cards.theme_for(session)
+    card_format = milestone_cards.default_format()
+    card_urls = {}
+    for m in milestones:
+        if m['status'] == 'done':
+            data = milestone_cards.card_data(child['name'], m)
+            card_urls[m['id']] = url_for('milestone_card', child_id=child_id, milestone_id=m['id'],
+                                         fmt=card_format, theme=theme,
+                                         v=milestone_cards.card_version(data, theme))
+    
+    return render_template('milestone_list.html', child=child, milestones=milestones, progress=progress,
+                           card_urls=card_urls)
 
 @app.route('/children/<int:child_id>/milestone/add', methods=['GET','POST'])
 def add_milestone(child_id):
@@ -294,8 +793,7 @@ def add_milestone(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id,name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
@@ -305,9 +803,13 @@ def add_milestone(child_id):
         status = request.form['status']
         noted = request.form.get('noted', '')
         
-        db.execute('INSERT INTO development (child_id,milestone,status,noted) VALUES (?,?,?,?)',
-                   (child_id, milestone, status, noted if noted else None))
+        cur = db.execute('INSERT INTO development (child_id,milestone,status,noted) VALUES (?,?,?,?)',
+                          (child_id, milestone, status, noted if noted else None))
         db.commit()
+        if status == 'done':
+            # Same follow-up as ticking it off in the list
+            milestone_cards.prerender_async(app, [cur.lastrowid], milestone_cards.theme_for(session), user_id)
+            activity.record(child_id, child['name'], 'milestone', milestone, user_id)
         flash('Milestone berhasil ditambahkan.')
         return redirect(url_for('milestone_list', child_id=child_id))
     
@@ -321,14 +823,13 @@ def toggle_milestone(child_id, milestone_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
     # Get current milestone status
-    cur = db.execute('SELECT status FROM development WHERE id=? AND child_id=?', (milestone_id, child_id))
+    cur = db.execute('SELECT milestone, status FROM development WHERE id=? AND child_id=?', (milestone_id, child_id))
     milestone = cur.fetchone()
     if not milestone:
         flash('Milestone tidak ditemukan.')
@@ -339,8 +840,40 @@ def toggle_milestone(child_id, milestone_id):
     db.execute('UPDATE development SET status=? WHERE id=?', (new_status, milestone_id))
     db.commit()
     
+    if new_status == 'done':
+        milestone_cards.prerender_async(app, [milestone_id], milestone_cards.theme_for(session), user_id)
+        activity.record(child_id, child['name'], 'milestone', milestone['milestone'], user_id)
+    
     return redirect(url_for('milestone_list', child_id=child_id))
 
+
+@app.route('/children/<int:child_id>/milestone/<int:milestone_id>/card.<fmt>')
+def milestone_card(child_id, milestone_id, fmt):
+    """Shareable milestone card image, rendered and cached on the server."""
+    db = get_db()
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    if fmt not in milestone_cards.MIMETYPES or (fmt == 'png' and not milestone_cards.png_available()):
+        abort(404)
+    
+    if not owned_child(db, child_id, user_id, 'id'):
+        abort(404)
+    data = milestone_cards.load_card_data(db, milestone_id, child_id)
+    if not data:
+        abort(404)
+    
+    theme = milestone_cards.theme_for(session, request.args.get('theme'))
+    path = milestone_cards.get_card(data, theme, fmt)
+    response = send_file(path, mimetype=milestone_cards.MIMETYPES[fmt], conditional=True,
+                         download_name=f"milestone-{data['child_name'].replace(' ', '-')}.{fmt}")
+    # A URL carrying the current version never changes content
+    if request.args.get('v') == milestone_cards.card_version(data, theme):
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/children/<int:child_id>/immunization')
 def immunization_list(child_id):
     db = get_db()
@@ -349,21 +882,24 @@ def immunization_list(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id,name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
     # Get immunization records
-    cur = db.execute('SELECT id,vaccine,date_given,status FROM immunization WHERE child_id=? ORDER BY date_given DESC', (child_id,))
+    cur = db.execute('''
+        SELECT id,vaccine,scheduled_date,date_given,status FROM immunization
+        WHERE child_id=? ORDER BY scheduled_date IS NULL, scheduled_date, date_given
+    ''', (child_id,))
     vaccinations = cur.fetchall()
     
     # Calculate status
     total = len(vaccinations)
     done = sum(1 for v in vaccinations if v['status'] == 'done') if vaccinations else 0
     
-    return render_template('immunization_list.html', child=child, vaccinations=vaccinations, total=total, done=done)
+    return render_template('immunization_list.html', child=child, vaccinations=vaccinations,
+                           total=total, done=done, today=date.today().isoformat())
 
 @app.route('/children/<int:child_id>/immunization/add', methods=['GET','POST'])
 def add_immunization(child_id):
@@ -373,19 +909,21 @@ def add_immunization(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id,name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
     if request.method=='POST':
         vaccine = request.form['vaccine']
-        date_given = request.form['date_given']
         status = request.form['status']
+        try:
+            date_given = dates.normalize(request.form['date_given'], required=(status == 'done'))
+        except dates.DateError as e:
+            flash(str(e))
+            return render_template('add_immunization.html', child=child)
         
-        db.execute('INSERT INTO immunization (child_id,vaccine,date_given,status) VALUES (?,?,?,?)',
-                   (child_id, vaccine, date_given, status))
+        record_doses(db, [(child_id, vaccine, date_given, status)])
         db.commit()
         flash('Vaksinasi berhasil ditambahkan.')
         return redirect(url_for('immunization_list', child_id=child_id))
@@ -400,8 +938,7 @@ def toggle_immunization(child_id, vacc_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id, 'id')
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
@@ -420,6 +957,64 @@ def toggle_immunization(child_id, vacc_id):
     
     return redirect(url_for('immunization_list', child_id=child_id))
 
+# ==================== BULK ENTRY ROUTES ====================
+
+@app.route('/bulk/<kind>', methods=['GET', 'POST'])
+def bulk_entry(kind):
+    """Enter many growth/milestone/immunization rows for many children at once."""
+    db = get_db()
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    
+    if kind not in BULK_KINDS:
+        flash('Jenis data tidak dikenali.')
+        return redirect(url_for('children'))
+    
+    # One ownership query for the whole batch instead of one per row
+    cur = db.execute('SELECT id, name FROM children WHERE user_id=? ORDER BY name', (user_id,))
+    children_list = cur.fetchall()
+    if not children_list:
+        flash('Tambahkan anak terlebih dahulu.')
+        return redirect(url_for('add_child'))
+    
+    result = None
+    if request.method == 'POST':
+        resolver = ChildResolver(children_list)
+        upload = request.files.get('csv_file')
+        if upload and upload.filename:
+            rows = iter_csv_rows(upload.stream)
+        else:
+            rows = iter_form_rows(request.form, kind)
+        per_child = {}
+        inserted, errors = insert_rows(db, kind, rows, resolver, per_child)
+        result = {'inserted': inserted, 'errors': errors}
+        if kind == 'growth':
+            # One feed event per child rather than one per measurement
+            for child_id, count in per_child.items():
+                activity.record(child_id, resolver.by_id[child_id], 'growth',
+                                f'{count} data pertumbuhan baru dari posyandu', user_id)
+        if inserted:
+            flash(f'✅ {inserted} data {BULK_KINDS[kind]["label"].lower()} berhasil disimpan.')
+        if errors:
+            flash(f'⚠️ {len(errors)} baris tidak disimpan, periksa daftar kesalahan.')
+    
+    return render_template('bulk_entry.html',
+                          kind=kind,
+                          kinds=BULK_KINDS,
+                          children=children_list,
+                          result=result)
+
+
+@app.route('/bulk/<kind>/template.csv')
+def bulk_template(kind):
+    """Download an example CSV for bulk upload."""
+    if kind not in BULK_KINDS:
+        return redirect(url_for('children'))
+    response = Response(csv_template(kind), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=babygrow-{kind}.csv'
+    return response
+
 # ==================== TIME CAPSULE ROUTES ====================
 
 @app.route('/capsule')
@@ -432,13 +1027,13 @@ def capsule_list():
     
     # Get all capsules with child info
     cur = db.execute('''
-        SELECT tc.*, c.name as child_name 
+        SELECT tc.*, c.name as child_name, tc.unlock_day - ? AS days_left
         FROM time_capsules tc
         JOIN children c ON tc.child_id = c.id
         WHERE c.user_id = ?
         ORDER BY tc.created_at DESC
-    ''', (user_id,))
-    capsules = cur.fetchall()
+    ''', (dates.today_day(), user_id))
+    capsules = stream(cur)
     
     return render_template('capsule_list.html', capsules=capsules)
 
@@ -463,7 +1058,11 @@ def capsule_create():
         child_id = request.form['child_id']
         title = request.form['title']
         letter_content = request.form['letter_content']
-        unlock_date = request.form['unlock_date']
+        try:
+            unlock_date = dates.normalize(request.form['unlock_date'])
+        except dates.DateError as e:
+            flash(str(e))
+            return render_template('capsule_create.html', children=children_list)
         unlock_occasion = request.form.get('unlock_occasion', '')
         
         db.execute('''
@@ -478,6 +1077,16 @@ def capsule_create():
     return render_template('capsule_create.html', children=children_list)
 
 
+def _unlock_day(capsule):
+    """Epoch day a capsule opens; rows with a legacy unparsable date stay locked."""
+    if capsule['unlock_day'] is not None:
+        return capsule['unlock_day']
+    try:
+        return dates.to_day(capsule['unlock_date'])
+    except dates.DateError:
+        return float('inf')
+
+
 @app.route('/capsule/<int:capsule_id>')
 def capsule_view(capsule_id):
     """View a time capsule."""
@@ -487,13 +1096,7 @@ def capsule_view(capsule_id):
         return redirect(url_for('login'))
     
     # Get capsule with ownership check
-    cur = db.execute('''
-        SELECT tc.*, c.name as child_name 
-        FROM time_capsules tc
-        JOIN children c ON tc.child_id = c.id
-        WHERE tc.id = ? AND c.user_id = ?
-    ''', (capsule_id, user_id))
-    capsule = cur.fetchone()
+    capsule = owned_capsule(db, capsule_id, user_id, 'tc.*, c.name AS child_name')
     
     if not capsule:
         flash('Kapsul tidak ditemukan.')
@@ -504,13 +1107,10 @@ def capsule_view(capsule_id):
     media = cur.fetchall()
     
     # Check if sealed and not yet unlockable
-    from datetime import datetime
-    is_sealed = capsule['is_sealed'] if isinstance(capsule, dict) else capsule[7]
-    unlock_date_str = capsule['unlock_date'] if isinstance(capsule, dict) else capsule[4]
+    is_sealed = capsule['is_sealed']
     
     if is_sealed:
-        unlock_date = datetime.strptime(unlock_date_str, '%Y-%m-%d')
-        can_open = datetime.now() >= unlock_date
+        can_open = _unlock_day(capsule) <= dates.today_day()
         return render_template('capsule_sealed.html', capsule=capsule, media=media, can_open=can_open)
     
     return render_template('capsule_edit.html', capsule=capsule, media=media)
@@ -525,25 +1125,24 @@ def capsule_update(capsule_id):
         return redirect(url_for('login'))
     
     # Verify ownership and not sealed
-    cur = db.execute('''
-        SELECT tc.is_sealed FROM time_capsules tc
-        JOIN children c ON tc.child_id = c.id
-        WHERE tc.id = ? AND c.user_id = ?
-    ''', (capsule_id, user_id))
-    capsule = cur.fetchone()
+    capsule = owned_capsule(db, capsule_id, user_id, 'tc.is_sealed')
     
     if not capsule:
         flash('Kapsul tidak ditemukan.')
         return redirect(url_for('capsule_list'))
     
-    is_sealed = capsule['is_sealed'] if isinstance(capsule, dict) else capsule[0]
+    is_sealed = capsule['is_sealed']
     if is_sealed:
         flash('Kapsul sudah disegel, tidak bisa diedit.')
         return redirect(url_for('capsule_view', capsule_id=capsule_id))
     
     title = request.form['title']
     letter_content = request.form['letter_content']
-    unlock_date = request.form['unlock_date']
+    try:
+        unlock_date = dates.normalize(request.form['unlock_date'])
+    except dates.DateError as e:
+        flash(str(e))
+        return redirect(url_for('capsule_view', capsule_id=capsule_id))
     unlock_occasion = request.form.get('unlock_occasion', '')
     
     db.execute('''
@@ -567,7 +1166,7 @@ def capsule_seal(capsule_id):
     
     # Verify ownership
     cur = db.execute('''
-        SELECT tc.id FROM time_capsules tc
+        SELECT tc.id, tc.child_id, tc.title, c.name AS child_name FROM time_capsules tc
         JOIN children c ON tc.child_id = c.id
         WHERE tc.id = ? AND c.user_id = ? AND tc.is_sealed = 0
     ''', (capsule_id, user_id))
@@ -577,11 +1176,11 @@ def capsule_seal(capsule_id):
         flash('Kapsul tidak ditemukan atau sudah disegel.')
         return redirect(url_for('capsule_list'))
     
-    from datetime import datetime
     db.execute('''
         UPDATE time_capsules SET is_sealed = 1, sealed_at = ? WHERE id = ?
     ''', (datetime.now().isoformat(), capsule_id))
     db.commit()
+    activity.record(capsule['child_id'], capsule['child_name'], 'capsule_sealed', capsule['title'], user_id)
     
     flash('🔒 Kapsul waktu berhasil disegel! Akan terbuka pada tanggal yang ditentukan.')
     return redirect(url_for('capsule_view', capsule_id=capsule_id))
@@ -597,7 +1196,7 @@ def capsule_open(capsule_id):
     
     # Verify ownership and unlock date
     cur = db.execute('''
-        SELECT tc.* FROM time_capsules tc
+        SELECT tc.*, c.name AS child_name FROM time_capsules tc
         JOIN children c ON tc.child_id = c.id
         WHERE tc.id = ? AND c.user_id = ? AND tc.is_sealed = 1
     ''', (capsule_id, user_id))
@@ -607,11 +1206,7 @@ def capsule_open(capsule_id):
         flash('Kapsul tidak ditemukan.')
         return redirect(url_for('capsule_list'))
     
-    from datetime import datetime
-    unlock_date_str = capsule['unlock_date'] if isinstance(capsule, dict) else capsule[4]
-    unlock_date = datetime.strptime(unlock_date_str, '%Y-%m-%d')
-    
-    if datetime.now() < unlock_date:
+    if _unlock_day(capsule) > dates.today_day():
         flash('Belum waktunya membuka kapsul ini! 🔒')
         return redirect(url_for('capsule_view', capsule_id=capsule_id))
     
@@ -619,6 +1214,11 @@ def capsule_open(capsule_id):
         UPDATE time_capsules SET opened_at = ? WHERE id = ?
     ''', (datetime.now().isoformat(), capsule_id))
     db.commit()
+    if not capsule['opened_at']:
+        activity.record(capsule['child_id'], capsule['child_name'], 'capsule_opened',
+                        capsule['title'], user_id)
+    # Normally rehydrated ahead of the unlock date; catch up if the job lagged
+    cold_storage.rehydrate_capsule(db, capsule_id)
     
     return redirect(url_for('capsule_opened', capsule_id=capsule_id))
 
@@ -658,26 +1258,19 @@ def capsule_delete(capsule_id):
         return redirect(url_for('login'))
     
     # Verify ownership and not sealed
-    cur = db.execute('''
-        SELECT tc.is_sealed FROM time_capsules tc
-        JOIN children c ON tc.child_id = c.id
-        WHERE tc.id = ? AND c.user_id = ?
-    ''', (capsule_id, user_id))
-    capsule = cur.fetchone()
+    capsule = owned_capsule(db, capsule_id, user_id, 'tc.is_sealed')
     
     if not capsule:
         flash('Kapsul tidak ditemukan.')
         return redirect(url_for('capsule_list'))
     
-    is_sealed = capsule['is_sealed'] if isinstance(capsule, dict) else capsule[0]
+    is_sealed = capsule['is_sealed']
     if is_sealed:
         flash('Kapsul yang sudah disegel tidak bisa dihapus.')
         return redirect(url_for('capsule_list'))
     
-    # Delete media first, then capsule
-    db.execute('DELETE FROM capsule_media WHERE capsule_id = ?', (capsule_id,))
-    db.execute('DELETE FROM time_capsules WHERE id = ?', (capsule_id,))
-    db.commit()
+    # Media rows and capsule together; files are removed by the janitor job
+    purge.purge_capsule(db, capsule_id)
     
     flash('Kapsul berhasil dihapus.')
     return redirect(url_for('capsule_list'))
@@ -692,18 +1285,13 @@ def capsule_upload_media(capsule_id):
         return redirect(url_for('login'))
     
     # Verify ownership and not sealed
-    cur = db.execute('''
-        SELECT tc.is_sealed FROM time_capsules tc
-        JOIN children c ON tc.child_id = c.id
-        WHERE tc.id = ? AND c.user_id = ?
-    ''', (capsule_id, user_id))
-    capsule = cur.fetchone()
+    capsule = owned_capsule(db, capsule_id, user_id, 'tc.is_sealed')
     
     if not capsule:
         flash('Kapsul tidak ditemukan.')
         return redirect(url_for('capsule_list'))
     
-    is_sealed = capsule['is_sealed'] if isinstance(capsule, dict) else capsule[0]
+    is_sealed = capsule['is_sealed']
     if is_sealed:
         flash('Kapsul sudah disegel, tidak bisa menambah media.')
         return redirect(url_for('capsule_view', capsule_id=capsule_id))
@@ -718,31 +1306,29 @@ def capsule_upload_media(capsule_id):
         return redirect(url_for('capsule_view', capsule_id=capsule_id))
     
     if file:
-        import os
-        from werkzeug.utils import secure_filename
-        from datetime import datetime
-        
-        # Create upload folder
-        upload_folder = os.path.join(os.path.dirname(__file__), 'static', 'uploads', 'capsules')
-        os.makedirs(upload_folder, exist_ok=True)
-        
+        size = storage.upload_size(file)
+        try:
+            storage.check_quota(db, user_id, size)
+        except storage.QuotaExceeded as e:
+            flash(str(e))
+            return redirect(url_for('capsule_view', capsule_id=capsule_id))
+
         # Generate unique filename
         filename = secure_filename(file.filename)
         ext = filename.rsplit('.', 1)[-1] if '.' in filename else 'jpg'
-        unique_filename = f"capsule_{capsule_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{ext}"
-        filepath = os.path.join(upload_folder, unique_filename)
+        key = f"capsules/capsule_{capsule_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{ext}"
         
-        # Save file
-        file.save(filepath)
+        # Save file (streamed to the media store)
+        size = media_store.get_store().save(key, file.stream, file.mimetype)
         
         # Save to database
-        file_url = f"/static/uploads/capsules/{unique_filename}"
+        file_url = media_store.key_to_url(key)
         caption = request.form.get('caption', '')
         
         db.execute('''
-            INSERT INTO capsule_media (capsule_id, media_type, file_url, caption)
-            VALUES (?, 'photo', ?, ?)
-        ''', (capsule_id, file_url, caption))
+            INSERT INTO capsule_media (capsule_id, media_type, file_url, caption, size_bytes)
+            VALUES (?, 'photo', ?, ?, ?)
+        ''', (capsule_id, file_url, caption, size))
         db.commit()
         
         flash('📸 Foto berhasil ditambahkan!')
@@ -775,9 +1361,14 @@ def settings():
     ''', (user_id,))
     total_capsules = cur.fetchone()[0]
     
+    used = storage.usage(db, user_id)['bytes']
+    
     if request.method == 'POST':
         # Handle theme change
         theme = request.form.get('theme', 'peach')
+        if theme not in milestone_cards.PALETTES:
+            flash('Tema tidak dikenal.')
+            return redirect(url_for('settings'))
         session['theme'] = theme
         flash('Pengaturan berhasil disimpan! ✨')
         return redirect(url_for('settings'))
@@ -788,6 +1379,10 @@ def settings():
                           user=user,
                           total_children=total_children,
                           total_capsules=total_capsules,
+                          storage_used=storage.format_size(used),
+                          storage_quota_mb=storage.STORAGE_QUOTA_MB,
+                          storage_percent=min(100, round(100 * used / (storage.STORAGE_QUOTA_MB * storage.MB)))
+                          if storage.STORAGE_QUOTA_MB else None,
                           current_theme=current_theme)
 
 
@@ -802,27 +1397,18 @@ def capsule_audio(capsule_id):
         return redirect(url_for('login'))
     
     # Verify ownership and not sealed
-    cur = db.execute('''
-        SELECT tc.id, tc.is_sealed FROM time_capsules tc
-        JOIN children c ON tc.child_id = c.id
-        WHERE tc.id = ? AND c.user_id = ?
-    ''', (capsule_id, user_id))
-    capsule = cur.fetchone()
+    capsule = owned_capsule(db, capsule_id, user_id)
     
     if not capsule:
         flash('Kapsul tidak ditemukan.')
         return redirect(url_for('capsule_list'))
     
-    is_sealed = capsule['is_sealed'] if isinstance(capsule, dict) else capsule[1]
+    is_sealed = capsule['is_sealed']
     if is_sealed:
         flash('Kapsul sudah disegel, tidak bisa menambah rekaman.')
         return redirect(url_for('capsule_view', capsule_id=capsule_id))
     
     if request.method == 'POST':
-        import os
-        import base64
-        from datetime import datetime
-        
         audio_data = request.form.get('audio_data', '')
         audio_title = request.form.get('audio_title', 'Rekaman')
         
@@ -830,34 +1416,33 @@ def capsule_audio(capsule_id):
             # Extract base64 data
             header, encoded = audio_data.split(',', 1)
             audio_bytes = base64.b64decode(encoded)
-            
-            # Create upload folder
-            upload_folder = os.path.join(os.path.dirname(__file__), 'static', 'uploads', 'audio')
-            os.makedirs(upload_folder, exist_ok=True)
+            try:
+                storage.check_quota(db, user_id, len(audio_bytes))
+            except storage.QuotaExceeded as e:
+                flash(str(e))
+                return redirect(url_for('capsule_view', capsule_id=capsule_id))
             
             # Generate unique filename
-            unique_filename = f"audio_{capsule_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.webm"
-            filepath = os.path.join(upload_folder, unique_filename)
+            key = f"audio/audio_{capsule_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.webm"
             
             # Save file
-            with open(filepath, 'wb') as f:
-                f.write(audio_bytes)
+            media_store.get_store().save(key, io.BytesIO(audio_bytes), 'audio/webm')
             
             # Save to database
-            file_url = f"/static/uploads/audio/{unique_filename}"
+            file_url = media_store.key_to_url(key)
             
-            db.execute('''
-                INSERT INTO capsule_media (capsule_id, media_type, file_url, caption)
-                VALUES (?, 'audio', ?, ?)
-            ''', (capsule_id, file_url, audio_title))
+            cur = db.execute('''
+                INSERT INTO capsule_media (capsule_id, media_type, file_url, caption, size_bytes)
+                VALUES (?, 'audio', ?, ?, ?)
+            ''', (capsule_id, file_url, audio_title, len(audio_bytes)))
             db.commit()
+            audio_pipeline.process_async(app, cur.lastrowid, user_id)
             
             flash('🎙️ Rekaman suara berhasil ditambahkan!')
             return redirect(url_for('capsule_view', capsule_id=capsule_id))
         else:
             flash('Tidak ada rekaman yang valid.')
     
-    from datetime import date
     return render_template('audio_recorder.html', 
                           capsule_id=capsule_id,
                           today=date.today().isoformat())
@@ -874,26 +1459,17 @@ def export_immunization_calendar(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT name, birth_date FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id, 'name')
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
-    child_name = child['name'] if isinstance(child, dict) else child[0]
+    child_name = child['name']
     
     # Get upcoming vaccinations (not completed)
-    cur = db.execute('''
-        SELECT vaccine_name, scheduled_date 
-        FROM vaccinations 
-        WHERE child_id = ? AND status != 'completed'
-        ORDER BY scheduled_date
-    ''', (child_id,))
-    vaccinations = cur.fetchall()
+    vaccinations = due_doses(db, date.today().isoformat(), '9999-12-31', child_id=child_id)
     
     # Generate iCalendar content
-    from datetime import datetime, timedelta
-    
     ics_content = """BEGIN:VCALENDAR
 VERSION:2.0
 PRODID:-//BabyGrow//Immunization Schedule//ID
@@ -903,14 +1479,10 @@ X-WR-CALNAME:Jadwal Imunisasi - {child_name}
 """.format(child_name=child_name)
     
     for vacc in vaccinations:
-        vaccine_name = vacc['vaccine_name'] if isinstance(vacc, dict) else vacc[0]
-        scheduled_date = vacc['scheduled_date'] if isinstance(vacc, dict) else vacc[1]
+        vaccine_name = vacc['vaccine']
+        scheduled_date = vacc['scheduled_date']
         
-        # Parse date
-        if isinstance(scheduled_date, str):
-            date_obj = datetime.strptime(scheduled_date, '%Y-%m-%d')
-        else:
-            date_obj = scheduled_date
+        date_obj = dates.parse(scheduled_date)
         
         # Create reminder 3 days before
         reminder_date = date_obj - timedelta(days=3)
@@ -937,14 +1509,127 @@ END:VEVENT
     ics_content += "END:VCALENDAR"
     
     # Return as downloadable file
-    from flask import Response
     response = Response(ics_content, mimetype='text/calendar')
     response.headers['Content-Disposition'] = f'attachment; filename=imunisasi-{child_name.replace(" ", "_")}.ics'
     return response
 
 
+# ==================== PUSH NOTIFICATION ROUTES ====================
+
+@app.route('/push/vapid-public-key')
+def push_vapid_public_key():
+    """Public key the browser needs to create a push subscription."""
+    return jsonify({'publicKey': VAPID_PUBLIC_KEY})
+
+
+@app.route('/push/subscribe', methods=['POST'])
+def push_subscribe_route():
+    """Store the browser's PushSubscription for the logged-in user."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'login required'}), 401
+    subscription = request.get_json(silent=True) or {}
+    try:
+        push_subscribe(get_db(), user_id, subscription, request.headers.get('User-Agent', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'ok': True})
+
+
+@app.route('/push/unsubscribe', methods=['POST'])
+def push_unsubscribe_route():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'login required'}), 401
+    subscription = request.get_json(silent=True) or {}
+    push_unsubscribe(get_db(), user_id, subscription.get('endpoint', ''))
+    return jsonify({'ok': True})
+
+
+# ==================== POSYANDU ROUTES ====================
+
+@app.route('/posyandu')
+def posyandu():
+    """The coordinator's groups; straight to the roster when there is one."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    groups = roster.coordinated_groups(get_catalog_db(), user_id)
+    if not groups:
+        flash('Anda belum menjadi koordinator posyandu.')
+        return redirect(url_for('dashboard'))
+    return redirect(url_for('posyandu_roster', group_id=groups[0]['id']))
+
+
+@app.route('/posyandu/<int:group_id>')
+def posyandu_roster(group_id):
+    """Every child of a posyandu group: growth, overdue vaccines, milestones."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    catalog = get_catalog_db()
+    group = roster.coordinated_group(catalog, group_id, user_id)
+    if not group:
+        abort(404)
+    groups = roster.coordinated_groups(catalog, user_id)
+    
+    sort = request.args.get('sort', roster.DEFAULT_SORT)
+    if sort not in roster.SORTS:
+        sort = roster.DEFAULT_SORT
+    entries, cursor, summary = roster.page(group_id, sort, request.args.get('after'),
+                                           request.args.get('size', type=int))
+    return render_template('posyandu_roster.html', group=group, groups=groups, entries=entries,
+                           cursor=cursor, summary=summary, sort=sort, sorts=roster.SORTS,
+                           stale_days=roster.ROSTER_STALE_DAYS)
+
+
+@app.route('/api/posyandu/<int:group_id>/roster')
+def posyandu_roster_api(group_id):
+    """The roster as JSON, same pagination (?sort=, ?after=, ?size=)."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'login required'}), 401
+    if not roster.coordinated_group(get_catalog_db(), group_id, user_id):
+        return jsonify({'error': 'not found'}), 404
+    entries, cursor, summary = roster.page(group_id, request.args.get('sort', roster.DEFAULT_SORT),
+                                           request.args.get('after'), request.args.get('size', type=int))
+    return jsonify({'children': entries, 'next': cursor, 'summary': summary})
+
+
 # ==================== FAMILY ACCESS ROUTES ====================
 
+@app.route('/activity')
+def activity_feed():
+    """What changed for the children other families shared with the user."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    
+    catalog = get_catalog_db()
+    before = request.args.get('before', type=int)
+    # Flashed messages are part of the page but not of the validator
+    etag = None
+    if not session.get('_flashes'):
+        etag = activity.feed_etag(catalog, user_id, before,
+                                  f"{session.get('theme', '')}:{template_version()}")
+        if etag in request.if_none_match:
+            activity.seen(catalog, user_id)
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+    
+    events, next_before = activity.page(catalog, user_id, before)
+    response = app.make_response(render_template('activity_feed.html',
+                                                 events=events,
+                                                 icons=activity.KINDS,
+                                                 next_before=next_before))
+    if etag:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @app.route('/child/<int:child_id>/family', methods=['GET'])
 def family_access(child_id):
     """Manage family access for a child."""
@@ -954,8 +1639,7 @@ def family_access(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id, name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
@@ -968,39 +1652,14 @@ def family_access(child_id):
         WHERE fa.child_id = ?
         ORDER BY fa.created_at DESC
     ''', (child_id,))
-    access_list = cur.fetchall()
-    
-    # Convert to list of dicts for template and get invite urls
-    access_list_with_urls = []
-    for access in access_list:
-        if isinstance(access, dict):
-            item = dict(access)
-        else:
-            # Convert sqlite Row to dict
-            item = {
-                'id': access[0],
-                'child_id': access[1],
-                'user_id': access[2],
-                'invite_code': access[3],
-                'invite_email': access[4],
-                'role': access[5],
-                'status': access[6],
-                'invited_by': access[7],
-                'accepted_at': access[8],
-                'created_at': access[9],
-                'username': access[10] if len(access) > 10 else None
-            }
-        # Add invite URL
-        item['invite_url'] = request.host_url + f"join/{item['invite_code']}"
-        access_list_with_urls.append(item)
+    access_list = stream(cur)
     
     # Show example invite URL (will be populated when user invites someone)
     example_url = request.host_url + 'join/...'
     
     return render_template('family_access.html',
-                          child={'id': child['id'] if isinstance(child, dict) else child[0],
-                                'name': child['name'] if isinstance(child, dict) else child[1]},
-                          access_list=access_list_with_urls,
+                          child=child,
+                          access_list=access_list,
                           invite_url=example_url)
 
 
@@ -1013,8 +1672,7 @@ def invite_family(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    if not cur.fetchone():
+    if not owned_child(db, child_id, user_id, 'id'):
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
@@ -1026,7 +1684,6 @@ def invite_family(child_id):
         return redirect(url_for('family_access', child_id=child_id))
     
     # Generate invite code
-    import secrets
     invite_code = secrets.token_urlsafe(16)
     
     # Check if already invited
@@ -1041,6 +1698,10 @@ def invite_family(child_id):
         VALUES (?, ?, ?, ?, ?)
     ''', (child_id, invite_code, email, role, user_id))
     db.commit()
+    if DB_SHARDING:
+        # Lets join_family find the invite from any shard
+        catalog = get_catalog_db()
+        sharding.route_invite(catalog, invite_code, sharding.lookup(catalog, user_id)[0])
     
     flash(f'✉️ Undangan berhasil dikirim ke {email}!')
     return redirect(url_for('family_access', child_id=child_id))
@@ -1054,8 +1715,19 @@ def revoke_access(child_id, access_id):
     if not user_id:
         return redirect(url_for('login'))
     
+    # Verify ownership
+    if not owned_child(db, child_id, user_id, 'id'):
+        flash('Anak tidak ditemukan.')
+        return redirect(url_for('children'))
+    
+    access = db.execute('SELECT user_id FROM family_access WHERE id=? AND child_id=?',
+                        (access_id, child_id)).fetchone()
     db.execute('DELETE FROM family_access WHERE id=? AND child_id=?', (access_id, child_id))
     db.commit()
+    if access and access['user_id']:
+        catalog = get_catalog_db()
+        activity.unfollow(catalog, access['user_id'], child_id)
+        catalog.commit()
     
     flash('Akses berhasil dicabut.')
     return redirect(url_for('family_access', child_id=child_id))
@@ -1072,6 +1744,13 @@ def join_family(invite_code):
         session['pending_invite'] = invite_code
         return redirect(url_for('login'))
     
+    if DB_SHARDING:
+        # The invite lives in the inviting family's shard
+        invite_db = sharding.connect_for_invite(get_catalog_db(), invite_code)
+        if invite_db is not None:
+            use_database(invite_db)
+            db = invite_db
+    
     # Find invite
     cur = db.execute('''
         SELECT fa.*, c.name as child_name 
@@ -1086,15 +1765,20 @@ def join_family(invite_code):
         return redirect(url_for('dashboard'))
     
     # Accept invite
-    from datetime import datetime
     db.execute('''
         UPDATE family_access 
         SET user_id = ?, status = 'accepted', accepted_at = ?
         WHERE invite_code = ?
     ''', (user_id, datetime.now().isoformat(), invite_code))
+    if DB_SHARDING:
+        # So the family page can show the new member's name
+        sharding.share_user_row(get_catalog_db(), db, user_id)
     db.commit()
+    catalog = get_catalog_db()
+    activity.follow(catalog, user_id, invite['child_id'])
+    catalog.commit()
     
-    child_name = invite['child_name'] if isinstance(invite, dict) else invite[-1]
+    child_name = invite['child_name']
     flash(f'🎉 Selamat! Anda sekarang bisa melihat data {child_name}.')
     return redirect(url_for('dashboard'))
 
@@ -1110,23 +1794,21 @@ def scheduled_letters(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id, name FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id)
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
     
     # Get letters
     cur = db.execute('''
-        SELECT * FROM scheduled_letters 
+        SELECT *, unlock_day - ? AS days_left FROM scheduled_letters 
         WHERE child_id = ? AND user_id = ?
-        ORDER BY unlock_date ASC
-    ''', (child_id, user_id))
-    letters = cur.fetchall()
+        ORDER BY unlock_day ASC
+    ''', (dates.today_day(), child_id, user_id))
+    letters = stream(cur)
     
     return render_template('scheduled_letters.html',
-                          child={'id': child['id'] if isinstance(child, dict) else child[0],
-                                'name': child['name'] if isinstance(child, dict) else child[1]},
+                          child=child,
                           letters=letters)
 
 
@@ -1146,6 +1828,11 @@ def create_scheduled_letter(child_id):
     if not title or not content or not unlock_date:
         flash('Semua field wajib diisi.')
         return redirect(url_for('scheduled_letters', child_id=child_id))
+    try:
+        unlock_date = dates.normalize(unlock_date)
+    except dates.DateError as e:
+        flash(str(e))
+        return redirect(url_for('scheduled_letters', child_id=child_id))
     
     db.execute('''
         INSERT INTO scheduled_letters (child_id, user_id, title, content, unlock_date, unlock_occasion)
@@ -1168,8 +1855,7 @@ def health_insights(child_id):
         return redirect(url_for('login'))
     
     # Verify ownership
-    cur = db.execute('SELECT id, name, dob, gender FROM children WHERE id=? AND user_id=?', (child_id, user_id))
-    child = cur.fetchone()
+    child = owned_child(db, child_id, user_id, 'id, name, dob, gender')
     if not child:
         flash('Anak tidak ditemukan.')
         return redirect(url_for('children'))
@@ -1179,7 +1865,7 @@ def health_insights(child_id):
         SELECT record_date, weight, height, head_circ 
         FROM growth 
         WHERE child_id = ? 
-        ORDER BY record_date DESC
+        ORDER BY record_day DESC
         LIMIT 10
     ''', (child_id,))
     growth_records = cur.fetchall()
@@ -1191,8 +1877,8 @@ def health_insights(child_id):
         latest = growth_records[0]
         previous = growth_records[1]
         
-        latest_weight = float(latest['weight'] if isinstance(latest, dict) else latest[1])
-        prev_weight = float(previous['weight'] if isinstance(previous, dict) else previous[1])
+        latest_weight = float(latest['weight'])
+        prev_weight = float(previous['weight'])
         weight_change = latest_weight - prev_weight
         
         if weight_change > 0:
@@ -1212,8 +1898,8 @@ def health_insights(child_id):
                 'suggestion': 'Pastikan asupan nutrisi mencukupi. Konsultasi dengan dokter jika berlanjut.'
             })
         
-        latest_height = float(latest['height'] if isinstance(latest, dict) else latest[2])
-        prev_height = float(previous['height'] if isinstance(previous, dict) else previous[2])
+        latest_height = float(latest['height'])
+        prev_height = float(previous['height'])
         height_change = latest_height - prev_height
         
         if height_change > 0:
@@ -1235,8 +1921,7 @@ def health_insights(child_id):
     })
     
     return render_template('health_insights.html',
-                          child={'id': child['id'] if isinstance(child, dict) else child[0],
-                                'name': child['name'] if isinstance(child, dict) else child[1]},
+                          child=child,
                           insights=insights,
                           growth_records=growth_records)
 
@@ -0,0 +1,180 @@
+"""
+Static asset pipeline: minify, fingerprint and precompress CSS/JS.
+
+`flask --app app build-assets` writes content-hashed copies of the files in
+SOURCES to static/dist (e.g. css/style.3f2a9c1b0d.css) together with .gz
+and, when the optional `brotli` module is installed, .br variants. A
+manifest maps each source path to its hashed name; templates resolve URLs
+through asset_url() and the service worker precaches the same list from
+static/dist/sw-assets.js. Because a file's URL changes whenever its content
+does, hashed files can be cached for a year as immutable, and the
+precompressed bodies are served as-is instead of compressing per request.
+
+Without a build (local development) asset_url() falls back to the plain
+/static URL, so nothing breaks.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+
+BASE_DIR = os.path.dirname(__file__)
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+SOURCES = [
+    'css/style.css',
+    'js/celebrations.js',
+    'js/milestone-card.js',
+    'js/audio-recorder.js',
+    'js/push.js',
+]
+
+# Files that are cached by the service worker on install
+PRECACHE = ['css/style.css', 'js/celebrations.js']
+
+CONTENT_TYPES = {
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+}
+
+_STRING_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+
+_manifest = None
+
+
+def minify_css(source):
+    """Strip comments and whitespace outside of string literals."""
+    out = []
+    pos = 0
+    for match in _STRING_RE.finditer(source):
+        out.append(_minify_css_code(source[pos:match.start()]))
+        out.append(match.group(0))
+        pos = match.end()
+    out.append(_minify_css_code(source[pos:]))
+    return ''.join(out).strip() + '\n'
+
+
+def _minify_css_code(code):
+    code = re.sub(r'/\*.*?\*/', '', code, flags=re.S)
+    code = re.sub(r'\s+', ' ', code)
+    # Spaces before ':' are kept: "a :hover" differs from "a:hover"
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    code = re.sub(r':\s+', ':', code)
+    return code.replace(';}', '}')
+
+
+def minify_js(source):
+    """Conservative JS minification: comment-only lines and indentation.
+
+    Code is never rewritten, so there is no risk of changing behaviour; lines
+    inside multi-line template literals are kept verbatim.
+    """
+    out = []
+    in_template = False
+    in_block_comment = False
+    for line in source.splitlines():
+        stripped = line.strip()
+        if in_template:
+            out.append(line)
+        elif in_block_comment:
+            if '*/' in stripped:
+                in_block_comment = False
+            continue
+        elif stripped.startswith('/*'):
+            in_block_comment = '*/' not in stripped
+            continue
+        elif not stripped or stripped.startswith('//'):
+            continue
+        else:
+            out.append(stripped)
+        if line.count('`') % 2:
+            in_template = not in_template
+    return '\n'.join(out) + '\n'
+
+
+def _fingerprint(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    root, ext = os.path.splitext(path)
+    return f'{root}.{digest}{ext}'
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def build(log=print):
+    """Build static/dist and return the manifest."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        log('brotli not installed, writing gzip variants only')
+
+    manifest = {}
+    for source in SOURCES:
+        with open(os.path.join(STATIC_DIR, source), encoding='utf-8') as f:
+            text = f.read()
+        minified = minify_css(text) if source.endswith('.css') else minify_js(text)
+        content = minified.encode('utf-8')
+        hashed = _fingerprint(source, content)
+        target = os.path.join(DIST_DIR, hashed)
+        _write(target, content)
+        # mtime=0 keeps the .gz byte-identical between builds
+        _write(target + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli:
+            _write(target + '.br', brotli.compress(content, quality=11))
+        manifest[source] = hashed
+        log(f'{source} -> dist/{hashed} ({len(text.encode())} -> {len(content)} bytes)')
+
+    _write(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+    # Precache list for sw.js; the version changes whenever any asset does
+    version = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:10]
+    precache = [f'/assets/{manifest[p]}' for p in PRECACHE]
+    _write(os.path.join(DIST_DIR, 'sw-assets.js'), (
+        f'self.BABYGROW_ASSETS_VERSION = {json.dumps(version)};\n'
+        f'self.BABYGROW_ASSETS = {json.dumps(precache)};\n').encode())
+
+    global _manifest
+    _manifest = manifest
+    return manifest
+
+
+def load_manifest(reload=False):
+    global _manifest
+    if _manifest is None or reload:
+        try:
+            with open(MANIFEST_PATH, encoding='utf-8') as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def hashed_name(path):
+    """Fingerprinted file name for a source path, or None if not built."""
+    return load_manifest().get(path)
+
+
+def resolve(filename, accept_encoding):
+    """Pick the best precompressed variant of a dist file.
+
+    Returns (absolute_path, content_encoding) or (None, None) if missing.
+    """
+    path = os.path.normpath(os.path.join(DIST_DIR, filename))
+    if not path.startswith(DIST_DIR + os.sep) or not os.path.isfile(path):
+        return None, None
+    if 'br' in accept_encoding and os.path.isfile(path + '.br'):
+        return path + '.br', 'br'
+    if 'gzip' in accept_encoding and os.path.isfile(path + '.gz'):
+        return path + '.gz', 'gzip'
+    return path, None
+
+
+def content_type(filename):
+    return CONTENT_TYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
@@ -0,0 +1,275 @@
+"""
+Background processing of recorded capsule audio.
+
+capsule_audio stores whatever MediaRecorder produced (usually .webm at a
+variable, fairly high bitrate). For each new recording this pipeline:
+
+1. measures its loudness with ffmpeg's loudnorm filter (EBU R128),
+2. transcodes it with the measured values in a second pass (linear
+   normalization to AUDIO_TARGET_LUFS) to mono Opus at AUDIO_BITRATE, tuned
+   for speech, which is several times smaller per minute,
+3. decodes the result once more to compute AUDIO_PEAKS waveform peaks,
+   stored as base64 uint8 in capsule_media.waveform together with the
+   duration and measured loudness, so players render without decoding the
+   file in the browser.
+
+The row then points at the new file and the original is queued for the
+media janitor in the same transaction. ffmpeg is an optional binary: without
+it recordings stay as uploaded and players show no waveform. Work runs on a
+background thread right after an upload and in the `audio-transcode` job,
+which also picks up older recordings and ones that were missed.
+"""
+import base64
+import json
+import logging
+import math
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_db, use_user_database
+from media_store import get_store, url_to_key
+from purge import enqueue_files
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+AUDIO_FFMPEG = os.environ.get('AUDIO_FFMPEG', 'ffmpeg')
+AUDIO_BITRATE = os.environ.get('AUDIO_BITRATE', '24k')
+AUDIO_TARGET_LUFS = float(os.environ.get('AUDIO_TARGET_LUFS', '-16'))
+AUDIO_PEAKS = int(os.environ.get('AUDIO_PEAKS', '160'))
+AUDIO_BATCH = int(os.environ.get('AUDIO_BATCH', '5'))
+AUDIO_TIMEOUT = int(os.environ.get('AUDIO_TIMEOUT', '300'))
+
+# Sample rate the peaks are computed at; plenty for a 160-bar waveform
+PEAK_SAMPLE_RATE = 8000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class AudioError(Exception):
+    pass
+
+
+def available():
+    return shutil.which(AUDIO_FFMPEG) is not None
+
+
+def _ffmpeg(args, capture_stdout=False):
+    cmd = [AUDIO_FFMPEG, '-hide_banner', '-nostdin', '-y'] + args
+    result = subprocess.run(cmd, stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, timeout=AUDIO_TIMEOUT)
+    if result.returncode != 0:
+        tail = result.stderr.decode('utf-8', 'replace').strip().splitlines()[-3:]
+        raise AudioError(' / '.join(tail) or f'ffmpeg exited with {result.returncode}')
+    return result
+
+
+def measure_loudness(path):
+    """First loudnorm pass: the measured input values, or None for silence."""
+    target = f'loudnorm=I={AUDIO_TARGET_LUFS}:TP=-1.5:LRA=11:print_format=json'
+    stderr = _ffmpeg(['-i', path, '-af', target, '-f', 'null', '-']).stderr.decode('utf-8', 'replace')
+    start, end = stderr.rfind('{'), stderr.rfind('}')
+    if start < 0 or end < start:
+        raise AudioError('loudnorm printed no measurements')
+    stats = json.loads(stderr[start:end + 1])
+    if not math.isfinite(float(stats['input_i'])):
+        return None
+    return stats
+
+
+def transcode(src, dest, loudness):
+    """Second pass: normalize with the measured values, encode mono Opus."""
+    filters = []
+    if loudness:
+        filters.append(
+            f"loudnorm=I={AUDIO_TARGET_LUFS}:TP=-1.5:LRA=11"
+            f":measured_I={loudness['input_i']}:measured_TP={loudness['input_tp']}"
+            f":measured_LRA={loudness['input_lra']}:measured_thresh={loudness['input_thresh']}"
+            f":offset={loudness['target_offset']}:linear=true")
+    args = ['-i', src, '-vn']
+    if filters:
+        args += ['-af', ','.join(filters)]
+    args += ['-ac', '1', '-ar', '48000', '-c:a', 'libopus', '-b:a', AUDIO_BITRATE,
+             '-application', 'voip', '-f', 'webm', dest]
+    _ffmpeg(args)
+
+
+def compute_peaks(path, buckets=None):
+    """(peaks as bytes 0-255, duration in ms) of an audio file."""
+    buckets = buckets or AUDIO_PEAKS
+    pcm = _ffmpeg(['-i', path, '-vn', '-ac', '1', '-ar', str(PEAK_SAMPLE_RATE),
+                   '-f', 's16le', '-'], capture_stdout=True).stdout
+    samples = array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    duration_ms = len(samples) * 1000 // PEAK_SAMPLE_RATE
+    if not samples:
+        return b'', 0
+    step = max(1, math.ceil(len(samples) / buckets))
+    peaks = bytearray()
+    for i in range(0, len(samples), step):
+        chunk = samples[i:i + step]
+        peaks.append(min(255, max(max(chunk), -min(chunk)) * 255 // 32767))
+    return bytes(peaks), duration_ms
+
+
+def encode_peaks(peaks):
+    return base64.b64encode(peaks).decode('ascii')
+
+
+def decode_peaks(waveform):
+    """Stored waveform -> list of heights in 0..1, scaled to the loudest bar."""
+    if not waveform:
+        return []
+    peaks = base64.b64decode(waveform)
+    top = max(peaks) or 1
+    return [round(p / top, 3) for p in peaks]
+
+
+def process(db, row):
+    """Transcode one capsule_media row. Returns True if it was processed."""
+    store = get_store()
+    src_key = url_to_key(row['file_url'])
+    if src_key is None:
+        _mark_failed(db, row, 'not an uploaded file')
+        return True
+    # A fresh name per attempt, so a concurrent attempt never touches our file
+    stem = os.path.splitext(row['file_url'])[0].split('~')[0]
+    new_url = f'{stem}~{secrets.token_hex(4)}.webm'
+    new_key = url_to_key(new_url)
+    fd, tmp = tempfile.mkstemp(suffix='.webm')
+    os.close(fd)
+    try:
+        # ffmpeg needs a file; with an S3 store this is a downloaded copy
+        with store.local_copy(src_key) as src:
+            original_size = os.path.getsize(src)
+            loudness = measure_loudness(src)
+            transcode(src, tmp, loudness)
+        peaks, duration_ms = compute_peaks(tmp)
+        size = store.save_file(new_key, tmp, 'audio/webm')
+    except FileNotFoundError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if _in_cold_storage(db, row['file_url']):
+            # Archived meanwhile; picked up again once it is rehydrated
+            return False
+        _mark_failed(db, row, 'file not found')
+        return True
+    except (AudioError, subprocess.TimeoutExpired, OSError, ValueError, KeyError) as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        logger.warning('Transcoding %s failed: %s', row['file_url'], e)
+        _mark_failed(db, row, str(e))
+        return True
+
+    try:
+        cur = db.execute('''
+            UPDATE capsule_media
+            SET file_url=?, audio_status='done', audio_error=NULL, duration_ms=?,
+                loudness_lufs=?, original_size=?, waveform=?, size_bytes=?
+            WHERE id=? AND file_url=?
+        ''', (new_url, duration_ms, float(loudness['input_i']) if loudness else None,
+              original_size, encode_peaks(peaks), size, row['id'], row['file_url']))
+        if cur.rowcount:
+            enqueue_files(db, [row['file_url']])
+        db.commit()
+    except Exception:
+        db.rollback()
+        store.delete(new_key)
+        raise
+    if not cur.rowcount:
+        # Deleted or replaced while we were working
+        store.delete(new_key)
+        return True
+    logger.info('Transcoded %s: %d -> %d bytes, %.1fs', row['file_url'], original_size,
+                size, duration_ms / 1000)
+    return True
+
+
+def _in_cold_storage(db, file_url):
+    return db.execute('SELECT 1 FROM cold_media WHERE file_url = ?', (file_url,)).fetchone() is not None
+
+
+def _mark_failed(db, row, error):
+    db.execute("UPDATE capsule_media SET audio_status='failed', audio_error=? WHERE id=?",
+               (error[:500], row['id']))
+    db.commit()
+
+
+def process_pending(db, limit=None, retry_failed=False):
+    """Process up to `limit` unprocessed recordings. Returns rows handled.
+
+    Recordings sitting in cold storage are skipped until they are
+    rehydrated, so they never hold up the ones behind them.
+    """
+    if not available():
+        return 0
+    status = "(audio_status IS NULL OR audio_status = 'failed')" if retry_failed else 'audio_status IS NULL'
+    rows = db.execute(f'''
+        SELECT id, file_url FROM capsule_media
+        WHERE media_type = 'audio' AND {status}
+          AND file_url NOT IN (SELECT file_url FROM cold_media)
+        ORDER BY id LIMIT ?
+    ''', (limit or AUDIO_BATCH,)).fetchall()
+    return sum(1 for row in rows if process(db, row))
+
+
+def process_async(app, media_id, user_id):
+    """Transcode a fresh recording after the response, on one background thread."""
+    global _executor
+    if not available():
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='babygrow-audio')
+
+    def run():
+        with app.app_context():
+            try:
+                db = use_user_database(user_id)
+                row = db.execute('''
+                    SELECT id, file_url FROM capsule_media WHERE id = ? AND audio_status IS NULL
+                ''', (media_id,)).fetchone()
+                if row:
+                    process(db, row)
+            except Exception:
+                logger.exception('Transcoding recording %s failed', media_id)
+
+    _executor.submit(run)
+
+
+def storage_stats(db):
+    rows = db.execute('''
+        SELECT file_url, original_size, duration_ms FROM capsule_media
+        WHERE media_type = 'audio' AND audio_status = 'done'
+    ''').fetchall()
+    store = get_store()
+    current = 0
+    for row in rows:
+        key = url_to_key(row['file_url'])
+        size = store.size(key) if key else None
+        if size is not None:
+            current += size
+    pending = db.execute('''
+        SELECT COUNT(*) AS n FROM capsule_media
+        WHERE media_type = 'audio' AND (audio_status IS NULL OR audio_status = 'failed')
+    ''').fetchone()
+    return {'done': len(rows), 'original_bytes': sum(r['original_size'] or 0 for r in rows),
+            'current_bytes': current, 'duration_ms': sum(r['duration_ms'] or 0 for r in rows),
+            'pending': pending['n']}
+
+
+@job('audio-transcode', every=60)
+def transcode_job():
+    db = get_db()
+    while process_pending(db) == AUDIO_BATCH:
+        pass
@@ -0,0 +1,387 @@
+"""
+Online backups of the SQLite database(s) and uploaded media.
+
+Databases are copied with SQLite's online backup API, BACKUP_PAGES_PER_STEP
+pages at a time with a BACKUP_STEP_SLEEP pause in between, so requests keep
+their locks short while a backup runs. Copying balita.db with cp while a
+worker writes to it can produce a torn file; the backup API cannot. When
+writes keep restarting a stepped copy it falls back to a single step, which
+in WAL mode only holds a read snapshot.
+
+Media are stored by content hash under BACKUP_DIR/media, so each run only
+copies files it has not seen before; a snapshot's manifest maps every upload
+URL to its hash. Cold-storage packs are backed up the same way, so media
+moved out of static/uploads stay covered. A hash index (path, size,
+mtime -> hash) avoids re-reading unchanged files on every run. With
+MEDIA_STORE=s3 the uploads live in the bucket and are not copied here; turn
+on versioning (or replication) for the bucket instead.
+
+Each snapshot is verified before it is published, and can be re-verified
+later: checksum and integrity_check of every database copy, its row counts
+against those recorded at backup time, and every media hash present in the
+store. Older snapshots are then rotated
+(BACKUP_KEEP_DAILY newest days plus BACKUP_KEEP_WEEKLY weeks) and media no
+snapshot references are deleted.
+
+Layout:
+    BACKUP_DIR/snapshots/20250101T020000Z/manifest.json
+    BACKUP_DIR/snapshots/20250101T020000Z/db/balita.db (and shard files)
+    BACKUP_DIR/media/ab/abcdef...
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+
+from db import DATABASE, DATABASE_DIR, DB_SHARDING, DB_TYPE
+from cold_storage import COLD_STORAGE_DIR
+from media_store import UPLOADS_DIR, UPLOADS_URL_PREFIX
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+# Put this on a different disk than DATABASE_DIR in production
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(DATABASE_DIR, 'backups'))
+BACKUP_INTERVAL = int(os.environ.get('BACKUP_INTERVAL', '86400'))
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', '256'))
+BACKUP_STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', '0.05'))
+BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', '7'))
+BACKUP_KEEP_WEEKLY = int(os.environ.get('BACKUP_KEEP_WEEKLY', '4'))
+# Restarts of a stepped copy (caused by writes) before copying in one step
+BACKUP_MAX_RESTARTS = 3
+
+SNAPSHOT_FORMAT = '%Y%m%dT%H%M%SZ'
+HASH_INDEX = 'media-index.json'
+COLD_PREFIX = 'cold/'
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def snapshots_dir():
+    return os.path.join(BACKUP_DIR, 'snapshots')
+
+
+def media_path(digest):
+    return os.path.join(BACKUP_DIR, 'media', digest[:2], digest)
+
+
+@contextmanager
+def _backup_lock():
+    """One backup at a time, whether from the worker or the CLI."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with open(os.path.join(BACKUP_DIR, 'backup.lock'), 'w') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise BackupError('Another backup is running')
+        yield
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _table_counts(conn):
+    names = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    return {name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0] for name in names}
+
+
+def _databases():
+    """(file name in the snapshot, live path) of every SQLite database."""
+    if DB_TYPE != 'sqlite':
+        return []
+    if not DB_SHARDING:
+        return [('balita.db', DATABASE)]
+    import sharding
+    return [(os.path.basename(sharding.shard_path(name)), sharding.shard_path(name))
+            for name in sharding.existing_shards()]
+
+
+def backup_database(src_path, dest_path):
+    """Copy one live database with the online backup API.
+
+    Returns the table row counts of the copy, taken from the same snapshot.
+    """
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        # A write by another connection restarts the copy from page one
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > BACKUP_MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'] = remaining
+        if remaining:
+            time.sleep(BACKUP_STEP_SLEEP)
+
+    with closing(sqlite3.connect(src_path, timeout=30)) as src:
+        try:
+            with closing(sqlite3.connect(dest_path)) as dest:
+                src.backup(dest, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+        except _Restarted:
+            logger.info('Backup of %s kept restarting, copying in one step', src_path)
+            os.remove(dest_path)
+            with closing(sqlite3.connect(dest_path)) as dest:
+                src.backup(dest, pages=-1)
+    with closing(sqlite3.connect(dest_path)) as dest:
+        # A self-contained file: no -wal next to it when restored
+        dest.execute('PRAGMA journal_mode=DELETE')
+        return _table_counts(dest)
+
+
+def _load_hash_index():
+    try:
+        with open(os.path.join(BACKUP_DIR, HASH_INDEX)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _media_files():
+    """(manifest key, path) of every upload and cold-storage pack."""
+    for top, prefix in ((UPLOADS_DIR, UPLOADS_URL_PREFIX), (COLD_STORAGE_DIR, COLD_PREFIX)):
+        for root, _, files in os.walk(top):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                yield prefix + os.path.relpath(path, top).replace(os.sep, '/'), path
+
+
+def backup_media():
+    """Copy new upload files and packs into the content-addressed store.
+
+    Returns ({key: sha256} for every file, files copied, bytes copied). Keys
+    are upload URLs, or cold/<pack> for cold-storage packs.
+    """
+    old_index = _load_hash_index()
+    index, media = {}, {}
+    copied = copied_bytes = 0
+    for key, path in _media_files():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        known = old_index.get(key)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            digest = known[2]
+        else:
+            digest = _sha256(path)
+        target = media_path(digest)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(path, target + '.tmp')
+            os.replace(target + '.tmp', target)
+            copied += 1
+            copied_bytes += st.st_size
+            time.sleep(BACKUP_STEP_SLEEP)
+        index[key] = [st.st_size, st.st_mtime_ns, digest]
+        media[key] = digest
+    _write_json(os.path.join(BACKUP_DIR, HASH_INDEX), index)
+    return media, copied, copied_bytes
+
+
+def list_snapshots():
+    """Published snapshot names, oldest first."""
+    try:
+        names = os.listdir(snapshots_dir())
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names
+                  if not n.endswith('.partial')
+                  and os.path.exists(os.path.join(snapshots_dir(), n, 'manifest.json')))
+
+
+def load_manifest(name):
+    try:
+        with open(os.path.join(snapshots_dir(), name, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise BackupError(f'No such snapshot: {name}')
+
+
+def verify_snapshot(name, deep=False, path=None):
+    """Problems found in a snapshot; an empty list means it restores cleanly.
+
+    Every database copy must pass integrity_check and hold the row counts
+    recorded at backup time, and every media hash must be in the store.
+    With deep, media files are re-hashed as well.
+    """
+    path = path or os.path.join(snapshots_dir(), name)
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    problems = []
+    for filename, info in manifest['databases'].items():
+        db_path = os.path.join(path, 'db', filename)
+        if not os.path.exists(db_path):
+            problems.append(f'{filename}: missing')
+            continue
+        if _sha256(db_path) != info['sha256']:
+            problems.append(f'{filename}: checksum mismatch')
+            continue
+        with closing(sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)) as conn:
+            result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                problems.append(f'{filename}: integrity_check: {result}')
+                continue
+            if _table_counts(conn) != info['tables']:
+                problems.append(f'{filename}: row counts differ from backup time')
+    for url, digest in manifest['media'].items():
+        stored = media_path(digest)
+        if not os.path.exists(stored):
+            problems.append(f'{url}: missing from media store')
+        elif deep and _sha256(stored) != digest:
+            problems.append(f'{url}: media checksum mismatch')
+    return problems
+
+
+def create_snapshot(log=logger.info):
+    """Back up every database and new media, verify, publish. Returns the name."""
+    with _backup_lock():
+        started = time.monotonic()
+        name = datetime.now(timezone.utc).strftime(SNAPSHOT_FORMAT)
+        partial = os.path.join(snapshots_dir(), name + '.partial')
+        os.makedirs(os.path.join(partial, 'db'), exist_ok=True)
+        try:
+            databases = {}
+            for filename, live_path in _databases():
+                dest = os.path.join(partial, 'db', filename)
+                tables = backup_database(live_path, dest)
+                databases[filename] = {'tables': tables, 'size': os.path.getsize(dest),
+                                       'sha256': _sha256(dest)}
+                log(f'{filename}: {sum(tables.values())} rows, {os.path.getsize(dest)} bytes')
+            if DB_TYPE != 'sqlite':
+                log('DB_TYPE is not sqlite: only media are backed up, use mysqldump for the database')
+
+            media, copied, copied_bytes = backup_media()
+            log(f'media: {len(media)} files, {copied} new ({copied_bytes} bytes)')
+
+            _write_json(os.path.join(partial, 'manifest.json'), {
+                'created_at': name,
+                'db_type': DB_TYPE,
+                'databases': databases,
+                'media': media,
+            })
+            problems = verify_snapshot(name, path=partial)
+            if problems:
+                raise BackupError('Verification failed: ' + '; '.join(problems[:10]))
+            os.rename(partial, os.path.join(snapshots_dir(), name))
+        except Exception:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        log(f'Snapshot {name} verified in {time.monotonic() - started:.1f}s')
+        rotate(log=log)
+        return name
+
+
+def _retained(names):
+    """Snapshots to keep: newest of each of the last daily/weekly periods."""
+    keep = set(names[-1:])
+    days, weeks = [], []
+    for name in reversed(names):
+        created = datetime.strptime(name, SNAPSHOT_FORMAT)
+        day, week = created.date(), created.isocalendar()[:2]
+        if day not in days and len(days) < BACKUP_KEEP_DAILY:
+            days.append(day)
+            keep.add(name)
+        if week not in weeks and len(weeks) < BACKUP_KEEP_WEEKLY:
+            weeks.append(week)
+            keep.add(name)
+    return keep
+
+
+def rotate(log=logger.info):
+    """Delete snapshots outside the retention policy and unreferenced media."""
+    names = list_snapshots()
+    keep = _retained(names)
+    for name in names:
+        if name not in keep:
+            shutil.rmtree(os.path.join(snapshots_dir(), name))
+            log(f'Snapshot {name} rotated out')
+
+    referenced = set()
+    for name in keep:
+        referenced.update(load_manifest(name)['media'].values())
+    removed = 0
+    media_root = os.path.join(BACKUP_DIR, 'media')
+    for root, _, files in os.walk(media_root):
+        for digest in files:
+            if digest not in referenced:
+                os.remove(os.path.join(root, digest))
+                removed += 1
+    if removed:
+        log(f'{removed} media files no longer in any snapshot removed')
+    return removed
+
+
+def restore(name, target_dir, log=logger.info):
+    """Write a snapshot's databases and uploads into target_dir.
+
+    Produces target_dir/balita.db (plus shards/ with DB_SHARDING),
+    target_dir/uploads/ and target_dir/cold/ (cold-storage packs, restore
+    them to COLD_STORAGE_DIR). The live database is never touched: stop the app
+    and move the files into place, or point DATABASE_DIR at target_dir.
+    """
+    problems = verify_snapshot(name)
+    if problems:
+        raise BackupError('Snapshot is damaged: ' + '; '.join(problems[:10]))
+    manifest = load_manifest(name)
+    if os.path.exists(target_dir) and os.listdir(target_dir):
+        raise BackupError(f'{target_dir} is not empty')
+    for filename in manifest['databases']:
+        dest_dir = target_dir if filename == 'balita.db' else os.path.join(target_dir, 'shards')
+        os.makedirs(dest_dir, exist_ok=True)
+        shutil.copyfile(os.path.join(snapshots_dir(), name, 'db', filename),
+                        os.path.join(dest_dir, filename))
+    for key, digest in manifest['media'].items():
+        if key.startswith(COLD_PREFIX):
+            dest = os.path.join(target_dir, 'cold', key[len(COLD_PREFIX):])
+        else:
+            dest = os.path.join(target_dir, 'uploads', key[len(UPLOADS_URL_PREFIX):])
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(media_path(digest), dest)
+    log(f"Restored {len(manifest['databases'])} databases and {len(manifest['media'])} "
+        f'media files to {target_dir}')
+
+
+def _due():
+    names = list_snapshots()
+    if not names:
+        return True
+    last = datetime.strptime(names[-1], SNAPSHOT_FORMAT).replace(tzinfo=timezone.utc)
+    # A little slack so a daily backup does not drift a tick later every day
+    return (datetime.now(timezone.utc) - last).total_seconds() >= BACKUP_INTERVAL * 0.9
+
+
+if BACKUP_INTERVAL:
+    # Checked hourly so a restarted worker neither skips nor repeats a backup
+    @job('backup', every=min(BACKUP_INTERVAL, 3600), per_database=False)
+    def backup_job():
+        if _due():
+            create_snapshot()
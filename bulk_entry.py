@@ -0,0 +1,232 @@
+"""
+Bulk data entry for posyandu sessions.
+
+Validates many growth / milestone / immunization rows across many children
+and inserts them in one transaction with executemany, collecting per-row
+errors instead of aborting on the first bad row. Rows come either from the
+multi-row web form or from an uploaded CSV (e.g. a KMS sheet exported from
+Excel), which is parsed as a stream so large files never sit in memory.
+"""
+import csv
+import io
+
+import dates
+from immunization_schedule import record_doses
+
+# Rows are inserted in chunks of this size; the whole upload is still one
+# transaction, but memory stays flat for large files.
+BATCH_SIZE = 500
+
+# Header aliases seen in KMS / Excel exports, mapped to our field names
+HEADER_ALIASES = {
+    'anak': 'child', 'nama': 'child', 'nama_anak': 'child', 'child_name': 'child',
+    'id_anak': 'child_id', 'anak_id': 'child_id',
+    'tanggal': 'record_date', 'tgl': 'record_date', 'tanggal_timbang': 'record_date', 'date': 'record_date',
+    'bb': 'weight', 'berat': 'weight', 'berat_badan': 'weight', 'weight_kg': 'weight',
+    'tb': 'height', 'pb': 'height', 'tinggi': 'height', 'tinggi_badan': 'height', 'height_cm': 'height',
+    'lk': 'head_circ', 'lingkar_kepala': 'head_circ',
+    'vaksin': 'vaccine', 'imunisasi': 'vaccine',
+    'tanggal_diberikan': 'date_given', 'tanggal_imunisasi': 'date_given',
+    'catatan': 'noted', 'keterangan': 'noted',
+}
+
+
+class RowError(Exception):
+    pass
+
+
+def parse_date(value, required=True):
+    """ISO date via dates.normalize(), the same rules as the forms."""
+    try:
+        return dates.normalize(value, required)
+    except dates.DateError as e:
+        raise RowError(str(e))
+
+
+def parse_number(value, label, low, high, required=False):
+    value = (value or '').strip().replace(',', '.')
+    if not value:
+        if required:
+            raise RowError(f'{label} wajib diisi')
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise RowError(f'{label} bukan angka: {value}')
+    if not low <= number <= high:
+        raise RowError(f'{label} di luar rentang wajar ({low}-{high}): {value}')
+    return number
+
+
+def parse_status(value):
+    value = (value or 'pending').strip().lower()
+    if value in ('done', 'selesai', 'sudah', 'ya', '1'):
+        return 'done'
+    if value in ('pending', 'belum', 'tidak', '0', ''):
+        return 'pending'
+    raise RowError(f'Status tidak dikenali: {value}')
+
+
+def validate_growth(row, child_id):
+    weight = parse_number(row.get('weight'), 'Berat badan', 0.5, 40)
+    height = parse_number(row.get('height'), 'Tinggi badan', 30, 130)
+    if weight is None and height is None:
+        raise RowError('Isi berat atau tinggi badan')
+    head_circ = parse_number(row.get('head_circ'), 'Lingkar kepala', 20, 60)
+    return (child_id, parse_date(row.get('record_date')), weight, height, head_circ)
+
+
+def validate_milestone(row, child_id):
+    milestone = (row.get('milestone') or '').strip()
+    if not milestone:
+        raise RowError('Nama milestone wajib diisi')
+    noted = (row.get('noted') or '').strip() or None
+    return (child_id, milestone, parse_status(row.get('status')), noted)
+
+
+def validate_immunization(row, child_id):
+    vaccine = (row.get('vaccine') or '').strip()
+    if not vaccine:
+        raise RowError('Nama vaksin wajib diisi')
+    status = parse_status(row.get('status'))
+    date_given = parse_date(row.get('date_given'), required=(status == 'done'))
+    return (child_id, vaccine, date_given, status)
+
+
+KINDS = {
+    'growth': {
+        'label': 'Pertumbuhan',
+        'fields': ('record_date', 'weight', 'height', 'head_circ'),
+        'validate': validate_growth,
+        'sql': 'INSERT INTO growth (child_id,record_date,weight,height,head_circ) VALUES (?,?,?,?,?)',
+    },
+    'milestone': {
+        'label': 'Milestone',
+        'fields': ('milestone', 'status', 'noted'),
+        'validate': validate_milestone,
+        'sql': 'INSERT INTO development (child_id,milestone,status,noted) VALUES (?,?,?,?)',
+    },
+    'immunization': {
+        'label': 'Imunisasi',
+        'fields': ('vaccine', 'date_given', 'status'),
+        'validate': validate_immunization,
+        # Fills in the child's scheduled doses instead of duplicating them
+        'write': record_doses,
+    },
+}
+
+
+class ChildResolver:
+    """Map a row's child reference (id or name) to one of the user's children."""
+
+    def __init__(self, children):
+        self.by_id = {}
+        self.by_name = {}
+        for child in children:
+            self.by_id[int(child['id'])] = child['name']
+            self.by_name[child['name'].strip().lower()] = int(child['id'])
+
+    def resolve(self, row):
+        ref = (row.get('child_id') or '').strip()
+        if ref:
+            try:
+                child_id = int(ref)
+            except ValueError:
+                raise RowError(f'ID anak tidak valid: {ref}')
+            if child_id not in self.by_id:
+                raise RowError(f'Anak dengan ID {child_id} tidak ditemukan')
+            return child_id
+        name = (row.get('child') or '').strip().lower()
+        if not name:
+            raise RowError('Anak wajib dipilih')
+        if name not in self.by_name:
+            raise RowError(f'Anak "{row.get("child")}" tidak ditemukan')
+        return self.by_name[name]
+
+
+def iter_form_rows(form, kind):
+    """Yield (row_number, row) from the repeated inputs of the bulk form."""
+    fields = ('child_id',) + KINDS[kind]['fields']
+    columns = {f: form.getlist(f) for f in fields}
+    count = max(len(v) for v in columns.values())
+    for i in range(count):
+        row = {f: (columns[f][i] if i < len(columns[f]) else '') for f in fields}
+        # Skip rows the volunteer left completely empty
+        if any((v or '').strip() for k, v in row.items() if k != 'child_id'):
+            yield i + 1, row
+
+
+def normalize_header(name):
+    key = (name or '').strip().lower().replace(' ', '_').replace('(', '').replace(')', '')
+    return HEADER_ALIASES.get(key, key)
+
+
+def iter_csv_rows(stream):
+    """Yield (line_number, row) from an uploaded CSV without reading it all.
+
+    Delimiter is sniffed from the first line, since Indonesian Excel exports
+    use ';' while Google Sheets uses ','.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    header_line = text.readline()
+    if not header_line:
+        return
+    try:
+        dialect = csv.Sniffer().sniff(header_line, delimiters=',;\t')
+        delimiter = dialect.delimiter
+    except csv.Error:
+        delimiter = ','
+    header = [normalize_header(h) for h in next(csv.reader([header_line], delimiter=delimiter))]
+    for line_number, values in enumerate(csv.reader(text, delimiter=delimiter), start=2):
+        if not any(v.strip() for v in values):
+            continue
+        yield line_number, dict(zip(header, values))
+
+
+def insert_rows(db, kind, rows, resolver, per_child=None):
+    """Validate and insert rows in one transaction.
+
+    Returns (inserted_count, errors) where errors is a list of
+    {'row': n, 'message': ...}. Valid rows are written even when others
+    fail, so a volunteer only has to re-enter the rejected ones. If given,
+    the dict `per_child` receives the number of rows written per child id.
+    """
+    spec = KINDS[kind]
+    validate = spec['validate']
+    write = spec.get('write') or (lambda db, batch: db.executemany(spec['sql'], batch))
+    inserted = 0
+    errors = []
+    batch = []
+    try:
+        for number, row in rows:
+            try:
+                values = validate(row, resolver.resolve(row))
+            except RowError as e:
+                errors.append({'row': number, 'message': str(e)})
+                continue
+            batch.append(values)
+            if per_child is not None:
+                per_child[values[0]] = per_child.get(values[0], 0) + 1
+            if len(batch) >= BATCH_SIZE:
+                write(db, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            write(db, batch)
+            inserted += len(batch)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return inserted, errors
+
+
+def csv_template(kind):
+    """Header line (plus example) for the downloadable CSV template."""
+    examples = {
+        'growth': 'Aisha Putri,2024-08-17,9.2,74.5,45',
+        'milestone': "Aisha Putri,Bisa berjalan,done,",
+        'immunization': 'Aisha Putri,Campak/MR 1,2024-08-17,done',
+    }
+    header = ','.join(('child',) + KINDS[kind]['fields'])
+    return f'{header}\n{examples[kind]}\n'
@@ -0,0 +1,323 @@
+"""
+Cold-storage tiering for sealed capsule media.
+
+Once a capsule is sealed its photos and audio are rarely read until the
+unlock date, often years later. COLD_AFTER_DAYS after sealing, the
+`cold-storage-tier` job packs them into zip files under COLD_STORAGE_DIR
+(mount it on cheaper storage) and removes them from static/uploads. Many
+small files go into one pack of up to COLD_PACK_MAX_MB, so cold storage
+holds a few large files instead of thousands of small ones. Members are
+deflated, except formats that are already compressed (JPEG, WebM, ...),
+which are stored as they are.
+
+A pack is written to a temporary file, verified, and renamed before its
+`cold_media` rows are committed; hot files are deleted only after that
+commit. A crash in between leaves a file both hot and cold, and the next run
+deletes the hot copy once its checksum matches.
+
+The `cold-storage-rehydrate` job extracts a capsule's media back into
+static/uploads REHYDRATE_DAYS_BEFORE days ahead of its unlock date, or as
+soon as it is opened; opening a capsule also rehydrates just that capsule
+on the spot. Rows of deleted capsules are removed by purge.py in the same
+transaction as the capsule. A row whose capsule is merely missing from this
+database (e.g. the family moved shard) is extracted, never just dropped.
+Packs with no remaining members are deleted once no database refers to
+them. A request for an archived file before then is answered straight from
+the pack, see serve().
+
+Hot files are read and written through the media store. With MEDIA_STORE=s3
+nothing new is archived (use the bucket's lifecycle rules to move old objects
+to a cheaper storage class); packs made before the switch are still served
+and rehydrated into the bucket.
+"""
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import secrets
+import zipfile
+from datetime import date, datetime, timedelta
+
+from flask import send_file
+
+import dates
+from db import DATABASE_DIR, DB_SHARDING, each_database, get_db
+from media_store import UPLOADS_URL_PREFIX, get_store, url_to_key, url_to_path
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+COLD_STORAGE_DIR = os.environ.get('COLD_STORAGE_DIR', os.path.join(DATABASE_DIR, 'cold'))
+COLD_AFTER_DAYS = int(os.environ.get('COLD_AFTER_DAYS', '7'))
+REHYDRATE_DAYS_BEFORE = int(os.environ.get('REHYDRATE_DAYS_BEFORE', '14'))
+# Capsules opening sooner than this are not worth archiving
+COLD_MIN_DAYS_TO_UNLOCK = int(os.environ.get('COLD_MIN_DAYS_TO_UNLOCK', '90'))
+COLD_PACK_MAX_MB = int(os.environ.get('COLD_PACK_MAX_MB', '64'))
+
+# Deflate gains nothing on these
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+                     '.webm', '.ogg', '.mp3', '.m4a', '.mp4', '.mov', '.zip', '.gz'}
+
+
+def pack_path(name):
+    return os.path.join(COLD_STORAGE_DIR, name)
+
+
+def _member(file_url):
+    return file_url[len(UPLOADS_URL_PREFIX):]
+
+
+def _sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _candidates(db, today):
+    """(capsule_id, url) of hot media in capsules eligible for cold storage."""
+    sealed_before = (datetime.now() - timedelta(days=COLD_AFTER_DAYS)).isoformat()
+    unlock_after = dates.to_day(today) + COLD_MIN_DAYS_TO_UNLOCK
+    cur = db.execute('''
+        SELECT cm.capsule_id, cm.file_url, cm.thumbnail_url FROM capsule_media cm
+        JOIN time_capsules tc ON tc.id = cm.capsule_id
+        WHERE tc.is_sealed = 1 AND tc.opened_at IS NULL
+          AND tc.sealed_at <= ? AND tc.unlock_day > ?
+          AND cm.file_url NOT IN (SELECT file_url FROM cold_media)
+        ORDER BY cm.capsule_id, cm.id
+    ''', (sealed_before, unlock_after))
+    store = get_store()
+    for row in cur.fetchall():
+        for url in (row['file_url'], row['thumbnail_url']):
+            key = url_to_key(url)
+            if key and store.size(key) is not None:
+                yield row['capsule_id'], url
+
+
+def _write_pack(files):
+    """Zip [(capsule_id, url, data)] into a new pack; returns (name, size)."""
+    os.makedirs(COLD_STORAGE_DIR, exist_ok=True)
+    name = f"pack-{datetime.now().strftime('%Y%m%d%H%M%S')}-{secrets.token_hex(4)}.zip"
+    tmp = pack_path(name) + '.tmp'
+    try:
+        with zipfile.ZipFile(tmp, 'w') as zf:
+            for _, url, data in files:
+                stored = os.path.splitext(url)[1].lower() in STORED_EXTENSIONS
+                zf.writestr(_member(url), data,
+                            compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+        with open(tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        with zipfile.ZipFile(tmp) as zf:
+            bad = zf.testzip()
+            if bad:
+                raise OSError(f'Pack verification failed at {bad}')
+        os.replace(tmp, pack_path(name))
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return name, os.path.getsize(pack_path(name))
+
+
+def _archive_pack(db, files):
+    name, size = _write_pack(files)
+    now = datetime.now().isoformat()
+    try:
+        cur = db.execute('INSERT INTO media_packs (name, size, file_count, created_at) VALUES (?, ?, ?, ?)',
+                         (name, size, len(files), now))
+        pack_id = cur.lastrowid
+        db.executemany('''
+            INSERT INTO cold_media (file_url, pack_id, capsule_id, size, sha256, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(url, pack_id, capsule_id, len(data), _sha256_bytes(data), now)
+              for capsule_id, url, data in files])
+        db.commit()
+    except Exception:
+        db.rollback()
+        os.remove(pack_path(name))
+        raise
+    store = get_store()
+    for _, url, _ in files:
+        store.delete(url_to_key(url))
+    return name
+
+
+def _drop_hot_leftovers(db):
+    """Delete hot copies left behind by a crash after a pack was committed."""
+    store = get_store()
+    removed = 0
+    for row in db.execute('SELECT file_url, sha256 FROM cold_media').fetchall():
+        key = url_to_key(row['file_url'])
+        if not key:
+            continue
+        try:
+            data = store.read(key)
+        except FileNotFoundError:
+            continue
+        if _sha256_bytes(data) == row['sha256']:
+            store.delete(key)
+            removed += 1
+    return removed
+
+
+def archive(db, log=logger.info):
+    """Move eligible sealed-capsule media into packs. Returns files archived."""
+    if get_store().name != 'local':
+        return 0
+    _drop_hot_leftovers(db)
+    limit = COLD_PACK_MAX_MB * 1024 * 1024
+    batch, batch_size, archived = [], 0, 0
+    store = get_store()
+    for capsule_id, url in list(_candidates(db, date.today())):
+        data = store.read(url_to_key(url))
+        if batch and batch_size + len(data) > limit:
+            log(f'{_archive_pack(db, batch)}: {len(batch)} files')
+            archived += len(batch)
+            batch, batch_size = [], 0
+        batch.append((capsule_id, url, data))
+        batch_size += len(data)
+    if batch:
+        log(f'{_archive_pack(db, batch)}: {len(batch)} files')
+        archived += len(batch)
+    return archived
+
+
+def read_member(pack_name, file_url):
+    with zipfile.ZipFile(pack_path(pack_name)) as zf:
+        return zf.read(_member(file_url))
+
+
+def _write_hot(file_url, data):
+    get_store().save(url_to_key(file_url), io.BytesIO(data), mimetypes.guess_type(file_url)[0])
+
+
+def _restore(db, rows):
+    """Extract rows (file_url, sha256, pack) back to the media store and drop them."""
+    restored = 0
+    for row in rows:
+        data = read_member(row['pack'], row['file_url'])
+        if _sha256_bytes(data) != row['sha256']:
+            logger.error('Checksum mismatch for %s in %s', row['file_url'], row['pack'])
+            continue
+        _write_hot(row['file_url'], data)
+        restored += 1
+        db.execute('DELETE FROM cold_media WHERE file_url = ?', (row['file_url'],))
+        db.commit()
+    return restored
+
+
+def _pack_referenced_elsewhere(name):
+    """Whether another shard still has a row for pack `name` (after a move)."""
+    if not DB_SHARDING:
+        return False
+    import sharding
+    for shard in sharding.existing_shards():
+        conn = sharding.connect(shard)
+        try:
+            if conn.execute('SELECT 1 FROM media_packs WHERE name = ?', (name,)).fetchone():
+                return True
+        finally:
+            conn.close()
+    return False
+
+
+def _remove_empty_packs(db):
+    empty = db.execute('''
+        SELECT id, name FROM media_packs
+        WHERE id NOT IN (SELECT pack_id FROM cold_media)
+    ''').fetchall()
+    for pack in empty:
+        db.execute('DELETE FROM media_packs WHERE id = ?', (pack['id'],))
+        db.commit()
+        if _pack_referenced_elsewhere(pack['name']):
+            continue
+        try:
+            os.remove(pack_path(pack['name']))
+        except FileNotFoundError:
+            pass
+    return len(empty)
+
+
+def rehydrate(db, log=logger.info, everything=False):
+    """Bring media back to the media store ahead of their unlock date.
+
+    Rows whose capsule is not in this database are extracted too, unless
+    the file is queued for deletion; packs left without members are
+    deleted. With everything, all of them are (e.g. when moving media to
+    S3). Returns files restored.
+    """
+    due = dates.today_day() + REHYDRATE_DAYS_BEFORE
+    rows = db.execute('''
+        SELECT cm.file_url, cm.sha256, mp.name AS pack, pq.id AS purged
+        FROM cold_media cm
+        JOIN media_packs mp ON mp.id = cm.pack_id
+        LEFT JOIN time_capsules tc ON tc.id = cm.capsule_id
+        LEFT JOIN media_purge_queue pq ON pq.file_url = cm.file_url
+        WHERE tc.id IS NULL OR tc.unlock_day <= ? OR tc.opened_at IS NOT NULL
+           OR tc.is_sealed = 0 OR ? = 1
+        ORDER BY mp.id
+    ''', (due, 1 if everything else 0)).fetchall()
+    # Confirmed deleted: the purge queued the file itself, nothing to keep
+    purged = [r for r in rows if r['purged'] is not None]
+    for row in purged:
+        db.execute('DELETE FROM cold_media WHERE file_url = ?', (row['file_url'],))
+    db.commit()
+    restored = _restore(db, [r for r in rows if r['purged'] is None])
+    removed = _remove_empty_packs(db)
+    if restored or removed:
+        log(f'{restored} files rehydrated, {removed} empty packs removed')
+    return restored
+
+
+def rehydrate_capsule(db, capsule_id):
+    """Bring one capsule's media back now, whatever its date. Returns files restored."""
+    rows = db.execute('''
+        SELECT cm.file_url, cm.sha256, mp.name AS pack FROM cold_media cm
+        JOIN media_packs mp ON mp.id = cm.pack_id
+        WHERE cm.capsule_id = ?
+    ''', (capsule_id,)).fetchall()
+    if not rows:
+        return 0
+    restored = _restore(db, rows)
+    _remove_empty_packs(db)
+    return restored
+
+
+def serve(filename):
+    """Response for static/<filename> from its pack, or None if not archived.
+
+    Only reached when the file is missing from static/uploads. With
+    DB_SHARDING the row can be in any shard, so each one is asked in turn.
+    """
+    file_url = '/static/' + filename
+    if not url_to_path(file_url):
+        return None
+    for db in each_database():
+        row = db.execute('''
+            SELECT cm.sha256, mp.name AS pack FROM cold_media cm
+            JOIN media_packs mp ON mp.id = cm.pack_id
+            WHERE cm.file_url = ?
+        ''', (file_url,)).fetchone()
+        if row:
+            data = read_member(row['pack'], file_url)
+            mimetype = mimetypes.guess_type(file_url)[0] or 'application/octet-stream'
+            return send_file(io.BytesIO(data), mimetype=mimetype, etag=row['sha256'],
+                             conditional=True, max_age=3600)
+    return None
+
+
+def stats(db):
+    row = db.execute('''
+        SELECT COUNT(*) AS packs, COALESCE(SUM(size), 0) AS size,
+               COALESCE(SUM(file_count), 0) AS files
+        FROM media_packs
+    ''').fetchone()
+    return {'packs': row['packs'], 'size': row['size'], 'files': row['files']}
+
+
+@job('cold-storage-tier', every=86400)
+def tier_job():
+    archive(get_db())
+
+
+@job('cold-storage-rehydrate', every=3600)
+def rehydrate_job():
+    rehydrate(get_db())
@@ -0,0 +1,100 @@
+"""
+Calendar dates as stored by BabyGrow.
+
+Dates are kept in two forms: the ISO 'YYYY-MM-DD' text the forms always had
+(children.dob, growth.record_date, ...) and, next to it, an integer "epoch
+day" (days since 1970-01-01: dob_day, record_day, ...). The integer columns
+are maintained by triggers (migration 9) and indexed, so countdowns, ages
+and date ranges are plain integer arithmetic and range scans in SQL instead
+of strptime calls per row in Python.
+
+Everything entering the database, from the forms and from bulk/CSV entry
+alike, goes through normalize(), so the text column always holds a valid
+ISO date that the triggers can convert.
+"""
+from datetime import date, datetime, timedelta
+
+EPOCH = date(1970, 1, 1)
+
+MONTHS_ID = ['Januari', 'Februari', 'Maret', 'April', 'Mei', 'Juni', 'Juli',
+             'Agustus', 'September', 'Oktober', 'November', 'Desember']
+
+
+# Also accepted (forms, CSV uploads): unpadded ISO and day-first forms
+INPUT_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y')
+
+
+class DateError(ValueError):
+    pass
+
+
+def parse(value):
+    """date for a date string, date or datetime; None if empty.
+
+    Accepts ISO dates and timestamps, plus the day-first forms of Indonesian
+    paper records and spreadsheet exports (INPUT_FORMATS).
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or '').strip()
+    if not text:
+        return None
+    # The whole string must be a date or timestamp: no trailing text
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        pass
+    for fmt in INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise DateError(f'Tanggal tidak valid: {value}')
+
+
+def normalize(value, required=True):
+    """Validated 'YYYY-MM-DD' for storage."""
+    parsed = parse(value)
+    if parsed is None:
+        if required:
+            raise DateError('Tanggal wajib diisi')
+        return None
+    return parsed.isoformat()
+
+
+def to_day(value):
+    """Epoch day of a date-like value, None if empty."""
+    parsed = parse(value)
+    return None if parsed is None else (parsed - EPOCH).days
+
+
+def from_day(day):
+    return EPOCH + timedelta(days=day)
+
+
+def today_day():
+    return (date.today() - EPOCH).days
+
+
+def days_until(value):
+    """Days from today until `value` (an epoch day or a date-like value), never negative."""
+    day = value if isinstance(value, int) else to_day(value)
+    if day is None:
+        return 0
+    return max(0, day - today_day())
+
+
+def format_long(value):
+    """'2024-08-17' -> '17 Agustus 2024'; other text is shown as-is."""
+    value = str(value or '').strip()
+    try:
+        y, m, d = value[:10].split('-')
+        return f'{int(d)} {MONTHS_ID[int(m) - 1]} {y}'
+    except (ValueError, IndexError):
+        return value
@@ -1,7 +1,15 @@
 import os
+import time
+import random
+import logging
 import sqlite3
-from flask import g
+import threading
+from flask import g, has_request_context, session
 from dotenv import load_dotenv
+from migrations import migrate, LATEST_VERSION
+from models import RecordCursor, sqlite_row_factory
+import statements
+from statements import MYSQL_PREPARED, parse
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,235 +24,478 @@ DATABASE = os.path.join(DATABASE_DIR, 'balita.db')
 # Environment-driven DB selection. Set DB_TYPE=mysql to use MySQL.
 DB_TYPE = os.environ.get('DB_TYPE', 'sqlite').lower()
 
+# Latest migration version; workers behind it migrate (or refuse to start).
+SCHEMA_VERSION = LATEST_VERSION
+
+# Set DB_AUTO_MIGRATE=0 in production to require an explicit `flask init-db`.
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '1') == '1'
+
+# Connection tuning for threaded/gevent workers (see gunicorn.conf.py).
+# SQLite waits this many seconds for a competing writer instead of failing
+# with "database is locked"; WAL lets readers proceed while one thread writes.
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '10'))
+SQLITE_WAL = os.environ.get('SQLITE_WAL', '1') == '1'
+# MySQL connections are pooled per worker process when MYSQL_POOL_SIZE > 0,
+# which should be at least the number of threads/greenlets per worker.
+MYSQL_POOL_SIZE = int(os.environ.get('MYSQL_POOL_SIZE', '0'))
+MYSQL_POOL_TIMEOUT = float(os.environ.get('MYSQL_POOL_TIMEOUT', '10'))
+
+# Optional per-family SQLite sharding (see sharding.py). balita.db stays the
+# catalog: users, the user -> shard map, invite routes and legacy families.
+DB_SHARDING = os.environ.get('DB_SHARDING', '0') == '1' and DB_TYPE == 'sqlite'
+
+# Read replicas: MYSQL_REPLICAS=host[:port],... (same user/db as the primary).
+# A replica more than MYSQL_REPLICA_MAX_LAG seconds behind is skipped; set
+# MYSQL_REPLICA_LAG_CHECK=off for instances that are not real replicas.
+MYSQL_REPLICA_MAX_LAG = float(os.environ.get('MYSQL_REPLICA_MAX_LAG', '5'))
+MYSQL_REPLICA_CHECK_INTERVAL = float(os.environ.get('MYSQL_REPLICA_CHECK_INTERVAL', '5'))
+MYSQL_REPLICA_LAG_CHECK = os.environ.get('MYSQL_REPLICA_LAG_CHECK', 'status')
+# After a write, the same session reads from the primary for this long
+MYSQL_STICKY_SECONDS = float(os.environ.get('MYSQL_STICKY_SECONDS', str(MYSQL_REPLICA_MAX_LAG + 1)))
+
+# SERVER_TIMING=1 times every statement and commit and reports the totals
+# per request in a Server-Timing header (see tools/loadgen.py). Writes are
+# also reported on their own: with SQLite that is where a request waits
+# for the write lock held by another one.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+_mysql_pools = {}
+_mysql_pool_lock = threading.Lock()
+_replica_health = {}
+_replica_health_lock = threading.Lock()
+_sqlite_wal_enabled = set()
+
+# Per-process flag so the schema is only checked once per worker.
+_schema_checked = False
+
+logger = logging.getLogger(__name__)
+
 
 class MySQLDBWrapper:
     """A thin wrapper to provide a sqlite-like `execute` interface over
     mysql-connector so the rest of the app can call `db.execute(...)`.
+
+    With read replicas configured, read-only statements go to a healthy
+    replica and everything else to the primary. After the first write the
+    wrapper is pinned to the primary, so a request always reads its own
+    writes; `on_write` lets get_db() extend that to the next few requests
+    (the redirect after a POST). Both connections are opened lazily, so a
+    read-only request never touches the primary.
     """
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, conn=None, connect=None, connect_replica=None, pinned=False, on_write=None):
+        self._conn = conn
+        self._connect = connect
+        self._connect_replica = connect_replica
+        self._replica = None
+        self._replica_tried = False
+        self.pinned = pinned or connect_replica is None
+        self._on_write = on_write
+        self._trace = None
+        self.timing = None
+
+    @property
+    def conn(self):
+        """The primary connection."""
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
 
-    def _query(self, query):
-        # convert sqlite-style ? placeholders to MySQL %s
-        return query.replace('?', '%s')
+    def _route(self, stmt):
+        """Connection for `stmt`: a replica for plain reads when allowed."""
+        if not self.pinned and stmt.replica_ok:
+            if not self._replica_tried:
+                self._replica_tried = True
+                self._replica = self._connect_replica()
+            if self._replica is not None:
+                ROUTING_STATS['replica'] += 1
+                return self._replica
+            ROUTING_STATS['fallback'] += 1
+            return self.conn
+        if not self.pinned:
+            self.pinned = True
+            if self._on_write:
+                self._on_write()
+        ROUTING_STATS['primary'] += 1
+        return self.conn
+
+    def set_trace_callback(self, callback):
+        """Call `callback(sql)` for every statement, like sqlite3's."""
+        self._trace = callback
 
     def execute(self, query, params=()):
-        cur = self.conn.cursor(dictionary=True)
-        q = self._query(query)
-        cur.execute(q, params)
+        if self._trace:
+            self._trace(query)
+        stmt = parse(query)
+        started = time.perf_counter()
+        cur = statements.execute(self._route(stmt), stmt, params, self.timing, wrap=RecordCursor)
+        _record_timing(self.timing, query, started)
+        return cur
+
+    def executemany(self, query, seq_of_params):
+        if self._trace:
+            self._trace(query)
+        stmt = parse(query)
+        started = time.perf_counter()
+        cur = self._route(stmt).cursor()
+        cur.executemany(stmt.pyformat, seq_of_params)
+        _record_timing(self.timing, query, started)
         return cur
 
     def commit(self):
-        return self.conn.commit()
+        if self._conn is not None:
+            started = time.perf_counter()
+            result = self._conn.commit()
+            _record_timing(self.timing, None, started)
+            return result
+
+    def rollback(self):
+        if self._conn is not None:
+            return self._conn.rollback()
 
     def close(self):
+        for conn in (self._conn, self._replica):
+            if conn is None:
+                continue
+            try:
+                if MYSQL_POOL_SIZE and MYSQL_PREPARED:
+                    statements.release(conn)
+                conn.close()
+            except Exception:
+                pass
+
+
+# Per-process counters of where statements went (see tools/rw_split_check.py)
+ROUTING_STATS = {'primary': 0, 'replica': 0, 'fallback': 0}
+
+
+def _record_timing(timing, query, started):
+    """Add the time since `started` to a request's timing totals (query None = commit)."""
+    if timing is None:
+        return
+    elapsed = time.perf_counter() - started
+    timing['db'] += elapsed
+    if query is None or parse(query).writes:
+        timing['write'] += elapsed
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that adds its time in execute/commit to `timing`.
+
+    Only the first step of a SELECT runs inside execute(); rows fetched
+    later are not counted. Lock waits always happen inside execute/commit.
+    """
+    timing = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_timing(self.timing, sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_timing(self.timing, sql, started)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record_timing(self.timing, None, started)
+
+
+def _mysql_config(host=None, port=None):
+    return {
+        'host': host or os.environ.get('MYSQL_HOST', 'localhost'),
+        'port': int(port or os.environ.get('MYSQL_PORT', '3306')),
+        'user': os.environ.get('MYSQL_USER', 'root'),
+        'password': os.environ.get('MYSQL_PASSWORD', ''),
+        'database': os.environ.get('MYSQL_DB', 'balita_db'),
+        # The pure-Python driver yields to gevent; the C extension would block
+        'use_pure': os.environ.get('MYSQL_USE_PURE', '0') == '1',
+    }
+
+
+def _replica_configs():
+    """MYSQL_REPLICAS=host[:port],host[:port] -> list of connection configs."""
+    configs = []
+    for item in os.environ.get('MYSQL_REPLICAS', '').split(','):
+        item = item.strip()
+        if item:
+            host, _, port = item.partition(':')
+            configs.append(_mysql_config(host, port or None))
+    return configs
+
+
+def _connect_mysql(config=None, pool_name='babygrow'):
+    """Open a MySQL connection, from a per-process pool when enabled."""
+    # lazy import so mysql dependency is optional for sqlite users
+    import mysql.connector
+    config = config or _mysql_config()
+    if not MYSQL_POOL_SIZE:
+        return mysql.connector.connect(**config)
+
+    from mysql.connector import pooling, errors
+    # Created on first use, i.e. after gunicorn has forked this worker
+    with _mysql_pool_lock:
+        pool = _mysql_pools.get(pool_name)
+        if pool is None:
+            pool = _mysql_pools[pool_name] = pooling.MySQLConnectionPool(
+                pool_name=pool_name, pool_size=MYSQL_POOL_SIZE,
+                # A session reset would deallocate the prepared statements
+                # (see statements.py); MySQLDBWrapper.close() rolls back instead
+                pool_reset_session=not MYSQL_PREPARED, **config)
+    deadline = time.monotonic() + MYSQL_POOL_TIMEOUT
+    while True:
         try:
-            self.conn.close()
+            return pool.get_connection()
+        except errors.PoolError:
+            # All connections are checked out by other threads; wait briefly
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.01)
+
+
+def replica_lag(conn):
+    """Seconds the replica is behind, or None if it is not replicating."""
+    cur = conn.cursor(dictionary=True)
+    try:
+        try:
+            cur.execute('SHOW REPLICA STATUS')
         except Exception:
-            pass
+            # MySQL < 8.0.22 and MariaDB
+            cur.execute('SHOW SLAVE STATUS')
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if not row:
+        return None
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+def _replica_healthy(index, conn):
+    """Lag check, cached per replica for MYSQL_REPLICA_CHECK_INTERVAL."""
+    if MYSQL_REPLICA_LAG_CHECK == 'off':
+        return True
+    now = time.monotonic()
+    with _replica_health_lock:
+        cached = _replica_health.get(index)
+        if cached and now - cached[1] < MYSQL_REPLICA_CHECK_INTERVAL:
+            return cached[0]
+    try:
+        lag = replica_lag(conn)
+    except Exception:
+        logger.warning('Lag check failed on replica %d', index, exc_info=True)
+        lag = None
+    healthy = lag is not None and lag <= MYSQL_REPLICA_MAX_LAG
+    with _replica_health_lock:
+        was = _replica_health.get(index, (True,))[0]
+        _replica_health[index] = (healthy, now)
+    if was != healthy:
+        logger.warning('Replica %d is %s (lag: %s)', index,
+                       'back in rotation' if healthy else 'out of rotation', lag)
+    return healthy
+
+
+def _connect_replica():
+    """A connection to a healthy replica, or None to fall back to the primary."""
+    configs = _replica_configs()
+    for index in random.sample(range(len(configs)), len(configs)):
+        try:
+            conn = _connect_mysql(configs[index], pool_name=f'babygrow-replica{index}')
+        except Exception:
+            logger.warning('Cannot connect to replica %d', index, exc_info=True)
+            continue
+        if _replica_healthy(index, conn):
+            return conn
+        conn.close()
+    return None
+
+
+def _connect_sqlite(path=DATABASE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT,
+                           factory=TimedConnection if SERVER_TIMING else sqlite3.Connection)
+    conn.row_factory = sqlite_row_factory
+    if SQLITE_WAL:
+        if path not in _sqlite_wal_enabled:
+            # journal_mode is persistent in the file, so once per process is enough
+            conn.execute('PRAGMA journal_mode=WAL')
+            _sqlite_wal_enabled.add(path)
+        conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
 
 
 def get_db():
-    """Return a DB connection/wrapper stored on flask.g."""
+    """Return a DB connection/wrapper stored on flask.g.
+
+    flask.g is scoped to the current app context, so every request (thread
+    or greenlet) gets its own connection and sharing one is never possible.
+    """
     db = getattr(g, '_database', None)
     if db is None:
         if DB_TYPE == 'mysql':
-            # lazy import so mysql dependency is optional for sqlite users
-            import mysql.connector
-            host = os.environ.get('MYSQL_HOST', 'localhost')
-            port = int(os.environ.get('MYSQL_PORT', '3306'))
-            user = os.environ.get('MYSQL_USER', 'root')
-            password = os.environ.get('MYSQL_PASSWORD', '')
-            database = os.environ.get('MYSQL_DB', 'balita_db')
-            conn = mysql.connector.connect(
-                host=host,
-                port=port,
-                user=user,
-                password=password,
-                database=database
-            )
-            db = MySQLDBWrapper(conn)
+            db = _mysql_wrapper()
+        elif DB_SHARDING and has_request_context() and session.get('user_id'):
+            # Imported here because sharding builds on this module
+            import sharding
+            db, hold = sharding.connect_for_user(session['user_id'])
+            g.setdefault('_family_holds', []).append(hold)
         else:
-            os.makedirs(DATABASE_DIR, exist_ok=True)
-            conn = sqlite3.connect(DATABASE)
-            conn.row_factory = sqlite3.Row
-            db = conn
+            db = _connect_sqlite()
+        _instrument(db)
         g._database = db
     return db
 
 
+def _instrument(db):
+    """Install the app context's statement callback (see profiler.py) and
+    Server-Timing totals on db."""
+    callback = g.get('_query_trace')
+    if callback is not None:
+        db.set_trace_callback(callback)
+    if SERVER_TIMING:
+        db.timing = g.setdefault('_db_timing', {'db': 0.0, 'write': 0.0, 'prepare': 0.0,
+                                                'prepared': 0, 'reused': 0})
+
+
+def add_server_timing(response):
+    """after_request: report the request's database time (SERVER_TIMING=1)."""
+    timing = g.get('_db_timing')
+    if timing is not None:
+        response.headers.add('Server-Timing', f"db;dur={timing['db'] * 1000:.2f}")
+        response.headers.add('Server-Timing', f"db-write;dur={timing['write'] * 1000:.2f}")
+        if timing['prepared'] or timing['reused']:
+            response.headers.add('Server-Timing', f"db-prepare;dur={timing['prepare'] * 1000:.2f};"
+                                 f"desc=\"{timing['prepared']} prepared, {timing['reused']} reused\"")
+    return response
+
+
+def _mysql_wrapper():
+    if not _replica_configs():
+        return MySQLDBWrapper(_connect_mysql())
+    if not has_request_context():
+        # CLI commands and jobs: always the primary
+        return MySQLDBWrapper(connect=_connect_mysql)
+
+    def stick_to_primary():
+        session['_primary_until'] = time.time() + MYSQL_STICKY_SECONDS
+
+    return MySQLDBWrapper(connect=_connect_mysql, connect_replica=_connect_replica,
+                          pinned=session.get('_primary_until', 0) > time.time(),
+                          on_write=stick_to_primary)
+
+
+def get_catalog_db():
+    """The main database, regardless of which shard get_db() points at."""
+    if not DB_SHARDING:
+        return get_db()
+    db = getattr(g, '_catalog', None)
+    if db is None:
+        db = g._catalog = _connect_sqlite()
+        _instrument(db)
+    return db
+
+
+def use_database(db):
+    """Point get_db() at `db` for the rest of the app context."""
+    previous = getattr(g, '_database', None)
+    if previous is not None and previous is not db:
+        previous.close()
+    _instrument(db)
+    g._database = db
+
+
+def use_user_database(user_id):
+    """Point get_db() at the database holding `user_id`'s family."""
+    if DB_SHARDING:
+        import sharding
+        db, hold = sharding.connect_for_user(user_id)
+        g.setdefault('_family_holds', []).append(hold)
+        use_database(db)
+    return get_db()
+
+
+def each_database():
+    """Yield every database in turn, each installed as get_db().
+
+    With sharding off this is just get_db(); background jobs and CLI
+    commands use it so they cover every shard.
+    """
+    if not DB_SHARDING:
+        yield get_db()
+        return
+    import sharding
+    for name in sharding.existing_shards():
+        db = sharding.connect(name)
+        use_database(db)
+        yield db
+
+
 def close_connection(exception):
     """Close the DB connection at the end of each request."""
-    db = getattr(g, '_database', None)
-    if db is not None:
-        try:
-            db.close()
-        except Exception:
-            pass
+    for name in ('_database', '_catalog'):
+        db = getattr(g, name, None)
+        if db is not None:
+            try:
+                db.close()
+            except Exception:
+                pass
+    # Only now may a move of these families go ahead (see sharding.move_user)
+    for hold in g.pop('_family_holds', ()):
+        hold.release()
 
 
-def init_db():
-    """Create the database tables if they don't already exist."""
-    db = get_db()
+def init_db(dry_run=False, target=None, log=print):
+    """Bring the schema up to date by applying pending migrations."""
+    done = migrate(get_catalog_db(), DB_TYPE, dry_run=dry_run, target=target, log=log)
+    if DB_SHARDING and not dry_run:
+        import sharding
+        sharding.migrate_shards(target=target, log=log)
+    return done
 
-    # MySQL uses different AUTO_INCREMENT syntax
-    if DB_TYPE == 'mysql':
-        pk = 'INT AUTO_INCREMENT PRIMARY KEY'
-    else:
-        pk = 'INTEGER PRIMARY KEY AUTOINCREMENT'
-
-    def exec_sql(sql):
-        try:
-            db.execute(sql)
-        except Exception:
-            pass
-
-    # Users table
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS users (
-            id {pk},
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE,
-            password TEXT NOT NULL,
-            full_name TEXT,
-            avatar_url TEXT,
-            preferred_theme TEXT DEFAULT 'peach',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )
-    """)
-
-    # Children table
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS children (
-            id {pk},
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            dob TEXT,
-            gender TEXT,
-            photo_url TEXT,
-            blood_type TEXT,
-            allergies TEXT,
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Growth records
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS growth (
-            id {pk},
-            child_id INTEGER NOT NULL,
-            record_date TEXT,
-            weight REAL,
-            height REAL,
-            head_circ REAL,
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Development/Milestone records
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS development (
-            id {pk},
-            child_id INTEGER NOT NULL,
-            category TEXT DEFAULT 'general',
-            milestone TEXT,
-            status TEXT DEFAULT 'pending',
-            achieved_date TEXT,
-            noted TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Immunization records
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS immunization (
-            id {pk},
-            child_id INTEGER NOT NULL,
-            vaccine TEXT,
-            scheduled_date TEXT,
-            date_given TEXT,
-            status TEXT DEFAULT 'pending',
-            location TEXT,
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Time Capsule table
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS time_capsules (
-            id {pk},
-            child_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            letter_content TEXT,
-            unlock_date TEXT NOT NULL,
-            unlock_occasion TEXT,
-            is_sealed INTEGER DEFAULT 0,
-            sealed_at TIMESTAMP,
-            opened_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Capsule Media (photos, audio, video)
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS capsule_media (
-            id {pk},
-            capsule_id INTEGER NOT NULL,
-            media_type TEXT NOT NULL,
-            file_url TEXT NOT NULL,
-            thumbnail_url TEXT,
-            caption TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Family Access - Multi-parent sharing
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS family_access (
-            id {pk},
-            child_id INTEGER NOT NULL,
-            user_id INTEGER,
-            invite_code TEXT UNIQUE,
-            invite_email TEXT,
-            role TEXT DEFAULT 'viewer',
-            status TEXT DEFAULT 'pending',
-            invited_by INTEGER NOT NULL,
-            accepted_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Scheduled Letters - Time Capsule upgrade
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS scheduled_letters (
-            id {pk},
-            child_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            content TEXT,
-            unlock_date TEXT NOT NULL,
-            unlock_occasion TEXT,
-            is_sent INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Health Insights Cache
-    exec_sql(f"""
-        CREATE TABLE IF NOT EXISTS health_insights (
-            id {pk},
-            child_id INTEGER NOT NULL,
-            insight_type TEXT NOT NULL,
-            insight_data TEXT,
-            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
 
+def schema_is_current():
+    """Cheap check: True when the database is at SCHEMA_VERSION."""
+    db = get_catalog_db()
     try:
-        db.commit()
+        cur = db.execute('SELECT version FROM schema_version')
+        row = cur.fetchone()
     except Exception:
-        pass
+        return False
+    if not row:
+        return False
+    try:
+        version = row['version']
+    except Exception:
+        version = row[0]
+    return version >= SCHEMA_VERSION
+
+
+def ensure_schema():
+    """Verify the schema once per process, creating it if allowed.
+
+    Replaces running every CREATE TABLE on import: a worker now does a single
+    SELECT on its first request and only falls back to init_db() when the
+    database is new or behind (and DB_AUTO_MIGRATE is on).
+    """
+    global _schema_checked
+    if _schema_checked:
+        return
+    if not schema_is_current():
+        if not DB_AUTO_MIGRATE:
+            raise RuntimeError(
+                'Database schema is out of date; run `flask --app app db-migrate`.')
+        try:
+            init_db(log=logger.info)
+        except Exception:
+            # Another worker may have migrated concurrently
+            get_catalog_db().rollback()
+            if not schema_is_current():
+                raise
+    _schema_checked = True
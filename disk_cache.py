@@ -0,0 +1,28 @@
+"""
+Size limits for the on-disk render caches (milestone cards, growth reports).
+
+Cache readers refresh a file's mtime when they serve it, so the mtime is its
+last use; evict_lru() deletes the oldest files until the directory fits.
+"""
+import os
+
+
+def evict_lru(directory, max_bytes):
+    """Delete least-recently-used files until `directory` fits. Returns count."""
+    try:
+        entries = [e for e in os.scandir(directory) if e.is_file()]
+    except FileNotFoundError:
+        return 0
+    files = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries)
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,519 @@
+"""
+Printable growth reports (Kartu Menuju Sehat) for clinics and posyandu.
+
+A report holds the child's measurements plotted against the WHO Child Growth
+Standards (weight-for-age and length/height-for-age), a table of every
+measurement with its nutrition-status band, the immunization record and
+the milestones reached. It is one self-contained HTML page with inline SVG
+charts and A4 print styles, so any browser prints it or saves it as PDF.
+A server-side PDF needs WeasyPrint, which is optional and imported lazily.
+
+Reports are cached on disk under REPORT_CACHE_DIR, keyed by the child's
+data_version (bumped by database triggers on every write to what the report
+shows, see migration 12) and TEMPLATE_VERSION. A cache hit costs one query
+for the version; the URL carries it too, so the browser can keep a report
+for good. Writing a child's new report removes its older ones, and the
+`report-cache-evict` job trims the directory to REPORT_CACHE_MAX_MB,
+least-recently-served first.
+
+prerender() renders many reports at once for a posyandu session: the data
+is read in a few set-based queries in this process and the rendering is
+spread over a process pool, as it is pure CPU work.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
+
+import dates
+from db import DATABASE_DIR
+from disk_cache import evict_lru
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout changes so cached reports are re-rendered
+TEMPLATE_VERSION = 1
+
+REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', os.path.join(DATABASE_DIR, 'reports'))
+REPORT_CACHE_MAX_MB = int(os.environ.get('REPORT_CACHE_MAX_MB', '256'))
+# Processes used by prerender(); 0 means one per CPU
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '0'))
+
+# A served report's mtime is refreshed at most this often
+TOUCH_INTERVAL = 3600
+
+MIMETYPES = {'html': 'text/html', 'pdf': 'application/pdf'}
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+DAYS_PER_MONTH = 30.4375
+MAX_MONTHS = 60
+
+# WHO Child Growth Standards (2006) at selected ages, interpolated linearly
+# in between; close enough for a chart and a status band, not for clinical
+# z-scores.
+# Weight-for-age in kg: (month, -3 SD, -2 SD, median, +2 SD)
+WEIGHT_FOR_AGE = {
+    'L': [
+        (0, 2.1, 2.5, 3.3, 4.4), (1, 2.9, 3.4, 4.5, 5.8), (2, 3.8, 4.3, 5.6, 7.1),
+        (3, 4.4, 5.0, 6.4, 8.0), (4, 4.9, 5.6, 7.0, 8.7), (5, 5.3, 6.0, 7.5, 9.3),
+        (6, 5.7, 6.4, 7.9, 9.8), (9, 6.4, 7.1, 8.9, 11.0), (12, 6.9, 7.7, 9.6, 12.0),
+        (15, 7.4, 8.3, 10.3, 12.8), (18, 7.8, 8.8, 10.9, 13.7), (21, 8.2, 9.2, 11.5, 14.5),
+        (24, 8.6, 9.7, 12.2, 15.3), (30, 9.4, 10.5, 13.3, 16.9), (36, 10.0, 11.3, 14.3, 18.3),
+        (42, 10.6, 12.0, 15.3, 19.7), (48, 11.2, 12.7, 16.3, 21.2), (54, 11.7, 13.4, 17.3, 22.7),
+        (60, 12.2, 14.1, 18.3, 24.2),
+    ],
+    'P': [
+        (0, 2.0, 2.4, 3.2, 4.2), (1, 2.7, 3.2, 4.2, 5.5), (2, 3.4, 3.9, 5.1, 6.6),
+        (3, 4.0, 4.5, 5.8, 7.5), (4, 4.4, 5.0, 6.4, 8.2), (5, 4.8, 5.4, 6.9, 8.8),
+        (6, 5.1, 5.7, 7.3, 9.3), (9, 5.7, 6.5, 8.2, 10.5), (12, 6.3, 7.0, 8.9, 11.5),
+        (15, 6.7, 7.6, 9.6, 12.4), (18, 7.2, 8.1, 10.2, 13.2), (21, 7.6, 8.6, 10.9, 14.0),
+        (24, 8.1, 9.0, 11.5, 14.8), (30, 8.9, 10.0, 12.7, 16.5), (36, 9.6, 10.8, 13.9, 18.1),
+        (42, 10.3, 11.6, 15.0, 19.8), (48, 10.9, 12.3, 16.1, 21.5), (54, 11.5, 13.0, 17.2, 23.2),
+        (60, 12.1, 13.7, 18.2, 24.9),
+    ],
+}
+# Length (to 24 months) / height-for-age in cm: (month, -2 SD, median).
+# This indicator is normally distributed, so the other lines follow.
+_HEIGHT_FOR_AGE = {
+    'L': [
+        (0, 46.1, 49.9), (1, 50.8, 54.7), (2, 54.4, 58.4), (3, 57.3, 61.4), (4, 59.7, 63.9),
+        (5, 61.7, 65.9), (6, 63.3, 67.6), (9, 67.5, 72.0), (12, 71.0, 75.7), (15, 74.1, 79.1),
+        (18, 76.9, 82.3), (21, 79.4, 85.1), (24, 81.7, 87.8), (30, 85.1, 91.9), (36, 88.7, 96.1),
+        (42, 91.9, 99.9), (48, 94.9, 103.3), (54, 97.8, 106.7), (60, 100.7, 110.0),
+    ],
+    'P': [
+        (0, 45.4, 49.1), (1, 49.8, 53.7), (2, 53.0, 57.1), (3, 55.6, 59.8), (4, 57.8, 62.1),
+        (5, 59.6, 64.0), (6, 61.2, 65.7), (9, 65.3, 70.1), (12, 68.9, 74.0), (15, 72.0, 77.5),
+        (18, 74.9, 80.7), (21, 77.5, 83.7), (24, 80.0, 86.4), (30, 83.6, 90.7), (36, 87.4, 95.1),
+        (42, 90.9, 99.0), (48, 94.1, 102.7), (54, 97.1, 106.2), (60, 99.9, 109.4),
+    ],
+}
+HEIGHT_FOR_AGE = {
+    sex: [(m, med - 1.5 * (med - m2), m2, med, 2 * med - m2) for m, m2, med in rows]
+    for sex, rows in _HEIGHT_FOR_AGE.items()
+}
+
+# Status bands (Permenkes 2/2020 names) by the SD line the value is below;
+# the last entry applies above every line
+WEIGHT_STATUS = [('Berat badan sangat kurang', 'severe'), ('Berat badan kurang', 'warn'),
+                 ('Normal', 'ok'), ('Normal', 'ok'), ('Risiko berat badan lebih', 'warn')]
+HEIGHT_STATUS = [('Sangat pendek', 'severe'), ('Pendek', 'warn'),
+                 ('Normal', 'ok'), ('Normal', 'ok'), ('Normal', 'ok')]
+
+CHART_WIDTH, CHART_HEIGHT = 680, 300
+_PAD_LEFT, _PAD_RIGHT, _PAD_TOP, _PAD_BOTTOM = 44, 12, 12, 34
+
+_env = None
+_env_lock = threading.Lock()
+
+
+def pdf_available():
+    try:
+        import weasyprint  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def formats():
+    return ['html', 'pdf'] if pdf_available() else ['html']
+
+
+def sex_key(gender):
+    """'Laki-laki' -> 'L', 'Perempuan' -> 'P', anything else None."""
+    value = str(gender or '').strip().lower()
+    if value.startswith('l') or value in ('m', 'male'):
+        return 'L'
+    if value.startswith('p') or value in ('f', 'female'):
+        return 'P'
+    return None
+
+
+def reference_at(table, month):
+    """The (-3, -2, median, +2 SD) line values at `month`, interpolated."""
+    if month < 0 or month > MAX_MONTHS:
+        return None
+    for (m0, *lo), (m1, *hi) in zip(table, table[1:]):
+        if m0 <= month <= m1:
+            f = (month - m0) / (m1 - m0)
+            return tuple(a + (b - a) * f for a, b in zip(lo, hi))
+    return None
+
+
+def status(table, bands, month, value):
+    """(label, level) of a measurement, or None without a reference."""
+    if value is None or month is None:
+        return None
+    lines = reference_at(table, month)
+    if lines is None:
+        return None
+    for i, line in enumerate(lines):
+        if value < line:
+            return bands[i]
+    return bands[-1]
+
+
+def to_number(value):
+    """A stored measurement as a positive float, None if missing or invalid."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def age_text(days):
+    """Age in days -> '1 th 3 bln' / '5 bln' / '12 hr'."""
+    if days is None or days < 0:
+        return '-'
+    months = int(days // DAYS_PER_MONTH)
+    if months == 0:
+        return f'{days} hr'
+    years, months = divmod(months, 12)
+    if years and months:
+        return f'{years} th {months} bln'
+    return f'{years} th' if years else f'{months} bln'
+
+
+def report_version(data_version):
+    """Version token of a report URL and file name."""
+    return f'd{data_version or 0}v{TEMPLATE_VERSION}'
+
+
+# -- data
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def load_many(db, child_ids):
+    """Report data of many children in four queries per 500 children.
+
+    Returns {child_id: data}; the dicts hold plain values only, so they can
+    be sent to worker processes.
+    """
+    reports = {}
+    for chunk in _chunks(list(child_ids), 500):
+        marks = ','.join('?' * len(chunk))
+        for row in db.execute(f'''
+            SELECT id, name, dob, gender, blood_type, data_version FROM children
+            WHERE id IN ({marks})
+        ''', tuple(chunk)):
+            reports[row['id']] = {
+                'id': row['id'], 'name': row['name'], 'dob': row['dob'], 'gender': row['gender'],
+                'blood_type': row['blood_type'], 'data_version': row['data_version'] or 0,
+                'growth': [], 'immunization': [], 'milestones': [],
+            }
+        for row in db.execute(f'''
+            SELECT child_id, record_date, age_days, weight, height, head_circ FROM growth
+            WHERE child_id IN ({marks}) ORDER BY child_id, record_day, id
+        ''', tuple(chunk)):
+            reports[row['child_id']]['growth'].append({
+                'date': row['record_date'], 'age_days': row['age_days'],
+                'weight': to_number(row['weight']), 'height': to_number(row['height']),
+                'head_circ': to_number(row['head_circ']),
+            })
+        for row in db.execute(f'''
+            SELECT child_id, vaccine, scheduled_date, date_given, status FROM immunization
+            WHERE child_id IN ({marks})
+            ORDER BY child_id, scheduled_date IS NULL, scheduled_date, date_given
+        ''', tuple(chunk)):
+            reports[row['child_id']]['immunization'].append({
+                'vaccine': row['vaccine'], 'scheduled': row['scheduled_date'],
+                'given': row['date_given'], 'done': row['status'] == 'done',
+            })
+        for row in db.execute(f'''
+            SELECT child_id, milestone, status, noted FROM development
+            WHERE child_id IN ({marks}) ORDER BY child_id, id
+        ''', tuple(chunk)):
+            reports[row['child_id']]['milestones'].append({
+                'milestone': row['milestone'], 'noted': row['noted'], 'done': row['status'] == 'done',
+            })
+    return reports
+
+
+def load_report_data(db, child_id):
+    return load_many(db, [child_id]).get(child_id)
+
+
+# -- rendering
+
+def _nice_step(span, ticks):
+    raw = span / ticks
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for factor in (1, 2, 5, 10):
+        if raw <= factor * magnitude:
+            return factor * magnitude
+    return 10 * magnitude
+
+
+def chart_svg(points, table, unit):
+    """SVG chart of (month, value) points over the WHO lines of `table`.
+
+    `table` may be None (sex not recorded): only the child's curve is drawn.
+    """
+    last = max((m for m, _ in points), default=0)
+    months = min(MAX_MONTHS, max(12, math.ceil(last / 6) * 6))
+    values = [v for _, v in points]
+    if table:
+        lines = [reference_at(table, m) for m in range(months + 1)]
+        values += [lines[0][0], lines[-1][-1]]
+    low, high = min(values), max(values)
+    step = _nice_step(max(high - low, 1), 6)
+    low = math.floor(low / step) * step
+    high = math.ceil(high / step) * step
+
+    plot_w = CHART_WIDTH - _PAD_LEFT - _PAD_RIGHT
+    plot_h = CHART_HEIGHT - _PAD_TOP - _PAD_BOTTOM
+
+    def x(month):
+        return _PAD_LEFT + plot_w * month / months
+
+    def y(value):
+        return _PAD_TOP + plot_h * (high - value) / (high - low)
+
+    def path(coords):
+        return ' '.join(f'{x(m):.1f},{y(v):.1f}' for m, v in coords)
+
+    parts = []
+    if table:
+        band = [(m, lines[m][1]) for m in range(months + 1)]
+        upper = [(m, lines[m][3]) for m in range(months, -1, -1)]
+        lower = [(m, lines[m][0]) for m in range(months, -1, -1)]
+        parts.append(f'<polygon class="band-ok" points="{path(band + upper)}"/>')
+        parts.append(f'<polygon class="band-warn" points="{path(band + lower)}"/>')
+        for i, name in ((0, 'sd3'), (1, 'sd2'), (2, 'median'), (3, 'sd2')):
+            parts.append(f'<polyline class="{name}" points="{path((m, lines[m][i]) for m in range(months + 1))}"/>')
+
+    grid = []
+    value = low
+    while value <= high + step / 2:
+        grid.append(f'<line class="grid" x1="{_PAD_LEFT}" x2="{CHART_WIDTH - _PAD_RIGHT}" '
+                    f'y1="{y(value):.1f}" y2="{y(value):.1f}"/>'
+                    f'<text class="tick" x="{_PAD_LEFT - 6}" y="{y(value) + 4:.1f}" text-anchor="end">'
+                    f'{value:g}</text>')
+        value += step
+    month_step = 3 if months <= 24 else 6
+    for month in range(0, months + 1, month_step):
+        grid.append(f'<line class="grid" x1="{x(month):.1f}" x2="{x(month):.1f}" '
+                    f'y1="{_PAD_TOP}" y2="{CHART_HEIGHT - _PAD_BOTTOM}"/>'
+                    f'<text class="tick" x="{x(month):.1f}" y="{CHART_HEIGHT - _PAD_BOTTOM + 14}" '
+                    f'text-anchor="middle">{month}</text>')
+
+    shown = [(m, v) for m, v in points if m <= months]
+    if shown:
+        parts.append(f'<polyline class="child" points="{path(shown)}"/>')
+        parts.extend(f'<circle class="child-dot" cx="{x(m):.1f}" cy="{y(v):.1f}" r="3.5"/>'
+                     for m, v in shown)
+
+    return Markup(
+        f'<svg xmlns="http://www.w3.org/2000/svg" class="chart" viewBox="0 0 {CHART_WIDTH} {CHART_HEIGHT}">'
+        f'{"".join(grid)}{"".join(parts)}'
+        f'<text class="axis" x="{_PAD_LEFT + plot_w / 2:.0f}" y="{CHART_HEIGHT - 4}" '
+        f'text-anchor="middle">Umur (bulan)</text>'
+        f'<text class="axis" x="12" y="{_PAD_TOP + plot_h / 2:.0f}" text-anchor="middle" '
+        f'transform="rotate(-90 12 {_PAD_TOP + plot_h / 2:.0f})">{unit}</text>'
+        f'</svg>')
+
+
+def report_context(data):
+    """Template variables of a report."""
+    sex = sex_key(data['gender'])
+    weights, heights, rows = [], [], []
+    for g in data['growth']:
+        month = g['age_days'] / DAYS_PER_MONTH if g['age_days'] is not None else None
+        weight_status = height_status = None
+        if month is not None and sex:
+            weight_status = status(WEIGHT_FOR_AGE[sex], WEIGHT_STATUS, month, g['weight'])
+            height_status = status(HEIGHT_FOR_AGE[sex], HEIGHT_STATUS, month, g['height'])
+        if month is not None and 0 <= month <= MAX_MONTHS:
+            if g['weight']:
+                weights.append((month, g['weight']))
+            if g['height']:
+                heights.append((month, g['height']))
+        rows.append(dict(g, date=dates.format_long(g['date']), age=age_text(g['age_days']),
+                         weight_status=weight_status, height_status=height_status))
+
+    charts = []
+    for title, points, tables, unit in (
+            ('Berat Badan menurut Umur', weights, WEIGHT_FOR_AGE, 'kg'),
+            ('Panjang/Tinggi Badan menurut Umur', heights, HEIGHT_FOR_AGE, 'cm')):
+        if points:
+            charts.append({'title': title, 'svg': chart_svg(points, tables.get(sex), unit)})
+
+    beyond = any(g['age_days'] is not None and g['age_days'] / DAYS_PER_MONTH > MAX_MONTHS
+                 for g in data['growth'])
+    return {
+        'child': data,
+        'sex_label': {'L': 'Laki-laki', 'P': 'Perempuan'}.get(sex, '-'),
+        'dob': dates.format_long(data['dob']) or '-',
+        'measurements': rows,
+        'latest': rows[-1] if rows else None,
+        'charts': charts,
+        'has_reference': sex is not None,
+        'beyond_reference': beyond,
+        'immunization': [dict(v, scheduled=dates.format_long(v['scheduled']),
+                              given=dates.format_long(v['given']))
+                         for v in data['immunization']],
+        'milestones_done': [dict(m, noted=dates.format_long(m['noted']))
+                            for m in data['milestones'] if m['done']],
+        'milestones_pending': sum(1 for m in data['milestones'] if not m['done']),
+        'version': report_version(data['data_version']),
+        'generated': dates.format_long(date.today().isoformat()),
+    }
+
+
+def _environment():
+    # Its own Jinja environment rather than Flask's, so worker processes
+    # can render without an app
+    global _env
+    with _env_lock:
+        if _env is None:
+            _env = Environment(loader=FileSystemLoader(TEMPLATES_DIR),
+                               autoescape=select_autoescape(['html']))
+    return _env
+
+
+def render_html(data):
+    html = _environment().get_template('growth_report.html').render(report_context(data))
+    return html.encode('utf-8')
+
+
+def render_pdf(data):
+    from weasyprint import HTML
+    return HTML(string=render_html(data).decode('utf-8')).write_pdf()
+
+
+def render(data, fmt):
+    return render_pdf(data) if fmt == 'pdf' else render_html(data)
+
+
+# -- cache
+
+def cache_path(child_id, data_version, fmt):
+    return os.path.join(REPORT_CACHE_DIR, f'{child_id}-{report_version(data_version)}.{fmt}')
+
+
+def cached(child_id, data_version, fmt):
+    """Path of an up-to-date cached report, or None."""
+    path = cache_path(child_id, data_version, fmt)
+    try:
+        # LRU bookkeeping for evict(), coarse so Last-Modified stays put
+        if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        pass
+    return path
+
+
+def _remove_stale(child_id, version=None):
+    """Delete the child's cached reports other than those of `version`."""
+    try:
+        entries = list(os.scandir(REPORT_CACHE_DIR))
+    except FileNotFoundError:
+        return 0
+    current = f'{child_id}-{version}.'
+    removed = 0
+    for entry in entries:
+        name = entry.name
+        if name.startswith(f'{child_id}-') and not name.startswith(current) and not name.endswith('.tmp'):
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def get_report(data, fmt):
+    """Path of the child's cached report, rendering it first if needed."""
+    path = cached(data['id'], data['data_version'], fmt)
+    if path:
+        return path
+    path = cache_path(data['id'], data['data_version'], fmt)
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(render(data, fmt))
+    os.replace(tmp, path)
+    _remove_stale(data['id'], report_version(data['data_version']))
+    return path
+
+
+def forget(child_id):
+    """Remove a (deleted) child's cached reports."""
+    return _remove_stale(child_id)
+
+
+def _render_one(data, fmt):
+    return get_report(data, fmt)
+
+
+def prerender(db, child_ids=None, user_id=None, fmt='html', workers=None):
+    """Render the reports that are missing or stale, across a process pool.
+
+    Covers `child_ids`, or the children of `user_id` (e.g. a posyandu
+    account), or every child in `db`. Returns ({child_id: path}, rendered).
+    """
+    sql = 'SELECT id, data_version FROM children'
+    params = ()
+    if child_ids is not None:
+        child_ids = list(child_ids)
+        if not child_ids:
+            return {}, 0
+        sql += f" WHERE id IN ({','.join('?' * len(child_ids))})"
+        params = tuple(child_ids)
+    elif user_id is not None:
+        sql += ' WHERE user_id = ?'
+        params = (user_id,)
+    paths, stale = {}, []
+    for row in db.execute(sql, params).fetchall():
+        path = cached(row['id'], row['data_version'], fmt)
+        if path:
+            paths[row['id']] = path
+        else:
+            stale.append(row['id'])
+    if not stale:
+        return paths, 0
+
+    workers = min(workers or REPORT_WORKERS or os.cpu_count() or 1, len(stale))
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # A chunk at a time, so the parent never holds every child's data
+        for chunk in _chunks(stale, 200):
+            batch = list(load_many(db, chunk).values())
+            if pool is None:
+                rendered = [get_report(data, fmt) for data in batch]
+            else:
+                rendered = pool.map(_render_one, batch, [fmt] * len(batch),
+                                    chunksize=max(1, len(batch) // (workers * 4)))
+            for data, path in zip(batch, rendered):
+                paths[data['id']] = path
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return paths, len(stale)
+
+
+def evict(max_bytes=None):
+    """Delete least-recently-used reports until the cache fits. Returns count."""
+    max_bytes = REPORT_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    return evict_lru(REPORT_CACHE_DIR, max_bytes)
+
+
+@job('report-cache-evict', every=3600, per_database=False)
+def evict_job():
+    removed = evict()
+    if removed:
+        logger.info('Evicted %d cached growth reports', removed)
@@ -0,0 +1,46 @@
+"""
+Gunicorn configuration for BabyGrow.
+Gunicorn picks this file up automatically from the working directory,
+so the Procfile / render.yaml start command stays `gunicorn app:app`.
+
+Serving profiles (GUNICORN_PROFILE):
+  sync    - default gunicorn workers, one request per worker at a time
+  gthread - N threads per worker; a slow upload or slow MySQL query only
+            blocks its own thread
+  gevent  - cooperative greenlets for many concurrent, mostly-waiting
+            clients (requires `pip install gevent`); MySQL switches to the
+            pure-Python driver so socket I/O yields. Meant for DB_TYPE=mysql:
+            SQLite calls block the whole event loop while waiting on a lock.
+
+Compare them with tools/bench_workers.py.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+
+# Import the app once in the master and fork workers from it, so each worker
+# boots without re-importing Flask and the templates. Safe because no DB
+# connection is opened at import time (see db.ensure_schema).
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+profile = os.environ.get('GUNICORN_PROFILE', 'sync')
+
+if profile == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+    # mysql-connector caps a pool at 32 connections
+    os.environ.setdefault('MYSQL_POOL_SIZE', str(min(threads, 32)))
+elif profile == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '500'))
+    os.environ.setdefault('MYSQL_USE_PURE', '1')
+    os.environ.setdefault('MYSQL_POOL_SIZE', os.environ.get('GUNICORN_DB_CONNECTIONS', '32'))
+    # Never preload: the app's module-level locks (MySQL pool, profiler)
+    # would be created in the master as real OS locks before the worker
+    # monkey-patches, and a greenlet yielding while holding one deadlocks
+    # the worker. Each worker imports the app after patching instead.
+    preload_app = False
+
+# Uploads from slow mobile connections can take a while
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
@@ -0,0 +1,168 @@
+"""
+National immunization schedule (Kemenkes program + IDAI recommendations).
+
+Every child gets the full schedule materialized as `immunization` rows when
+they are added, and pending rows are re-dated when the date of birth is
+edited. Because every dose then has a `scheduled_date`, questions like "who
+is due this week" are a single range scan over the (status, scheduled_day)
+index, shared by the dashboard, the .ics export and reminders.
+"""
+import calendar
+from datetime import date
+
+import dates
+
+# (vaccine, age in months). Names match the options in add_immunization.html.
+NATIONAL_SCHEDULE = [
+    ('Hepatitis B (HB-0)', 0),
+    ('BCG', 1),
+    ('Polio 1 (OPV)', 1),
+    ('DPT-HB-Hib 1', 2),
+    ('Polio 2 (OPV)', 2),
+    ('PCV 1', 2),
+    ('Rotavirus 1', 2),
+    ('DPT-HB-Hib 2', 3),
+    ('Polio 3 (OPV)', 3),
+    ('PCV 2', 3),
+    ('Rotavirus 2', 3),
+    ('DPT-HB-Hib 3', 4),
+    ('Polio 4 (IPV)', 4),
+    ('Rotavirus 3', 4),
+    ('Campak/MR 1', 9),
+    ('IPV 2', 9),
+    ('PCV 3', 12),
+    ('DPT-HB-Hib Lanjutan', 18),
+    ('Campak/MR Lanjutan', 18),
+]
+
+
+def add_months(start, months):
+    """Calendar-month addition, clamped to the end of shorter months."""
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+
+def schedule_for(dob):
+    """Return [(vaccine, scheduled_date_str)] for a date of birth string."""
+    birth = dates.parse(dob)
+    return [(vaccine, add_months(birth, months).isoformat())
+            for vaccine, months in NATIONAL_SCHEDULE]
+
+
+def materialize_schedule(db, child_id, dob):
+    """Create missing schedule rows and re-date pending ones for a child.
+
+    Doses already given keep their dates; doses the parent added by hand
+    under a name outside the national schedule are left alone. Does not
+    commit, so callers can fold it into their own transaction.
+    """
+    if not dob:
+        return 0
+    try:
+        planned = schedule_for(dob)
+    except ValueError:
+        return 0
+
+    cur = db.execute('SELECT id, vaccine, status FROM immunization WHERE child_id=?', (child_id,))
+    existing = {row['vaccine']: row for row in cur.fetchall()}
+
+    inserts = []
+    updates = []
+    for vaccine, scheduled_date in planned:
+        row = existing.get(vaccine)
+        if row is None:
+            inserts.append((child_id, vaccine, scheduled_date, 'pending'))
+        elif row['status'] != 'done':
+            updates.append((scheduled_date, row['id']))
+
+    if inserts:
+        db.executemany('''
+            INSERT INTO immunization (child_id, vaccine, scheduled_date, status)
+            VALUES (?, ?, ?, ?)
+        ''', inserts)
+    if updates:
+        db.executemany('UPDATE immunization SET scheduled_date=? WHERE id=?', updates)
+    return len(inserts)
+
+
+def _due_where(start, end, user_id, child_id):
+    sql = "i.status = 'pending' AND i.scheduled_day <= ?"
+    params = [dates.to_day(end)]
+    if start is not None:
+        sql += ' AND i.scheduled_day >= ?'
+        params.append(dates.to_day(start))
+    if user_id is not None:
+        sql += ' AND c.user_id = ?'
+        params.append(user_id)
+    if child_id is not None:
+        sql += ' AND i.child_id = ?'
+        params.append(child_id)
+    return sql, params
+
+
+def due_doses(db, start, end, user_id=None, child_id=None, limit=None):
+    """Pending doses with scheduled_date in [start, end], soonest first.
+
+    `start`/`end` are ISO date strings (compared as epoch days against the
+    indexed scheduled_day); pass start=None for everything
+    overdue up to `end`. Filtered to one user's or one child's doses when
+    given, otherwise spans all children (for reminder jobs). At most
+    `limit` rows when given.
+    """
+    where, params = _due_where(start, end, user_id, child_id)
+    sql = f'''
+        SELECT i.id, i.child_id, i.vaccine, i.scheduled_date, c.name AS child_name, c.user_id
+        FROM immunization i
+        JOIN children c ON c.id = i.child_id
+        WHERE {where}
+        ORDER BY i.scheduled_day
+    '''
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return db.execute(sql, tuple(params)).fetchall()
+
+
+def count_due(db, start, end, user_id=None, child_id=None):
+    """Number of doses due_doses() would return without a limit."""
+    where, params = _due_where(start, end, user_id, child_id)
+    return db.execute(f'''
+        SELECT COUNT(*) FROM immunization i JOIN children c ON c.id = i.child_id WHERE {where}
+    ''', tuple(params)).fetchone()[0]
+
+
+def record_doses(db, doses):
+    """Record given/planned doses, filling in scheduled rows where possible.
+
+    `doses` is a list of (child_id, vaccine, date_given, status). A dose
+    matching a still-pending scheduled row of the same child updates that
+    row instead of creating a duplicate next to it. Does not commit.
+    """
+    if not doses:
+        return
+    child_ids = sorted({d[0] for d in doses})
+    placeholders = ','.join('?' * len(child_ids))
+    cur = db.execute(f'''
+        SELECT id, child_id, vaccine FROM immunization
+        WHERE status = 'pending' AND child_id IN ({placeholders})
+    ''', tuple(child_ids))
+    pending = {(row['child_id'], row['vaccine']): row['id'] for row in cur.fetchall()}
+
+    inserts = []
+    updates = []
+    for child_id, vaccine, date_given, status in doses:
+        row_id = pending.pop((child_id, vaccine), None)
+        if row_id is not None:
+            updates.append((date_given, status, row_id))
+        else:
+            inserts.append((child_id, vaccine, date_given, status))
+    if updates:
+        db.executemany('UPDATE immunization SET date_given=?, status=? WHERE id=?', updates)
+    if inserts:
+        db.executemany('''
+            INSERT INTO immunization (child_id, vaccine, date_given, status)
+            VALUES (?, ?, ?, ?)
+        ''', inserts)
@@ -0,0 +1,488 @@
+"""
+Where uploaded media live: the local disk or an S3-compatible bucket.
+
+Rows keep pointing at /static/uploads/<key> URLs whichever backend holds the
+bytes, so switching backends needs no schema change. MEDIA_STORE picks one:
+
+- `local` (default): files under static/uploads, served by Flask's static
+  route. Only works with a single instance, or a shared disk.
+- `s3`: objects under S3_PREFIX in S3_BUCKET at S3_ENDPOINT (AWS S3, MinIO,
+  R2, ...). Every instance sees the same media. /static/uploads/<key>
+  redirects to a presigned URL valid for MEDIA_URL_EXPIRES seconds, so the
+  bytes go from the bucket to the browser without passing through a worker.
+  The signing time is rounded down to half that period, so a page viewed
+  twice gets the same URL and the browser cache still works.
+
+Requests are signed with AWS Signature Version 4 using only the standard
+library. Uploads are streamed: a file larger than MEDIA_PART_SIZE is sent as
+a multipart upload, one part at a time, so a worker never holds more than
+one part in memory. Connections are kept alive per thread.
+
+`flask media-migrate` copies static/uploads into the bucket with
+MEDIA_MIGRATE_WORKERS threads; files already there with the same size are
+skipped, so an interrupted run can simply be restarted. Without real
+credentials, `python tools/s3_standin.py` serves a local bucket.
+"""
+import hashlib
+import hmac
+import http.client
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+UPLOADS_DIR = os.path.join(BASE_DIR, 'static', 'uploads')
+UPLOADS_URL_PREFIX = '/static/uploads/'
+
+MEDIA_STORE = os.environ.get('MEDIA_STORE', 'local').lower()
+S3_ENDPOINT = os.environ.get('S3_ENDPOINT', 'https://s3.amazonaws.com')
+# The endpoint browsers reach, if it differs (e.g. a container network)
+S3_PUBLIC_ENDPOINT = os.environ.get('S3_PUBLIC_ENDPOINT', S3_ENDPOINT)
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY', '')
+S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY', '')
+S3_PREFIX = os.environ.get('S3_PREFIX', 'uploads/')
+# Path-style URLs (endpoint/bucket/key) work with MinIO and most clones;
+# S3_PATH_STYLE=0 uses bucket.endpoint/key
+S3_PATH_STYLE = os.environ.get('S3_PATH_STYLE', '1') == '1'
+S3_TIMEOUT = float(os.environ.get('S3_TIMEOUT', '30'))
+MEDIA_URL_EXPIRES = int(os.environ.get('MEDIA_URL_EXPIRES', '3600'))
+# S3 requires at least 5 MB for every part but the last
+MEDIA_PART_SIZE = max(5, int(os.environ.get('MEDIA_PART_SIZE_MB', '8'))) * 1024 * 1024
+MEDIA_MIGRATE_WORKERS = int(os.environ.get('MEDIA_MIGRATE_WORKERS', '8'))
+
+_S3_NS = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class MediaStoreError(OSError):
+    pass
+
+
+def url_to_path(file_url):
+    """Filesystem path for an upload URL, or None if it is not an upload."""
+    if not file_url or not file_url.startswith(UPLOADS_URL_PREFIX):
+        return None
+    path = os.path.normpath(os.path.join(BASE_DIR, file_url.lstrip('/')))
+    if not path.startswith(UPLOADS_DIR + os.sep):
+        return None
+    return path
+
+
+def url_to_key(file_url):
+    """Store key ('capsules/x.jpg') of an upload URL, or None if it is not one."""
+    path = url_to_path(file_url)
+    if path is None:
+        return None
+    return os.path.relpath(path, UPLOADS_DIR).replace(os.sep, '/')
+
+
+def key_to_url(key):
+    return UPLOADS_URL_PREFIX + key
+
+
+def _chunks(stream, size):
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class LocalStore:
+    """Files under a directory (static/uploads)."""
+    name = 'local'
+
+    def __init__(self, root=UPLOADS_DIR):
+        self.root = root
+
+    def path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise MediaStoreError(f'Invalid media key: {key}')
+        return path
+
+    def save(self, key, stream, content_type=None):
+        """Write `stream` to `key`; returns the size in bytes."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                shutil.copyfileobj(stream, f, MEDIA_PART_SIZE)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return os.path.getsize(path)
+
+    def save_file(self, key, src_path, content_type=None):
+        """Move a finished local file to `key`; returns the size in bytes."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(src_path, path)
+        return os.path.getsize(path)
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def size(self, key):
+        """Size in bytes, or None if there is no such file."""
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        """Raises FileNotFoundError if there is nothing to delete."""
+        os.remove(self.path(key))
+
+    def list(self, prefix=''):
+        """(key, size, mtime) of every file."""
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    st = os.stat(path)
+                    yield key, st.st_size, st.st_mtime
+
+    def url(self, key):
+        """Direct download URL; None as Flask's static route serves the file."""
+        return None
+
+    @contextmanager
+    def local_copy(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        yield path
+
+
+def _sign(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def signing_key(secret, datestamp, region, service='s3'):
+    key = _sign(('AWS4' + secret).encode(), datestamp)
+    key = _sign(key, region)
+    key = _sign(key, service)
+    return _sign(key, 'aws4_request')
+
+
+def canonical_query(params):
+    return '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                    for k, v in sorted(params.items()))
+
+
+def signature(secret, region, amz_date, method, path, query, headers, payload_hash):
+    """SigV4 signature of a request; `headers` are the signed ones, lower-case."""
+    signed = ';'.join(sorted(headers))
+    canonical = '\n'.join([
+        method, path, canonical_query(query),
+        ''.join(f'{name}:{headers[name].strip()}\n' for name in sorted(headers)),
+        signed, payload_hash])
+    scope = f'{amz_date[:8]}/{region}/s3/aws4_request'
+    to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                         hashlib.sha256(canonical.encode()).hexdigest()])
+    return hmac.new(signing_key(secret, amz_date[:8], region), to_sign.encode(),
+                    hashlib.sha256).hexdigest()
+
+
+class S3Store:
+    """Objects in an S3-compatible bucket."""
+    name = 's3'
+
+    def __init__(self, endpoint=S3_ENDPOINT, bucket=S3_BUCKET, access_key=S3_ACCESS_KEY,
+                 secret_key=S3_SECRET_KEY, region=S3_REGION, prefix=S3_PREFIX,
+                 path_style=S3_PATH_STYLE, public_endpoint=None):
+        if not bucket or not access_key or not secret_key:
+            raise MediaStoreError('MEDIA_STORE=s3 needs S3_BUCKET, S3_ACCESS_KEY and S3_SECRET_KEY')
+        self.endpoint = urlsplit(endpoint)
+        self.public_endpoint = urlsplit(public_endpoint or endpoint)
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.path_style = path_style
+        self._local = threading.local()
+
+    # -- addressing and signing
+
+    def _host_and_path(self, endpoint, key):
+        object_key = quote(self.prefix + key, safe='/~') if key is not None else ''
+        if self.path_style:
+            return endpoint.netloc, f'/{self.bucket}/{object_key}'
+        return f'{self.bucket}.{endpoint.netloc}', f'/{object_key}'
+
+    def _auth_headers(self, method, host, path, query, payload_hash, now=None):
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now))
+        headers = {'host': host, 'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date}
+        sig = signature(self.secret_key, self.region, amz_date, method, path, query,
+                        headers, payload_hash)
+        headers['Authorization'] = (
+            f'AWS4-HMAC-SHA256 Credential={self.access_key}/{amz_date[:8]}/{self.region}/s3/aws4_request, '
+            f'SignedHeaders={";".join(sorted(headers))}, Signature={sig}')
+        return headers
+
+    def presign(self, key, expires=MEDIA_URL_EXPIRES, now=None):
+        """Time-limited GET URL for `key`, signed for the public endpoint."""
+        host, path = self._host_and_path(self.public_endpoint, key)
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now))
+        query = {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f'{self.access_key}/{amz_date[:8]}/{self.region}/s3/aws4_request',
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(expires),
+            'X-Amz-SignedHeaders': 'host',
+        }
+        query['X-Amz-Signature'] = signature(self.secret_key, self.region, amz_date, 'GET', path,
+                                             query, {'host': host}, 'UNSIGNED-PAYLOAD')
+        return f'{self.public_endpoint.scheme}://{host}{path}?{canonical_query(query)}'
+
+    # -- transport
+
+    def _connect(self, host):
+        cls = http.client.HTTPSConnection if self.endpoint.scheme == 'https' else http.client.HTTPConnection
+        return cls(host, timeout=S3_TIMEOUT)
+
+    def _request(self, method, key=None, query=None, body=b'', headers=None, stream=False):
+        """(status, headers, body) of a signed request; with stream, the open response."""
+        query = query or {}
+        host, path = self._host_and_path(self.endpoint, key)
+        payload_hash = hashlib.sha256(body).hexdigest()
+        all_headers = self._auth_headers(method, host, path, query, payload_hash)
+        all_headers.update(headers or {})
+        target = path + ('?' + canonical_query(query) if query else '')
+        if stream:
+            # A response read later must not share a connection with others
+            conn = self._connect(host)
+            conn.request(method, target, body=body, headers=all_headers)
+            return conn.getresponse()
+        conns = self._local.__dict__.setdefault('conns', {})
+        for attempt in (1, 2):
+            conn = conns.get(host)
+            if conn is None:
+                conn = conns[host] = self._connect(host)
+            try:
+                conn.request(method, target, body=body, headers=all_headers)
+                response = conn.getresponse()
+                return response.status, response.headers, response.read()
+            except (http.client.HTTPException, OSError):
+                # A kept-alive connection the server closed; retry once on a new one
+                conn.close()
+                del conns[host]
+                if attempt == 2:
+                    raise
+
+    def _check(self, method, key, status, data, ok=(200,)):
+        if status == 404 and method in ('GET', 'HEAD', 'DELETE'):
+            raise FileNotFoundError(key)
+        if status not in ok:
+            code = _xml_text(data, 'Code') if data else ''
+            raise MediaStoreError(f'S3 {method} {key}: HTTP {status} {code}'.strip())
+
+    # -- operations
+
+    def save(self, key, stream, content_type=None):
+        """Upload `stream` to `key`, in parts if it is large; returns the size."""
+        headers = {'Content-Type': content_type} if content_type else {}
+        first = stream.read(MEDIA_PART_SIZE)
+        second = stream.read(MEDIA_PART_SIZE) if len(first) == MEDIA_PART_SIZE else b''
+        if not second:
+            status, _, data = self._request('PUT', key, body=first, headers=headers)
+            self._check('PUT', key, status, data)
+            return len(first)
+
+        status, _, data = self._request('POST', key, {'uploads': ''}, headers=headers)
+        self._check('POST', key, status, data)
+        upload_id = _xml_text(data, 'UploadId')
+        parts, size = [], 0
+        try:
+            rest = _chunks(stream, MEDIA_PART_SIZE)
+            for number, chunk in enumerate(_prepend((first, second), rest), 1):
+                status, response_headers, data = self._request(
+                    'PUT', key, {'partNumber': str(number), 'uploadId': upload_id}, body=chunk)
+                self._check('PUT', key, status, data)
+                parts.append((number, response_headers['ETag']))
+                size += len(chunk)
+            body = ('<CompleteMultipartUpload>' + ''.join(
+                f'<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>' for n, etag in parts)
+                + '</CompleteMultipartUpload>').encode()
+            status, _, data = self._request('POST', key, {'uploadId': upload_id}, body=body)
+            # The completion can fail with status 200 and an <Error> body
+            self._check('POST', key, 500 if b'<Error>' in data else status, data)
+        except BaseException:
+            try:
+                self._request('DELETE', key, {'uploadId': upload_id})
+            except Exception:
+                logger.warning('Could not abort multipart upload of %s', key)
+            raise
+        return size
+
+    def save_file(self, key, src_path, content_type=None):
+        """Upload a finished local file to `key` and remove it; returns the size."""
+        with open(src_path, 'rb') as f:
+            size = self.save(key, f, content_type)
+        os.remove(src_path)
+        return size
+
+    def open(self, key):
+        """Streaming response for `key` (file-like; close it when done)."""
+        response = self._request('GET', key, stream=True)
+        if response.status != 200:
+            data = response.read()
+            response.close()
+            self._check('GET', key, response.status, data)
+        return response
+
+    def read(self, key):
+        status, _, data = self._request('GET', key)
+        self._check('GET', key, status, data)
+        return data
+
+    def size(self, key):
+        status, headers, data = self._request('HEAD', key)
+        if status == 404:
+            return None
+        self._check('HEAD', key, status, data)
+        return int(headers['Content-Length'])
+
+    def delete(self, key):
+        # S3 answers 204 for missing keys too; look first so callers can count
+        if self.size(key) is None:
+            raise FileNotFoundError(key)
+        status, _, data = self._request('DELETE', key)
+        self._check('DELETE', key, status, data, ok=(200, 204))
+
+    def list(self, prefix=''):
+        """(key, size, mtime) of every object below S3_PREFIX."""
+        query = {'list-type': '2', 'prefix': self.prefix + prefix}
+        while True:
+            status, _, data = self._request('GET', None, query)
+            self._check('GET', '(list)', status, data)
+            root = ET.fromstring(data)
+            for item in root.iter(_S3_NS + 'Contents'):
+                key = item.findtext(_S3_NS + 'Key')[len(self.prefix):]
+                modified = datetime.fromisoformat(item.findtext(_S3_NS + 'LastModified'))
+                yield key, int(item.findtext(_S3_NS + 'Size')), modified.timestamp()
+            token = root.findtext(_S3_NS + 'NextContinuationToken')
+            if root.findtext(_S3_NS + 'IsTruncated') != 'true' or not token:
+                return
+            query['continuation-token'] = token
+
+    def url(self, key):
+        """Presigned URL, stable within half of MEDIA_URL_EXPIRES."""
+        window = max(1, MEDIA_URL_EXPIRES // 2)
+        now = int(time.time())
+        return self.presign(key, MEDIA_URL_EXPIRES, now - now % window)
+
+    @contextmanager
+    def local_copy(self, key):
+        """A temporary local file with the object's content (e.g. for ffmpeg)."""
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f, self.open(key) as response:
+                shutil.copyfileobj(response, f, MEDIA_PART_SIZE)
+            yield path
+        finally:
+            os.remove(path)
+
+
+def _prepend(chunks, rest):
+    yield from chunks
+    yield from rest
+
+
+def _xml_text(data, tag):
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError:
+        return ''
+    for element in root.iter():
+        if element.tag.rsplit('}', 1)[-1] == tag:
+            return element.text or ''
+    return ''
+
+
+def get_store():
+    """The configured media store (one per process)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if MEDIA_STORE == 's3':
+                    _store = S3Store(public_endpoint=S3_PUBLIC_ENDPOINT)
+                elif MEDIA_STORE == 'local':
+                    _store = LocalStore()
+                else:
+                    raise MediaStoreError(f'Unknown MEDIA_STORE: {MEDIA_STORE}')
+    return _store
+
+
+def migrate(source, target, workers=None, delete_source=False, log=print):
+    """Copy every file from `source` to `target` in parallel.
+
+    Files already in `target` with the same size are skipped. With
+    delete_source, a file is removed from `source` once its copy is
+    verified. Returns {'copied', 'skipped', 'failed', 'bytes'}.
+    """
+    report = {'copied': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+    lock = threading.Lock()
+
+    def copy(item):
+        key, size, _ = item
+        try:
+            if target.size(key) == size:
+                outcome = 'skipped'
+            else:
+                with source.open(key) as f:
+                    if target.save(key, f) != size:
+                        raise MediaStoreError(f'{key}: size changed while copying')
+                outcome = 'copied'
+            if delete_source:
+                source.delete(key)
+        except Exception as e:
+            log(f'{key}: {e}')
+            outcome = 'failed'
+        with lock:
+            report[outcome] += 1
+            if outcome == 'copied':
+                report['bytes'] += size
+            done = report['copied'] + report['skipped'] + report['failed']
+        if done % 500 == 0:
+            log(f'{done} files...')
+
+    files = (item for item in source.list() if not item[0].endswith('.tmp'))
+    with ThreadPoolExecutor(max_workers=workers or MEDIA_MIGRATE_WORKERS,
+                            thread_name_prefix='babygrow-media') as pool:
+        # map() would queue the whole listing up front; keep it bounded
+        pending = []
+        for item in files:
+            pending.append(pool.submit(copy, item))
+            if len(pending) >= 100 * (workers or MEDIA_MIGRATE_WORKERS):
+                for future in pending:
+                    future.result()
+                pending = []
+        for future in pending:
+            future.result()
+    return report
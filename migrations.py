@@ -0,0 +1,884 @@
+"""
+Versioned schema migrations for BabyGrow.
+
+Migrations are plain functions registered in order with @migration. Each one
+receives a MigrationContext that knows the SQL dialect (sqlite or mysql) and
+offers idempotent helpers, so the same migration runs on a fresh database and
+on one created by an older init_db()/seed.py.
+
+Applied migrations are recorded in `schema_migrations` together with a
+checksum of their source; editing a migration after it has been applied is
+reported as drift instead of silently diverging between environments. The
+single-row `schema_version` table is kept up to date as the cheap pointer
+read by db.schema_is_current().
+"""
+import hashlib
+import inspect
+import time
+from datetime import datetime
+
+MIGRATIONS = []
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migration(version, name):
+    """Register a migration function under an increasing version number."""
+    def decorator(fn):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise MigrationError(f'Migration {version} registered out of order')
+        MIGRATIONS.append(Migration(version, name, fn))
+        return fn
+    return decorator
+
+
+class Migration:
+    def __init__(self, version, name, fn):
+        self.version = version
+        self.name = name
+        self.fn = fn
+        source = inspect.getsource(fn)
+        self.checksum = hashlib.sha256(source.encode()).hexdigest()
+
+
+class MigrationContext:
+    """Dialect-aware helpers handed to each migration."""
+
+    def __init__(self, db, dialect, dry_run=False, log=print):
+        self.db = db
+        self.dialect = dialect
+        self.dry_run = dry_run
+        self.log = log
+        if dialect == 'mysql':
+            self.pk = 'INT AUTO_INCREMENT PRIMARY KEY'
+            # MySQL cannot put UNIQUE/INDEX on unbounded TEXT columns
+            self.key_text = 'VARCHAR(255)'
+        else:
+            self.pk = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+            self.key_text = 'TEXT'
+
+    def execute(self, sql, params=()):
+        if self.dry_run:
+            self.log('    [dry-run] ' + ' '.join(sql.split()))
+            return None
+        return self.db.execute(sql, params)
+
+    def query(self, sql, params=()):
+        """Run a read-only statement, also in dry-run mode."""
+        return self.db.execute(sql, params)
+
+    def column_exists(self, table, column):
+        if self.dialect == 'mysql':
+            cur = self.query('''
+                SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND COLUMN_NAME = ?
+            ''', (table, column))
+            return cur.fetchone() is not None
+        cur = self.query(f'PRAGMA table_info({table})')
+        return any(row['name'] == column for row in cur.fetchall())
+
+    def index_exists(self, name, table):
+        if self.dialect == 'mysql':
+            cur = self.query('''
+                SELECT INDEX_NAME FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND INDEX_NAME = ?
+            ''', (table, name))
+            return cur.fetchone() is not None
+        cur = self.query("SELECT name FROM sqlite_master WHERE type='index' AND name=?", (name,))
+        return cur.fetchone() is not None
+
+    def add_column(self, table, column, decl):
+        if not self.column_exists(table, column):
+            self.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+    def create_index(self, name, table, columns, unique=False):
+        if not self.index_exists(name, table):
+            kind = 'UNIQUE INDEX' if unique else 'INDEX'
+            self.execute(f'CREATE {kind} {name} ON {table} ({columns})')
+
+    def drop_index(self, name, table):
+        if self.index_exists(name, table):
+            if self.dialect == 'mysql':
+                self.execute(f'DROP INDEX {name} ON {table}')
+            else:
+                self.execute(f'DROP INDEX {name}')
+
+    def create_trigger(self, name, definition):
+        """CREATE TRIGGER name <definition>, unless it already exists."""
+        if self.dialect == 'mysql':
+            cur = self.query('''
+                SELECT TRIGGER_NAME FROM information_schema.TRIGGERS
+                WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = ?
+            ''', (name,))
+            if cur.fetchone() is None:
+                self.execute(f'CREATE TRIGGER {name} {definition}')
+        else:
+            self.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {definition}')
+
+    def backfill(self, table, set_clause, where='1=1', params=(),
+                 batch_size=1000, pause=0.0):
+        """Run `UPDATE table SET set_clause` in primary-key chunks.
+
+        Each chunk is its own short transaction, so a backfill over a large
+        table (e.g. 1M growth rows) never holds the write lock for long and
+        requests keep being served between chunks. `pause` adds a sleep
+        between chunks to throttle further.
+        """
+        if self.dry_run:
+            # The columns being backfilled may not exist yet in a dry run
+            self.log(f'    [dry-run] backfill {table} in batches of {batch_size}: '
+                     f'UPDATE {table} SET {set_clause} WHERE {where}')
+            return 0
+        cur = self.query(
+            f'SELECT MIN(id) AS low, MAX(id) AS high, COUNT(*) AS total FROM {table} WHERE {where}',
+            params)
+        row = cur.fetchone()
+        low, high, total = row['low'], row['high'], row['total']
+        if not total:
+            self.log(f'    backfill {table}: nothing to do')
+            return 0
+        started = time.perf_counter()
+        updated = 0
+        start = low
+        while start <= high:
+            end = start + batch_size - 1
+            cur = self.db.execute(
+                f'UPDATE {table} SET {set_clause} WHERE id BETWEEN ? AND ? AND ({where})',
+                (start, end) + tuple(params))
+            self.db.commit()
+            updated += max(cur.rowcount, 0)
+            start = end + 1
+            if pause:
+                time.sleep(pause)
+        elapsed = time.perf_counter() - started
+        self.log(f'    backfill {table}: {updated} rows in {elapsed:.2f}s')
+        return updated
+
+
+def _ensure_bookkeeping(ctx):
+    ctx.db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMP,
+            duration_ms INTEGER
+        )
+    ''')
+    ctx.db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER NOT NULL
+        )
+    ''')
+    ctx.db.commit()
+
+
+def applied_migrations(db):
+    """Return {version: checksum} for every migration already applied."""
+    cur = db.execute('SELECT version, checksum FROM schema_migrations')
+    return {row['version']: row['checksum'] for row in cur.fetchall()}
+
+
+def status(db, dialect):
+    """Return (migration, state) pairs; state is applied, pending or drifted."""
+    ctx = MigrationContext(db, dialect)
+    _ensure_bookkeeping(ctx)
+    applied = applied_migrations(db)
+    result = []
+    for m in MIGRATIONS:
+        if m.version not in applied:
+            state = 'pending'
+        elif applied[m.version] != m.checksum:
+            state = 'drifted'
+        else:
+            state = 'applied'
+        result.append((m, state))
+    return result
+
+
+def migrate(db, dialect, dry_run=False, target=None, log=print):
+    """Apply pending migrations up to `target` (default: latest)."""
+    ctx = MigrationContext(db, dialect, dry_run=dry_run, log=log)
+    _ensure_bookkeeping(ctx)
+    applied = applied_migrations(db)
+
+    for m in MIGRATIONS:
+        if m.version in applied and applied[m.version] != m.checksum:
+            raise MigrationError(
+                f'Migration {m.version} ({m.name}) was edited after it was applied')
+
+    pending = [m for m in MIGRATIONS
+               if m.version not in applied and (target is None or m.version <= target)]
+    if not pending:
+        log('Schema is up to date.')
+        return []
+
+    done = []
+    for m in pending:
+        log(f'{"[dry-run] " if dry_run else ""}Applying {m.version:03d} {m.name}')
+        started = time.perf_counter()
+        m.fn(ctx)
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        if not dry_run:
+            db.execute('''
+                INSERT INTO schema_migrations (version, name, checksum, applied_at, duration_ms)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (m.version, m.name, m.checksum, datetime.now().isoformat(), duration_ms))
+            db.execute('DELETE FROM schema_version')
+            db.execute('INSERT INTO schema_version (version) VALUES (?)', (m.version,))
+            db.commit()
+        log(f'    done in {duration_ms}ms')
+        done.append(m)
+    return done
+
+
+# ==================== MIGRATIONS ====================
+
+@migration(1, 'baseline')
+def baseline(ctx):
+    """Tables as created by the original init_db()."""
+    pk = ctx.pk
+    key_text = ctx.key_text
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS users (
+            id {pk},
+            username {key_text} UNIQUE NOT NULL,
+            email {key_text} UNIQUE,
+            password TEXT NOT NULL,
+            full_name TEXT,
+            avatar_url TEXT,
+            preferred_theme TEXT DEFAULT 'peach',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS children (
+            id {pk},
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            dob TEXT,
+            gender TEXT,
+            photo_url TEXT,
+            blood_type TEXT,
+            allergies TEXT,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS growth (
+            id {pk},
+            child_id INTEGER NOT NULL,
+            record_date TEXT,
+            weight REAL,
+            height REAL,
+            head_circ REAL,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS development (
+            id {pk},
+            child_id INTEGER NOT NULL,
+            category TEXT DEFAULT 'general',
+            milestone TEXT,
+            status TEXT DEFAULT 'pending',
+            achieved_date TEXT,
+            noted TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS immunization (
+            id {pk},
+            child_id INTEGER NOT NULL,
+            vaccine TEXT,
+            scheduled_date TEXT,
+            date_given TEXT,
+            status TEXT DEFAULT 'pending',
+            location TEXT,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS time_capsules (
+            id {pk},
+            child_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            letter_content TEXT,
+            unlock_date TEXT NOT NULL,
+            unlock_occasion TEXT,
+            is_sealed INTEGER DEFAULT 0,
+            sealed_at TIMESTAMP,
+            opened_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS capsule_media (
+            id {pk},
+            capsule_id INTEGER NOT NULL,
+            media_type TEXT NOT NULL,
+            file_url TEXT NOT NULL,
+            thumbnail_url TEXT,
+            caption TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS family_access (
+            id {pk},
+            child_id INTEGER NOT NULL,
+            user_id INTEGER,
+            invite_code {key_text} UNIQUE,
+            invite_email TEXT,
+            role TEXT DEFAULT 'viewer',
+            status TEXT DEFAULT 'pending',
+            invited_by INTEGER NOT NULL,
+            accepted_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS scheduled_letters (
+            id {pk},
+            child_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT,
+            unlock_date TEXT NOT NULL,
+            unlock_occasion TEXT,
+            is_sent INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS health_insights (
+            id {pk},
+            child_id INTEGER NOT NULL,
+            insight_type TEXT NOT NULL,
+            insight_data TEXT,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+@migration(2, 'reconcile_seed_columns_and_add_fk_indexes')
+def reconcile_seed_columns(ctx):
+    """Columns missing from databases created by seed.py, plus lookup indexes."""
+    ctx.add_column('users', 'last_login', 'TIMESTAMP')
+    ctx.add_column('children', 'notes', 'TEXT')
+    for table in ('growth', 'development', 'immunization'):
+        ctx.add_column(table, 'created_at', 'TIMESTAMP')
+
+    ctx.create_index('idx_children_user', 'children', 'user_id')
+    ctx.create_index('idx_growth_child', 'growth', 'child_id')
+    ctx.create_index('idx_development_child', 'development', 'child_id')
+    ctx.create_index('idx_immunization_child', 'immunization', 'child_id')
+    ctx.create_index('idx_capsules_child', 'time_capsules', 'child_id')
+    ctx.create_index('idx_capsule_media_capsule', 'capsule_media', 'capsule_id')
+    ctx.create_index('idx_family_access_child', 'family_access', 'child_id')
+    ctx.create_index('idx_letters_child', 'scheduled_letters', 'child_id')
+
+
+
+@migration(3, 'immunization_due_index')
+def immunization_due_index(ctx):
+    """Index for "which doses are due between X and Y" range scans."""
+    if ctx.dialect == 'mysql':
+        # TEXT columns cannot be indexed without a prefix length in MySQL
+        ctx.execute("""
+            ALTER TABLE immunization
+                MODIFY status VARCHAR(20) DEFAULT 'pending',
+                MODIFY scheduled_date VARCHAR(10)
+        """)
+    ctx.create_index('idx_immunization_due', 'immunization', 'status, scheduled_date')
+    ctx.create_index('idx_immunization_child_schedule', 'immunization', 'child_id, scheduled_date')
+
+
+
+@migration(4, 'push_notifications')
+def push_notifications(ctx):
+    """Push subscriptions per user/device and the notification queue."""
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS push_subscriptions (
+            id {ctx.pk},
+            user_id INTEGER NOT NULL,
+            endpoint TEXT NOT NULL,
+            endpoint_hash {ctx.key_text} UNIQUE NOT NULL,
+            p256dh TEXT,
+            auth TEXT,
+            user_agent TEXT,
+            failure_count INTEGER DEFAULT 0,
+            last_success_at TIMESTAMP,
+            created_at TIMESTAMP
+        )
+    """)
+    ctx.create_index('idx_push_subscriptions_user', 'push_subscriptions', 'user_id')
+
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS notification_queue (
+            id {ctx.pk},
+            user_id INTEGER NOT NULL,
+            event_type {ctx.key_text} NOT NULL,
+            dedupe_key {ctx.key_text} UNIQUE NOT NULL,
+            title TEXT NOT NULL,
+            body TEXT,
+            url TEXT,
+            status {ctx.key_text} DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at {ctx.key_text},
+            sent_at TIMESTAMP,
+            created_at TIMESTAMP
+        )
+    """)
+    ctx.create_index('idx_notification_queue_due', 'notification_queue', 'status, next_attempt_at')
+
+
+# Tables that hang off children.child_id; capsule_media hangs off time_capsules
+CHILD_TABLES = ('growth', 'development', 'immunization', 'time_capsules',
+                'scheduled_letters', 'family_access', 'health_insights')
+
+
+@migration(5, 'cascade_deletes_and_media_purge_queue')
+def cascade_deletes(ctx):
+    """Database-level cascades for child rows, plus the file deletion queue.
+
+    MySQL gets real ON DELETE CASCADE foreign keys (orphans left by the old
+    delete_child are removed first, or the constraint would fail). SQLite
+    cannot add a foreign key without rebuilding the table, so AFTER DELETE
+    triggers do the same job there and work even without PRAGMA foreign_keys.
+    """
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS media_purge_queue (
+            id {ctx.pk},
+            file_url {ctx.key_text} UNIQUE NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            enqueued_at TIMESTAMP
+        )
+    """)
+
+    ctx.execute('DELETE FROM capsule_media WHERE capsule_id NOT IN (SELECT id FROM time_capsules)')
+    for table in CHILD_TABLES:
+        ctx.execute(f'DELETE FROM {table} WHERE child_id NOT IN (SELECT id FROM children)')
+
+    if ctx.dialect == 'mysql':
+        def add_fk(name, table, column, parent):
+            cur = ctx.query("""
+                SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND CONSTRAINT_NAME = ?
+            """, (table, name))
+            if cur.fetchone() is None:
+                ctx.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) '
+                            f'REFERENCES {parent} (id) ON DELETE CASCADE')
+
+        for table in CHILD_TABLES:
+            add_fk(f'fk_{table}_child', table, 'child_id', 'children')
+        add_fk('fk_capsule_media_capsule', 'capsule_media', 'capsule_id', 'time_capsules')
+        return
+
+    deletes = ' '.join(f'DELETE FROM {table} WHERE child_id = OLD.id;' for table in CHILD_TABLES)
+    ctx.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_children_cascade AFTER DELETE ON children
+        BEGIN {deletes} END
+    """)
+    ctx.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_time_capsules_cascade AFTER DELETE ON time_capsules
+        BEGIN DELETE FROM capsule_media WHERE capsule_id = OLD.id; END
+    """)
+
+
+@migration(6, 'shard_catalog')
+def shard_catalog(ctx):
+    """Routing tables for DB_SHARDING; only used in the main database."""
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS shard_map (
+            user_id INTEGER PRIMARY KEY,
+            shard {ctx.key_text} NOT NULL,
+            moving INTEGER DEFAULT 0,
+            updated_at TIMESTAMP
+        )
+    """)
+    ctx.create_index('idx_shard_map_shard', 'shard_map', 'shard')
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS invite_routes (
+            invite_code {ctx.key_text} PRIMARY KEY,
+            shard {ctx.key_text} NOT NULL
+        )
+    """)
+
+
+
+@migration(7, 'cold_storage')
+def cold_storage(ctx):
+    """Packs of archived sealed-capsule media and where each file went."""
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS media_packs (
+            id {ctx.pk},
+            name {ctx.key_text} UNIQUE NOT NULL,
+            size INTEGER NOT NULL,
+            file_count INTEGER NOT NULL,
+            created_at TIMESTAMP
+        )
+    """)
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS cold_media (
+            file_url {ctx.key_text} PRIMARY KEY,
+            pack_id INTEGER NOT NULL,
+            capsule_id INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            archived_at TIMESTAMP
+        )
+    """)
+    ctx.create_index('idx_cold_media_pack', 'cold_media', 'pack_id')
+    ctx.create_index('idx_cold_media_capsule', 'cold_media', 'capsule_id')
+
+
+
+@migration(8, 'audio_pipeline')
+def audio_pipeline(ctx):
+    """Transcoding state, loudness and waveform peaks of audio recordings."""
+    ctx.add_column('capsule_media', 'audio_status', 'TEXT')
+    ctx.add_column('capsule_media', 'audio_error', 'TEXT')
+    ctx.add_column('capsule_media', 'duration_ms', 'INTEGER')
+    ctx.add_column('capsule_media', 'loudness_lufs', 'REAL')
+    ctx.add_column('capsule_media', 'original_size', 'INTEGER')
+    ctx.add_column('capsule_media', 'waveform', 'TEXT')
+    ctx.create_index('idx_capsule_media_audio', 'capsule_media', 'media_type, audio_status')
+
+
+
+# (table, ISO date column, derived epoch-day column); see dates.py
+DAY_COLUMNS = (
+    ('children', 'dob', 'dob_day'),
+    ('growth', 'record_date', 'record_day'),
+    ('immunization', 'scheduled_date', 'scheduled_day'),
+    ('time_capsules', 'unlock_date', 'unlock_day'),
+    ('scheduled_letters', 'unlock_date', 'unlock_day'),
+)
+
+
+@migration(9, 'typed_dates')
+def typed_dates(ctx):
+    """Integer epoch-day columns next to the ISO date text, plus growth.age_days.
+
+    Triggers keep them in sync on every write path (forms, bulk entry, seed,
+    shard moves): BEFORE triggers on MySQL, AFTER triggers updating the row
+    on SQLite. The backfill runs after the triggers exist, in batches.
+    """
+    mysql = ctx.dialect == 'mysql'
+
+    def epoch_day(expr):
+        if mysql:
+            return f"DATEDIFF({expr}, '1970-01-01')"
+        return f'CAST(julianday({expr}) - 2440587.5 AS INTEGER)'
+
+    for table, column, day in DAY_COLUMNS:
+        ctx.add_column(table, day, 'INTEGER')
+    ctx.add_column('growth', 'age_days', 'INTEGER')
+
+    age = '{record_day} - (SELECT dob_day FROM children WHERE children.id = {child})'
+    for table, column, day in DAY_COLUMNS:
+        values = [(day, epoch_day(f'NEW.{column}'))]
+        watched = column
+        if table == 'growth':
+            values.append(('age_days', age.format(record_day=values[0][1], child='NEW.child_id')))
+            watched = f'{column}, child_id'
+        if mysql:
+            assign = ', '.join(f'NEW.{name} = {expr}' for name, expr in values)
+            for event, suffix in (('INSERT', 'ins'), ('UPDATE', 'upd')):
+                ctx.create_trigger(f'trg_{table}_{day}_{suffix}',
+                                   f'BEFORE {event} ON {table} FOR EACH ROW SET {assign}')
+        else:
+            assign = ', '.join(f'{name} = {expr}' for name, expr in values)
+            body = f'BEGIN UPDATE {table} SET {assign} WHERE id = NEW.id; END'
+            ctx.create_trigger(f'trg_{table}_{day}_ins', f'AFTER INSERT ON {table} {body}')
+            ctx.create_trigger(f'trg_{table}_{day}_upd', f'AFTER UPDATE OF {watched} ON {table} {body}')
+
+    # A corrected date of birth shifts every growth row's age
+    if mysql:
+        ctx.create_trigger('trg_children_growth_age',
+                           'AFTER UPDATE ON children FOR EACH ROW '
+                           'UPDATE growth SET age_days = record_day - NEW.dob_day '
+                           'WHERE child_id = NEW.id AND NOT (OLD.dob <=> NEW.dob)')
+    else:
+        ctx.create_trigger('trg_children_growth_age',
+                           f'AFTER UPDATE OF dob ON children BEGIN '
+                           f'UPDATE growth SET age_days = record_day - ({epoch_day("NEW.dob")}) '
+                           f'WHERE child_id = NEW.id; END')
+
+    for table, column, day in DAY_COLUMNS:
+        # Legacy free-form values that are not ISO dates stay NULL
+        valid = f"{column} REGEXP '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}'" if mysql else f'{column} IS NOT NULL'
+        ctx.backfill(table, f'{day} = {epoch_day(column)}', where=valid)
+    ctx.backfill('growth', 'age_days = ' + age.format(record_day='record_day', child='growth.child_id'),
+                 where='record_day IS NOT NULL')
+
+    # Dates typed as DD/MM/YYYY etc. before the forms validated them; the
+    # UPDATE fires the triggers above, which fill the day columns
+    for table, column, day in DAY_COLUMNS:
+        if ctx.dry_run:
+            break
+        cur = ctx.query(f'SELECT id, {column} AS value FROM {table} '
+                        f'WHERE {day} IS NULL AND {column} IS NOT NULL')
+        for row in cur.fetchall():
+            for fmt in ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d'):
+                try:
+                    iso = datetime.strptime(str(row['value']).strip(), fmt).date().isoformat()
+                except ValueError:
+                    continue
+                ctx.execute(f'UPDATE {table} SET {column} = ? WHERE id = ?', (iso, row['id']))
+                break
+        ctx.db.commit()
+
+    ctx.create_index('idx_children_dob_day', 'children', 'dob_day')
+    ctx.create_index('idx_growth_child_day', 'growth', 'child_id, record_day')
+    ctx.create_index('idx_growth_age_days', 'growth', 'age_days')
+    ctx.create_index('idx_immunization_due_day', 'immunization', 'status, scheduled_day')
+    ctx.drop_index('idx_immunization_due', 'immunization')
+    ctx.create_index('idx_capsules_unlock_day', 'time_capsules', 'is_sealed, unlock_day')
+    ctx.create_index('idx_letters_due_day', 'scheduled_letters', 'is_sent, unlock_day')
+
+
+@migration(10, 'storage_usage')
+def storage_usage(ctx):
+    """Bytes and file counts of capsule media per child (see storage.py).
+
+    capsule_media.size_bytes is set by the app when a file is written;
+    triggers add and subtract it from the child's storage_usage row on every
+    insert, update and delete, whichever code path does it. Rows that predate
+    this migration have no size yet; the storage-reconcile job measures them.
+    """
+    mysql = ctx.dialect == 'mysql'
+    ctx.add_column('capsule_media', 'size_bytes', 'INTEGER')
+    ctx.execute("""
+        CREATE TABLE IF NOT EXISTS storage_usage (
+            child_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            files INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    ctx.create_index('idx_storage_usage_user', 'storage_usage', 'user_id')
+
+    ignore = 'INSERT IGNORE' if mysql else 'INSERT OR IGNORE'
+
+    def usage_row(row):
+        return (f'{ignore} INTO storage_usage (child_id, user_id, bytes, files) '
+                f'SELECT c.id, c.user_id, 0, 0 FROM time_capsules tc '
+                f'JOIN children c ON c.id = tc.child_id WHERE tc.id = {row}.capsule_id;')
+
+    def count(row, sign):
+        return (f'UPDATE storage_usage SET bytes = bytes {sign} COALESCE({row}.size_bytes, 0), '
+                f'files = files {sign} 1 '
+                f'WHERE child_id = (SELECT child_id FROM time_capsules WHERE id = {row}.capsule_id);')
+
+    each_row = 'FOR EACH ROW ' if mysql else ''
+    ctx.create_trigger('trg_capsule_media_usage_ins',
+                       f"AFTER INSERT ON capsule_media {each_row}"
+                       f"BEGIN {usage_row('NEW')} {count('NEW', '+')} END")
+    ctx.create_trigger('trg_capsule_media_usage_del',
+                       f"AFTER DELETE ON capsule_media {each_row}BEGIN {count('OLD', '-')} END")
+    moved = f"{count('OLD', '-')} {usage_row('NEW')} {count('NEW', '+')}"
+    if mysql:
+        ctx.create_trigger('trg_capsule_media_usage_upd',
+                           f'AFTER UPDATE ON capsule_media FOR EACH ROW BEGIN '
+                           f'IF NOT (OLD.size_bytes <=> NEW.size_bytes) OR OLD.capsule_id <> NEW.capsule_id '
+                           f'THEN {moved} END IF; END')
+        ctx.create_trigger('trg_children_usage_del',
+                           'AFTER DELETE ON children FOR EACH ROW '
+                           'DELETE FROM storage_usage WHERE child_id = OLD.id')
+    else:
+        ctx.create_trigger('trg_capsule_media_usage_upd',
+                           f'AFTER UPDATE OF size_bytes, capsule_id ON capsule_media BEGIN {moved} END')
+        ctx.create_trigger('trg_children_usage_del',
+                           'AFTER DELETE ON children BEGIN '
+                           'DELETE FROM storage_usage WHERE child_id = OLD.id; END')
+
+    # Children with media already; sizes are filled in by the reconcile job,
+    # whose UPDATEs go through the triggers above
+    ctx.execute("""
+        INSERT INTO storage_usage (child_id, user_id, bytes, files)
+        SELECT c.id, c.user_id, COALESCE(SUM(cm.size_bytes), 0), COUNT(cm.id)
+        FROM children c
+        JOIN time_capsules tc ON tc.child_id = c.id
+        JOIN capsule_media cm ON cm.capsule_id = tc.id
+        WHERE c.id NOT IN (SELECT child_id FROM storage_usage)
+        GROUP BY c.id, c.user_id
+    """)
+    if not ctx.dry_run:
+        ctx.db.commit()
+
+
+@migration(11, 'activity_feed')
+def activity_feed(ctx):
+    """Family activity feed (see activity.py).
+
+    Created in every database but only used in the catalog, since a relative
+    follows children of other families, which may live in other shards.
+    """
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS activity_events (
+            id {ctx.pk},
+            child_id INTEGER NOT NULL,
+            child_name TEXT NOT NULL,
+            actor_id INTEGER,
+            kind {ctx.key_text} NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    ctx.create_index('idx_activity_events_child', 'activity_events', 'child_id, id')
+    ctx.execute("""
+        CREATE TABLE IF NOT EXISTS activity_follows (
+            user_id INTEGER NOT NULL,
+            child_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, child_id)
+        )
+    """)
+    ctx.create_index('idx_activity_follows_child', 'activity_follows', 'child_id')
+    # since: first event id pushed to the reader's timeline, NULL while cold
+    ctx.execute("""
+        CREATE TABLE IF NOT EXISTS activity_readers (
+            user_id INTEGER PRIMARY KEY,
+            since INTEGER,
+            read_at INTEGER NOT NULL
+        )
+    """)
+    ctx.execute("""
+        CREATE TABLE IF NOT EXISTS activity_timeline (
+            user_id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            child_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, event_id)
+        )
+    """)
+    ctx.create_index('idx_activity_timeline_child', 'activity_timeline', 'child_id')
+
+
+
+# What a growth report shows (see growth_report.py); changing any of these
+# columns makes the child's cached report stale
+REPORT_COLUMNS = {
+    'growth': ('child_id', 'record_date', 'weight', 'height', 'head_circ'),
+    'development': ('child_id', 'milestone', 'status', 'noted'),
+    'immunization': ('child_id', 'vaccine', 'scheduled_date', 'date_given', 'status'),
+}
+REPORT_CHILD_COLUMNS = ('name', 'dob', 'gender', 'blood_type')
+
+
+@migration(12, 'child_data_version')
+def child_data_version(ctx):
+    """children.data_version, the cache key of the child's growth report.
+
+    Triggers bump it whenever a reported row is inserted, changed or deleted,
+    whichever code path does it (forms, bulk entry, schedule materialization,
+    seed), and when the child's own reported fields are edited. On MySQL the
+    children trigger sets NEW.data_version, as a trigger may not update its
+    own table; on SQLite it is an AFTER trigger outside its own column list.
+    """
+    mysql = ctx.dialect == 'mysql'
+    ctx.add_column('children', 'data_version', 'INTEGER NOT NULL DEFAULT 0')
+
+    each_row = 'FOR EACH ROW ' if mysql else ''
+    bump = 'UPDATE children SET data_version = data_version + 1 WHERE id IN ({ids});'
+    for table, columns in REPORT_COLUMNS.items():
+        ctx.create_trigger(f'trg_{table}_version_ins',
+                           f"AFTER INSERT ON {table} {each_row}BEGIN {bump.format(ids='NEW.child_id')} END")
+        ctx.create_trigger(f'trg_{table}_version_del',
+                           f"AFTER DELETE ON {table} {each_row}BEGIN {bump.format(ids='OLD.child_id')} END")
+        moved = bump.format(ids='OLD.child_id, NEW.child_id')
+        if mysql:
+            changed = ' OR '.join(f'NOT (OLD.{c} <=> NEW.{c})' for c in columns)
+            ctx.create_trigger(f'trg_{table}_version_upd',
+                               f'AFTER UPDATE ON {table} FOR EACH ROW BEGIN '
+                               f'IF {changed} THEN {moved} END IF; END')
+        else:
+            ctx.create_trigger(f'trg_{table}_version_upd',
+                               f"AFTER UPDATE OF {', '.join(columns)} ON {table} BEGIN {moved} END")
+
+    if mysql:
+        changed = ' OR '.join(f'NOT (OLD.{c} <=> NEW.{c})' for c in REPORT_CHILD_COLUMNS)
+        ctx.create_trigger('trg_children_version_upd',
+                           f'BEFORE UPDATE ON children FOR EACH ROW BEGIN '
+                           f'IF {changed} THEN SET NEW.data_version = OLD.data_version + 1; END IF; END')
+    else:
+        ctx.create_trigger('trg_children_version_upd',
+                           f"AFTER UPDATE OF {', '.join(REPORT_CHILD_COLUMNS)} ON children BEGIN "
+                           f"UPDATE children SET data_version = data_version + 1 WHERE id = NEW.id; END")
+
+
+
+@migration(13, 'posyandu_roster')
+def posyandu_roster(ctx):
+    """Posyandu groups and the columns the coordinator roster sorts on.
+
+    posyandu_groups lives in the catalog (a group spans families, which may
+    sit in different shards); children.posyandu_id points at it, so a
+    child's membership moves with the child. children.last_growth_day is
+    the latest growth.record_day (0 if never measured), kept by triggers so
+    "longest since last weighing" is an index scan like name and age.
+    """
+    mysql = ctx.dialect == 'mysql'
+    ctx.execute(f"""
+        CREATE TABLE IF NOT EXISTS posyandu_groups (
+            id {ctx.pk},
+            name TEXT NOT NULL,
+            coordinator_id INTEGER NOT NULL,
+            join_code {ctx.key_text} UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    ctx.create_index('idx_posyandu_groups_coordinator', 'posyandu_groups', 'coordinator_id')
+    ctx.add_column('children', 'posyandu_id', 'INTEGER')
+    ctx.add_column('children', 'last_growth_day', 'INTEGER NOT NULL DEFAULT 0')
+
+    latest = ('UPDATE children SET last_growth_day = COALESCE('
+              '(SELECT MAX(record_day) FROM growth WHERE growth.child_id = children.id), 0) '
+              'WHERE id IN ({ids});')
+    # record_day itself is set by the typed_dates triggers: BEFORE the row
+    # is written on MySQL, by an UPDATE right after the insert on SQLite
+    if mysql:
+        ctx.create_trigger('trg_growth_latest_ins',
+                           f"AFTER INSERT ON growth FOR EACH ROW BEGIN {latest.format(ids='NEW.child_id')} END")
+        ctx.create_trigger('trg_growth_latest_upd',
+                           f'AFTER UPDATE ON growth FOR EACH ROW BEGIN '
+                           f'IF NOT (OLD.record_day <=> NEW.record_day) OR OLD.child_id <> NEW.child_id '
+                           f"THEN {latest.format(ids='OLD.child_id, NEW.child_id')} END IF; END")
+        ctx.create_trigger('trg_growth_latest_del',
+                           f"AFTER DELETE ON growth FOR EACH ROW BEGIN {latest.format(ids='OLD.child_id')} END")
+    else:
+        ctx.create_trigger('trg_growth_latest_upd',
+                           f"AFTER UPDATE OF record_day, child_id ON growth "
+                           f"BEGIN {latest.format(ids='OLD.child_id, NEW.child_id')} END")
+        ctx.create_trigger('trg_growth_latest_del',
+                           f"AFTER DELETE ON growth BEGIN {latest.format(ids='OLD.child_id')} END")
+
+    ctx.backfill('children', 'last_growth_day = COALESCE((SELECT MAX(record_day) FROM growth '
+                             'WHERE growth.child_id = children.id), 0)')
+
+    # Keyset pagination per sort order: (group, key, id) index scans
+    name = 'name(100)' if mysql else 'name'
+    ctx.create_index('idx_children_posyandu_name', 'children', f'posyandu_id, {name}, id')
+    ctx.create_index('idx_children_posyandu_dob', 'children', 'posyandu_id, dob_day, id')
+    ctx.create_index('idx_children_posyandu_growth', 'children', 'posyandu_id, last_growth_day, id')
+
+
+LATEST_VERSION = MIGRATIONS[-1].version
@@ -0,0 +1,318 @@
+"""
+Server-side milestone cards.
+
+Cards are drawn from the `development` row and the user's theme palette,
+replacing the html2canvas rendering that was slow on low-end phones. SVG is
+always available (plain string templating); PNG needs Pillow, which is
+optional and imported lazily.
+
+Rendered cards are cached on disk under CARD_CACHE_DIR. The file name holds
+the milestone id, theme, TEMPLATE_VERSION and a hash of the card text, so an
+edit or a layout change produces a new file (and URL) instead of a stale
+one; the card URL carries the same hash and can be cached for a year. Files
+are evicted least-recently-used once the directory grows past
+CARD_CACHE_MAX_MB. Marking a milestone as done pre-renders its card on a
+background thread so the first share is instant.
+"""
+import hashlib
+import io
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+import dates
+from db import DATABASE_DIR, use_user_database
+from disk_cache import evict_lru
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout changes so cached cards are re-rendered
+TEMPLATE_VERSION = 1
+
+CARD_CACHE_DIR = os.environ.get('CARD_CACHE_DIR', os.path.join(DATABASE_DIR, 'cards'))
+CARD_CACHE_MAX_MB = int(os.environ.get('CARD_CACHE_MAX_MB', '64'))
+
+WIDTH, HEIGHT = 400, 500
+PNG_SCALE = 2
+
+# Same palettes as the theme picker in settings (gradient stops, text, accent)
+PALETTES = {
+    'peach': (('#FCB9B2', '#B8B8DC', '#B5EAD7'), '#5D4E37', '#E8877D'),
+    'pink': (('#FCB9B2', '#FFECD2'), '#5D4E37', '#F9A099'),
+    'lavender': (('#B8B8DC', '#E8E8F4'), '#5D4E37', '#9999C9'),
+    'mint': (('#B5EAD7', '#E6F7F1'), '#5D4E37', '#3FAF8C'),
+}
+DEFAULT_THEME = 'peach'
+
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+FONT_PATHS = [
+    os.environ.get('CARD_FONT', ''),
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/truetype/DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans-Bold.ttf',
+    'C:\\Windows\\Fonts\\arialbd.ttf',
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def png_available():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def default_format():
+    return 'png' if png_available() else 'svg'
+
+
+def palette(theme):
+    return PALETTES.get(theme) or PALETTES[DEFAULT_THEME]
+
+
+def theme_for(session, requested=None):
+    """The card theme for a request: `requested`, else the session's, if known.
+
+    Themes end up in cache file names and card versions, so every caller
+    goes through here rather than reading the session directly.
+    """
+    theme = requested or session.get('theme')
+    return theme if theme in PALETTES else DEFAULT_THEME
+
+
+def card_data(child_name, milestone):
+    """Fields shown on the card, from a child name and a development row."""
+    return {
+        'id': int(milestone['id']),
+        'child_name': child_name,
+        'milestone': milestone['milestone'],
+        'date': dates.format_long(milestone['noted'] or milestone['created_at']),
+    }
+
+
+def load_card_data(db, milestone_id, child_id):
+    row = db.execute('''
+        SELECT d.id, d.milestone, d.status, d.noted, d.created_at, c.name AS child_name
+        FROM development d JOIN children c ON c.id = d.child_id
+        WHERE d.id=? AND d.child_id=?
+    ''', (milestone_id, child_id)).fetchone()
+    if not row or row['status'] != 'done':
+        return None
+    return card_data(row['child_name'], row)
+
+
+def card_version(data, theme):
+    text = '\x1f'.join((data['child_name'], data['milestone'], data['date'], theme,
+                        str(TEMPLATE_VERSION)))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+
+def _wrap(text, width):
+    lines, line = [], ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}'.strip()
+    if line:
+        lines.append(line)
+    return lines[:4] or ['']
+
+
+def _star_points(cx, cy, outer, inner):
+    points = []
+    for i in range(10):
+        radius = outer if i % 2 == 0 else inner
+        angle = math.pi / 2 + i * math.pi / 5
+        points.append((cx + radius * math.cos(angle), cy - radius * math.sin(angle)))
+    return points
+
+
+def render_svg(data, theme):
+    stops, text_color, accent = palette(theme)
+    gradient = ''.join(
+        f'<stop offset="{i / max(len(stops) - 1, 1):.2f}" stop-color="{c}"/>'
+        for i, c in enumerate(stops))
+    star = ' '.join(f'{x:.1f},{y:.1f}' for x, y in _star_points(WIDTH / 2, 70, 26, 11))
+    lines = _wrap(data['milestone'], 22)
+    box_height = 40 + 30 * len(lines)
+    text_top = 260 - box_height / 2 + 38
+    milestone_text = ''.join(
+        f'<text x="{WIDTH / 2}" y="{text_top + 30 * i:.0f}" font-size="22" font-weight="600">{escape(line)}</text>'
+        for i, line in enumerate(lines))
+    svg = f'''<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" viewBox="0 0 {WIDTH} {HEIGHT}">
+<defs><linearGradient id="bg" x1="0" y1="0" x2="1" y2="1">{gradient}</linearGradient></defs>
+<rect width="{WIDTH}" height="{HEIGHT}" rx="24" fill="url(#bg)"/>
+<polygon points="{star}" fill="#FFD66B" stroke="#FFFFFF" stroke-width="2"/>
+<g font-family="Quicksand, Nunito, sans-serif" text-anchor="middle" fill="{text_color}">
+<text x="{WIDTH / 2}" y="145" font-size="28" font-weight="700">{escape(data['child_name'])}</text>
+<text x="{WIDTH / 2}" y="178" font-size="14" letter-spacing="2" fill="{accent}">MILESTONE TERCAPAI!</text>
+<rect x="40" y="{260 - box_height / 2:.0f}" width="{WIDTH - 80}" height="{box_height}" rx="16" fill="#FFFFFF" fill-opacity="0.9"/>
+{milestone_text}
+<text x="{WIDTH / 2}" y="{260 + box_height / 2 + 45:.0f}" font-size="16" fill-opacity="0.8">{escape(data['date'])}</text>
+<text x="{WIDTH / 2}" y="{HEIGHT - 20}" font-size="12" fill-opacity="0.5">BabyGrow</text>
+</g>
+</svg>
+'''
+    return svg.encode('utf-8')
+
+
+def _font(size):
+    from PIL import ImageFont
+    for path in FONT_PATHS:
+        if path and os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1
+        return ImageFont.load_default()
+
+
+def _hex(color):
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def render_png(data, theme):
+    from PIL import Image, ImageDraw
+
+    s = PNG_SCALE
+    w, h = WIDTH * s, HEIGHT * s
+    stops, text_color, accent = palette(theme)
+    stops = [_hex(c) for c in stops]
+    text_color, accent = _hex(text_color), _hex(accent)
+
+    # Diagonal gradient drawn as anti-diagonal lines at low resolution, then
+    # upscaled; it is smooth anyway and this is most of the render time
+    gw, gh = WIDTH // 4, HEIGHT // 4
+    background = Image.new('RGB', (gw, gh))
+    draw = ImageDraw.Draw(background)
+    span = gw + gh
+    for d in range(span):
+        t = d / span * (len(stops) - 1)
+        i = min(int(t), len(stops) - 2)
+        f = t - i
+        color = tuple(round(a + (b - a) * f) for a, b in zip(stops[i], stops[i + 1]))
+        draw.line([(d, 0), (0, d)], fill=color, width=2)
+    background = background.resize((w, h), Image.BILINEAR)
+
+    card = Image.new('RGBA', (w, h), (0, 0, 0, 0))
+    mask = Image.new('L', (w, h), 0)
+    ImageDraw.Draw(mask).rounded_rectangle([0, 0, w - 1, h - 1], radius=24 * s, fill=255)
+    card.paste(background, (0, 0), mask)
+
+    overlay = Image.new('RGBA', (w, h), (0, 0, 0, 0))
+    odraw = ImageDraw.Draw(overlay)
+    lines = _wrap(data['milestone'], 22)
+    box_height = (40 + 30 * len(lines)) * s
+    box_top = 260 * s - box_height // 2
+    odraw.rounded_rectangle([40 * s, box_top, w - 40 * s, box_top + box_height],
+                            radius=16 * s, fill=(255, 255, 255, 230))
+    card = Image.alpha_composite(card, overlay)
+
+    draw = ImageDraw.Draw(card)
+    draw.polygon([(x * s, y * s) for x, y in _star_points(WIDTH / 2, 70, 26, 11)],
+                 fill=(255, 214, 107), outline=(255, 255, 255))
+
+    def centered(text, y, size, fill):
+        draw.text((w / 2, y * s), text, font=_font(size * s), fill=fill, anchor='ms')
+
+    centered(data['child_name'], 145, 28, text_color)
+    centered('MILESTONE TERCAPAI!', 178, 14, accent)
+    text_top = 260 - (40 + 30 * len(lines)) / 2 + 38
+    for i, line in enumerate(lines):
+        centered(line, text_top + 30 * i, 22, text_color)
+    centered(data['date'], box_top / s + box_height / s + 45, 16, text_color)
+    centered('BabyGrow', HEIGHT - 20, 12, accent)
+
+    out = io.BytesIO()
+    card.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+def render(data, theme, fmt):
+    return render_png(data, theme) if fmt == 'png' else render_svg(data, theme)
+
+
+def cache_path(data, theme, fmt):
+    name = f"{data['id']}-{theme}-v{TEMPLATE_VERSION}-{card_version(data, theme)}.{fmt}"
+    return os.path.join(CARD_CACHE_DIR, name)
+
+
+def get_card(data, theme, fmt):
+    """Path of the cached card, rendering it first if needed."""
+    path = cache_path(data, theme, fmt)
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # LRU bookkeeping for evict()
+        except OSError:
+            pass
+        return path
+    os.makedirs(CARD_CACHE_DIR, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(render(data, theme, fmt))
+    os.replace(tmp, path)
+    return path
+
+
+def prerender(db, milestone_ids=None, themes=None, fmt=None):
+    """Batch-render cards for done milestones (all of them when ids is None)."""
+    fmt = fmt or default_format()
+    themes = themes or [DEFAULT_THEME]
+    sql = '''SELECT d.id, d.milestone, d.noted, d.created_at, c.name AS child_name
+             FROM development d JOIN children c ON c.id = d.child_id
+             WHERE d.status = 'done' '''
+    params = ()
+    if milestone_ids is not None:
+        milestone_ids = list(milestone_ids)
+        if not milestone_ids:
+            return 0
+        sql += f" AND d.id IN ({','.join('?' * len(milestone_ids))})"
+        params = tuple(milestone_ids)
+    rendered = 0
+    for row in db.execute(sql, params).fetchall():
+        data = card_data(row['child_name'], row)
+        for theme in themes:
+            if not os.path.exists(cache_path(data, theme, fmt)):
+                get_card(data, theme, fmt)
+                rendered += 1
+    return rendered
+
+
+def prerender_async(app, milestone_ids, theme, user_id):
+    """Pre-render after the response on a single background thread."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='babygrow-cards')
+
+    def run():
+        with app.app_context():
+            try:
+                prerender(use_user_database(user_id), milestone_ids, [theme])
+            except Exception:
+                logger.exception('Pre-rendering cards %s failed', milestone_ids)
+
+    _executor.submit(run)
+
+
+def evict(max_bytes=None):
+    """Delete least-recently-used cards until the cache fits. Returns count."""
+    max_bytes = CARD_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    return evict_lru(CARD_CACHE_DIR, max_bytes)
+
+
+@job('card-cache-evict', every=3600, per_database=False)
+def evict_job():
+    removed = evict()
+    if removed:
+        logger.info('Evicted %d cached milestone cards', removed)
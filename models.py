@@ -0,0 +1,160 @@
+"""
+Row types returned by get_db().
+
+Every query, on SQLite and MySQL alike, returns Records: tuples with named
+fields, so `row['name']`, `row.name` (also in Jinja) and `row[1]` all work
+and routes never need to care which backend produced a row. A Record
+class is created once per distinct result shape (the column names of a
+query) and cached; it adds no per-row storage on top of the tuple, unlike
+a dict per row.
+
+Pages that show a list pass stream(cursor) to the template instead of
+fetchall(), so rows are turned into Records one at a time while the
+template renders and memory per request does not grow with the list. Use
+fetchall() where the rows are needed twice or counted.
+
+The data-access helpers at the bottom cover the ownership checks that
+almost every route starts with.
+"""
+import threading
+from operator import itemgetter
+
+_types = {}
+_by_description = {}
+_types_lock = threading.Lock()
+
+
+class Record(tuple):
+    """A result row: a tuple whose items can also be read by column name."""
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return self._fields
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={value!r}' for name, value in zip(self._fields, self))
+        return f'Record({values})'
+
+
+def record_type(fields):
+    """The Record class for a tuple of column names (created once)."""
+    cls = _types.get(fields)
+    if cls is None:
+        with _types_lock:
+            cls = _types.get(fields)
+            if cls is None:
+                namespace = {'__slots__': (), '_fields': fields,
+                             '_index': {name: i for i, name in enumerate(fields)}}
+                for i, name in enumerate(fields):
+                    # Columns may shadow tuple methods (count, index), not Record's own
+                    if name.isidentifier() and not name.startswith('_') and name not in vars(Record):
+                        namespace[name] = property(itemgetter(i))
+                cls = _types[fields] = type('Record', (Record,), namespace)
+    return cls
+
+
+def _type_for(description):
+    # Keyed on the whole cursor.description, which is cheaper to hash than
+    # building the tuple of names again for every row
+    cls = _by_description.get(description)
+    if cls is None:
+        cls = _by_description[description] = record_type(tuple(column[0] for column in description))
+    return cls
+
+
+def sqlite_row_factory(cursor, row):
+    return tuple.__new__(_type_for(cursor.description), row)
+
+
+class RecordCursor:
+    """Wraps a DB-API cursor (mysql-connector) so it returns Records too."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._type = None
+
+    def _make(self, row):
+        if self._type is None:
+            self._type = _type_for(self._cursor.description)
+        return tuple.__new__(self._type, row)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._make(row)
+
+    def fetchall(self):
+        return [self._make(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._make(row) for row in self._cursor.fetchmany(size)]
+
+    def __iter__(self):
+        while True:
+            row = self._cursor.fetchone()
+            if row is None:
+                return
+            yield self._make(row)
+
+    def __getattr__(self, name):
+        # lastrowid, rowcount, description, close, ...
+        return getattr(self._cursor, name)
+
+
+class stream:
+    """Rows of a cursor, read lazily in a single pass.
+
+    Unlike a bare cursor it answers `{% if rows %}` (by reading the first
+    row ahead), so templates keep their empty states. It can be iterated
+    once and has no len(); with MySQL it must be the last query of the
+    request, since the connection cannot run another while rows are unread.
+    """
+    __slots__ = ('_cursor', '_first', '_consumed')
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._first = cursor.fetchone()
+        self._consumed = False
+
+    def __bool__(self):
+        return self._first is not None
+
+    def __iter__(self):
+        if self._consumed:
+            raise RuntimeError('rows can only be iterated once')
+        self._consumed = True
+        if self._first is None:
+            return
+        yield self._first
+        yield from self._cursor
+
+
+def owned_child(db, child_id, user_id, columns='id, name'):
+    """The child if it belongs to user_id, else None."""
+    return db.execute(f'SELECT {columns} FROM children WHERE id=? AND user_id=?',
+                      (child_id, user_id)).fetchone()
+
+
+def owned_capsule(db, capsule_id, user_id, columns='tc.id, tc.is_sealed'):
+    """The capsule if its child belongs to user_id, else None."""
+    return db.execute(f'''
+        SELECT {columns} FROM time_capsules tc
+        JOIN children c ON tc.child_id = c.id
+        WHERE tc.id = ? AND c.user_id = ?
+    ''', (capsule_id, user_id)).fetchone()
@@ -0,0 +1,312 @@
+"""
+Web Push notifications: subscriptions, event queue and batched delivery.
+
+Events (vaccine due in 3 days, capsule unlock date reached, scheduled letter
+delivered) are enqueued into `notification_queue` with a dedupe key, so a
+job that runs every hour never notifies twice for the same thing. The
+delivery job takes a batch of due rows, coalesces several events for the
+same user into one push, sends to all of the user's devices with bounded
+concurrency, retries transient failures with exponential backoff and prunes
+subscriptions the push service reports as gone (404/410).
+
+Sending uses pywebpush when VAPID keys are configured (optional dependency,
+imported lazily). PUSH_SENDER=plain posts the JSON payload unencrypted,
+which is what tools/push_standin.py expects for local testing.
+"""
+import hashlib
+import json
+import logging
+import os
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import dates
+from db import get_db
+from immunization_schedule import due_doses
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+VAPID_PUBLIC_KEY = os.environ.get('VAPID_PUBLIC_KEY', '')
+VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
+VAPID_SUBJECT = os.environ.get('VAPID_SUBJECT', 'mailto:admin@babygrow.id')
+PUSH_SENDER = os.environ.get('PUSH_SENDER', 'webpush' if VAPID_PRIVATE_KEY else 'plain')
+
+PUSH_BATCH_SIZE = int(os.environ.get('PUSH_BATCH_SIZE', '200'))
+PUSH_CONCURRENCY = int(os.environ.get('PUSH_CONCURRENCY', '16'))
+PUSH_MAX_ATTEMPTS = int(os.environ.get('PUSH_MAX_ATTEMPTS', '5'))
+PUSH_BACKOFF_SECONDS = int(os.environ.get('PUSH_BACKOFF_SECONDS', '60'))
+PUSH_TIMEOUT = float(os.environ.get('PUSH_TIMEOUT', '10'))
+VACCINE_REMINDER_DAYS = 3
+
+# Push services report these when a subscription no longer exists
+GONE_STATUSES = (404, 410)
+
+
+def _now():
+    return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+def _endpoint_hash(endpoint):
+    return hashlib.sha256(endpoint.encode()).hexdigest()
+
+
+# ==================== SUBSCRIPTIONS ====================
+
+def subscribe(db, user_id, subscription, user_agent=''):
+    """Store (or re-assign) a browser PushSubscription for a user/device."""
+    endpoint = subscription.get('endpoint', '')
+    keys = subscription.get('keys') or {}
+    if not endpoint:
+        raise ValueError('subscription has no endpoint')
+    endpoint_hash = _endpoint_hash(endpoint)
+    cur = db.execute('SELECT id FROM push_subscriptions WHERE endpoint_hash=?', (endpoint_hash,))
+    row = cur.fetchone()
+    if row:
+        db.execute('''
+            UPDATE push_subscriptions SET user_id=?, p256dh=?, auth=?, user_agent=?, failure_count=0
+            WHERE id=?
+        ''', (user_id, keys.get('p256dh'), keys.get('auth'), user_agent[:255], row['id']))
+    else:
+        db.execute('''
+            INSERT INTO push_subscriptions (user_id, endpoint, endpoint_hash, p256dh, auth, user_agent, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, endpoint, endpoint_hash, keys.get('p256dh'), keys.get('auth'),
+              user_agent[:255], _now()))
+    db.commit()
+
+
+def unsubscribe(db, user_id, endpoint):
+    db.execute('DELETE FROM push_subscriptions WHERE endpoint_hash=? AND user_id=?',
+               (_endpoint_hash(endpoint), user_id))
+    db.commit()
+
+
+# ==================== QUEUE ====================
+
+def enqueue(db, user_id, event_type, dedupe_key, title, body, url='/'):
+    """Queue a notification; returns False if the same event was queued before."""
+    cur = db.execute('SELECT id FROM notification_queue WHERE dedupe_key=?', (dedupe_key,))
+    if cur.fetchone():
+        return False
+    try:
+        db.execute('''
+            INSERT INTO notification_queue
+                (user_id, event_type, dedupe_key, title, body, url, status, attempts, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, ?, ?)
+        ''', (user_id, event_type, dedupe_key, title, body, url, _now(), _now()))
+    except Exception:
+        # Unique dedupe_key: queued concurrently by another run
+        return False
+    return True
+
+
+def enqueue_due_events(db, today=None):
+    """Scan for reminder-worthy events and queue them. Returns count queued."""
+    today = today or date.today()
+    queued = 0
+
+    # Vaccines due within the next few days (index range scan)
+    horizon = (today + timedelta(days=VACCINE_REMINDER_DAYS)).isoformat()
+    for dose in due_doses(db, today.isoformat(), horizon):
+        queued += enqueue(
+            db, dose['user_id'], 'vaccine_due',
+            f"vaccine:{dose['id']}:{dose['scheduled_date']}",
+            f"💉 Imunisasi {dose['vaccine']}",
+            f"{dose['child_name']} dijadwalkan imunisasi {dose['vaccine']} pada {dose['scheduled_date']}.",
+            f"/children/{dose['child_id']}/immunization")
+
+    # Sealed capsules whose unlock date has arrived
+    cur = db.execute('''
+        SELECT tc.id, tc.title, c.user_id, c.name AS child_name
+        FROM time_capsules tc
+        JOIN children c ON tc.child_id = c.id
+        WHERE tc.is_sealed = 1 AND tc.opened_at IS NULL AND tc.unlock_day <= ?
+    ''', (dates.to_day(today),))
+    for capsule in cur.fetchall():
+        queued += enqueue(
+            db, capsule['user_id'], 'capsule_unlock', f"capsule:{capsule['id']}",
+            '💌 Kapsul waktu siap dibuka!',
+            f"\"{capsule['title']}\" untuk {capsule['child_name']} sudah bisa dibuka.",
+            f"/capsule/{capsule['id']}")
+
+    # Scheduled letters reaching their date are delivered (marked sent)
+    cur = db.execute('''
+        SELECT id, child_id, user_id, title FROM scheduled_letters
+        WHERE is_sent = 0 AND unlock_day <= ?
+    ''', (dates.to_day(today),))
+    for letter in cur.fetchall():
+        queued += enqueue(
+            db, letter['user_id'], 'letter_delivered', f"letter:{letter['id']}",
+            '📬 Surat terjadwal telah tiba',
+            f"Surat \"{letter['title']}\" sudah bisa dibaca.",
+            f"/child/{letter['child_id']}/letters")
+        db.execute('UPDATE scheduled_letters SET is_sent = 1 WHERE id = ?', (letter['id'],))
+
+    db.commit()
+    return queued
+
+
+# ==================== SENDERS ====================
+
+class PlainSender:
+    """POSTs the JSON payload as-is. For local stand-in push endpoints."""
+
+    def send(self, subscription, payload):
+        request = urllib.request.Request(
+            subscription['endpoint'], data=payload.encode(), method='POST',
+            headers={'Content-Type': 'application/json', 'TTL': '86400'})
+        try:
+            with urllib.request.urlopen(request, timeout=PUSH_TIMEOUT) as response:
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            return e.code, str(e)
+        except (urllib.error.URLError, OSError) as e:
+            return None, str(e)
+
+
+class WebPushSender:
+    """Encrypted Web Push with VAPID via pywebpush."""
+
+    def send(self, subscription, payload):
+        # lazy import so pywebpush is only needed when push is configured
+        from pywebpush import webpush, WebPushException
+        try:
+            response = webpush(
+                subscription_info={
+                    'endpoint': subscription['endpoint'],
+                    'keys': {'p256dh': subscription['p256dh'], 'auth': subscription['auth']},
+                },
+                data=payload,
+                vapid_private_key=VAPID_PRIVATE_KEY,
+                vapid_claims={'sub': VAPID_SUBJECT},
+                timeout=PUSH_TIMEOUT,
+            )
+            return response.status_code, None
+        except WebPushException as e:
+            status = e.response.status_code if e.response is not None else None
+            return status, str(e)
+
+
+def get_sender():
+    return WebPushSender() if PUSH_SENDER == 'webpush' else PlainSender()
+
+
+# ==================== DELIVERY ====================
+
+def _coalesce(items):
+    """One payload per user: the event itself, or a summary of several."""
+    if len(items) == 1:
+        item = items[0]
+        return {'title': item['title'], 'body': item['body'], 'url': item['url']}
+    titles = [item['title'] for item in items]
+    body = '; '.join(titles[:3]) + (f' dan {len(titles) - 3} lainnya' if len(titles) > 3 else '')
+    return {'title': f'🍼 {len(items)} pengingat baru', 'body': body, 'url': '/dashboard'}
+
+
+def deliver_pending(db, sender=None, batch_size=None, concurrency=None):
+    """Deliver one batch of due notifications. Returns a stats dict."""
+    sender = sender or get_sender()
+    batch_size = batch_size or PUSH_BATCH_SIZE
+    concurrency = concurrency or PUSH_CONCURRENCY
+    stats = {'users': 0, 'sent': 0, 'coalesced': 0, 'retried': 0, 'failed': 0,
+             'dropped': 0, 'pruned': 0}
+
+    cur = db.execute('''
+        SELECT id, user_id, title, body, url, attempts FROM notification_queue
+        WHERE status = 'queued' AND next_attempt_at <= ?
+        ORDER BY id LIMIT ?
+    ''', (_now(), batch_size))
+    rows = cur.fetchall()
+    if not rows:
+        return stats
+
+    by_user = {}
+    for row in rows:
+        by_user.setdefault(row['user_id'], []).append(row)
+    stats['users'] = len(by_user)
+
+    user_ids = list(by_user)
+    placeholders = ','.join('?' * len(user_ids))
+    cur = db.execute(f'''
+        SELECT id, user_id, endpoint, p256dh, auth FROM push_subscriptions
+        WHERE user_id IN ({placeholders})
+    ''', tuple(user_ids))
+    subs_by_user = {}
+    for sub in cur.fetchall():
+        subs_by_user.setdefault(sub['user_id'], []).append(sub)
+
+    tasks = []
+    for user_id, items in by_user.items():
+        payload = json.dumps(_coalesce(items))
+        for sub in subs_by_user.get(user_id, []):
+            tasks.append((user_id, sub, payload))
+
+    def send(task):
+        user_id, sub, payload = task
+        return task, sender.send(sub, payload)
+
+    delivered_users = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for (user_id, sub, _), (status, error) in pool.map(send, tasks):
+            if status is not None and 200 <= status < 300:
+                delivered_users.add(user_id)
+                db.execute('UPDATE push_subscriptions SET last_success_at=?, failure_count=0 WHERE id=?',
+                           (_now(), sub['id']))
+            elif status in GONE_STATUSES:
+                db.execute('DELETE FROM push_subscriptions WHERE id=?', (sub['id'],))
+                stats['pruned'] += 1
+            else:
+                logger.warning('Push to subscription %s failed: %s %s', sub['id'], status, error)
+                db.execute('UPDATE push_subscriptions SET failure_count=failure_count+1 WHERE id=?',
+                           (sub['id'],))
+
+    for user_id, items in by_user.items():
+        ids = [item['id'] for item in items]
+        if user_id in delivered_users:
+            db.executemany("UPDATE notification_queue SET status='sent', sent_at=? WHERE id=?",
+                           [(_now(), i) for i in ids])
+            stats['sent'] += 1
+            stats['coalesced'] += len(ids) - 1
+        elif not subs_by_user.get(user_id):
+            # No (remaining) devices to deliver to
+            db.executemany("UPDATE notification_queue SET status='dropped' WHERE id=?",
+                           [(i,) for i in ids])
+            stats['dropped'] += len(ids)
+        else:
+            for item in items:
+                attempts = item['attempts'] + 1
+                if attempts >= PUSH_MAX_ATTEMPTS:
+                    db.execute("UPDATE notification_queue SET status='failed', attempts=? WHERE id=?",
+                               (attempts, item['id']))
+                    stats['failed'] += 1
+                else:
+                    delay = PUSH_BACKOFF_SECONDS * (2 ** (attempts - 1))
+                    next_attempt = (datetime.now() + timedelta(seconds=delay)).isoformat(
+                        sep=' ', timespec='seconds')
+                    db.execute('UPDATE notification_queue SET attempts=?, next_attempt_at=? WHERE id=?',
+                               (attempts, next_attempt, item['id']))
+                    stats['retried'] += 1
+    db.commit()
+    return stats
+
+
+# ==================== JOBS ====================
+
+@job('push-enqueue', every=int(os.environ.get('PUSH_ENQUEUE_INTERVAL', '3600')))
+def enqueue_job():
+    queued = enqueue_due_events(get_db())
+    logger.info('Queued %d notifications', queued)
+
+
+@job('push-deliver', every=int(os.environ.get('PUSH_DELIVER_INTERVAL', '30')))
+def deliver_job():
+    db = get_db()
+    # Drain the queue in batches until nothing due is left
+    while True:
+        stats = deliver_pending(db)
+        if not stats['users']:
+            break
+        logger.info('Push delivery: %s', stats)
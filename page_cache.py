@@ -0,0 +1,203 @@
+"""
+Response compression and a full-page cache for anonymous pages.
+
+compress_response() runs after every request and gzips (or brotli-compresses,
+when the optional `brotli` module is installed) dynamic HTML/JSON bodies
+above COMPRESS_MIN_SIZE. Files sent with send_file and responses that are
+already encoded (e.g. /assets) are left alone.
+
+@cached_page keeps the rendered body of anonymous GET pages (landing, login,
+register) in memory per worker, together with its compressed variants, so a
+hit costs a dict lookup instead of a Jinja render plus compression. Entries
+are keyed on the path, the template version (a hash of templates/ and the
+asset manifest, so a deploy never serves stale markup), the locale and the
+visitor's theme, and the least recently used entries beyond
+PAGE_CACHE_MAX_ENTRIES are dropped (expired ones first). Anyone with a
+session (logged in, or with flashed messages waiting) bypasses the cache
+entirely.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request, session
+
+import assets
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+COMPRESSIBLE_TYPES = ('text/html', 'application/json', 'text/plain', 'text/calendar')
+
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', '300'))
+# Browser/CDN lifetime for cached anonymous pages
+PAGE_CACHE_MAX_AGE = int(os.environ.get('PAGE_CACHE_MAX_AGE', '60'))
+PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE', '1') == '1'
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', '256'))
+
+# All UI strings are Indonesian for now; the locale is part of the cache key
+# so adding a translation does not require touching the cache.
+SUPPORTED_LOCALES = ['id']
+DEFAULT_LOCALE = 'id'
+
+# Session keys that do not make a visitor "logged in"
+ANONYMOUS_SESSION_KEYS = {'theme'}
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_template_version = None
+
+
+def _accepts(encoding):
+    return encoding in request.headers.get('Accept-Encoding', '')
+
+
+def _add_vary(response, header):
+    vary = [v.strip() for v in response.headers.get('Vary', '').split(',') if v.strip()]
+    if header not in vary:
+        vary.append(header)
+    response.headers['Vary'] = ', '.join(vary)
+
+
+def _encode(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+
+
+def _pick_encoding():
+    if brotli and _accepts('br'):
+        return 'br'
+    if _accepts('gzip'):
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook: compress large dynamic text responses."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    _add_vary(response, 'Accept-Encoding')
+    encoding = _pick_encoding()
+    if encoding is None:
+        return response
+    response.set_data(_encode(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def template_version():
+    """Hash of every template and the asset manifest, computed once per process."""
+    global _template_version
+    if _template_version is None:
+        digest = hashlib.sha256()
+        for root, _, files in sorted(os.walk(TEMPLATES_DIR)):
+            for name in sorted(files):
+                with open(os.path.join(root, name), 'rb') as f:
+                    digest.update(name.encode() + f.read())
+        digest.update(repr(sorted(assets.load_manifest().items())).encode())
+        _template_version = digest.hexdigest()[:12]
+    return _template_version
+
+
+def _is_anonymous():
+    return set(session.keys()) <= ANONYMOUS_SESSION_KEYS
+
+
+def _locale():
+    return request.accept_languages.best_match(SUPPORTED_LOCALES) or DEFAULT_LOCALE
+
+
+def _cached_response(entry):
+    encoding = _pick_encoding()
+    # Each encoding is a different representation, so it gets its own ETag
+    etag = f"{entry['etag']}-{encoding or 'identity'}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        body = entry['body']
+        if encoding:
+            if encoding not in entry['encoded']:
+                entry['encoded'][encoding] = _encode(body, encoding)
+            body = entry['encoded'][encoding]
+        response = Response(body, mimetype=entry['mimetype'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    _set_cache_headers(response)
+    return response
+
+
+def _set_cache_headers(response):
+    response.headers['Cache-Control'] = f'public, max-age={PAGE_CACHE_MAX_AGE}'
+    # Logged-in visitors get a redirect or a different page at the same URL
+    _add_vary(response, 'Cookie')
+    _add_vary(response, 'Accept-Encoding')
+    _add_vary(response, 'Accept-Language')
+
+
+def _store(key, entry, now):
+    with _lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        if len(_cache) > PAGE_CACHE_MAX_ENTRIES:
+            for stale in [k for k, e in _cache.items() if e['expires'] <= now]:
+                del _cache[stale]
+        while len(_cache) > PAGE_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def cached_page(view):
+    """Serve anonymous GETs of `view` from the in-process page cache."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if (not PAGE_CACHE_ENABLED or current_app.debug
+                or request.method != 'GET' or not _is_anonymous()):
+            return view(*args, **kwargs)
+
+        key = (request.path, template_version(), _locale(), session.get('theme', ''))
+        now = time.monotonic()
+        entry = _cache.get(key)
+        if entry and entry['expires'] > now:
+            with _lock:
+                if key in _cache:
+                    _cache.move_to_end(key)
+            return _cached_response(entry)
+
+        response = current_app.make_response(view(*args, **kwargs))
+        # Only plain, cookie-free 200 pages are shareable
+        if (response.status_code != 200 or response.direct_passthrough
+                or 'Set-Cookie' in response.headers or session.modified):
+            return response
+        body = response.get_data()
+        entry = {
+            'body': body,
+            'encoded': {},
+            'mimetype': response.mimetype,
+            'etag': hashlib.sha256(body).hexdigest()[:16],
+            'expires': now + PAGE_CACHE_TTL,
+        }
+        _store(key, entry, now)
+        return _cached_response(entry)
+    return wrapper
+
+
+def clear():
+    with _lock:
+        _cache.clear()
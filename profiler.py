@@ -0,0 +1,330 @@
+"""
+On-demand sampling profiler for slow pages in production.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or, with
+PROFILE_SAMPLE_RATE set, when it is picked at random. While it runs, one
+background thread per worker reads the request thread's stack from
+sys._current_frames() every PROFILE_INTERVAL_MS, covering the view, the
+queries and the Jinja render. Nothing is hooked into the interpreter, so an
+unprofiled request pays only for a dict lookup, and a profiled one for a
+few stack walks per second of other threads' time.
+
+Each profile is written to PROFILE_DIR in collapsed-stack format (one
+`frame;frame;frame count` line per stack), the input of flamegraph.pl,
+speedscope and `flask --app app profile-flamegraph`. The file name carries
+the endpoint, a user bucket (a hash of the user id, never the id itself),
+the status, the duration and the number of SQL statements, e.g.
+
+    20260101T120000.000000Z-growth_list-u07-200-850ms-q42.folded
+
+Only PROFILE_KEEP files (and at most PROFILE_MAX_MB) are kept; the oldest
+are deleted first. Randomly sampled requests faster than PROFILE_MIN_MS are
+not written at all.
+
+Under the gevent profile all greenlets share one OS thread, so stacks
+cannot be attributed to a request and profiling stays off.
+"""
+import glob
+import hashlib
+import hmac
+import html
+import logging
+import os
+import random
+import re
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from flask import Flask, g, request, session
+
+from db import DATABASE_DIR
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MIN_MS = int(os.environ.get('PROFILE_MIN_MS', '200'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(DATABASE_DIR, 'profiles'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '200'))
+PROFILE_MAX_MB = int(os.environ.get('PROFILE_MAX_MB', '50'))
+# Requests profiled at the same time, per worker
+PROFILE_MAX_ACTIVE = int(os.environ.get('PROFILE_MAX_ACTIVE', '4'))
+PROFILE_USER_BUCKETS = 32
+
+PROFILE_HEADER = 'X-Profile'
+SUFFIX = '.folded'
+
+# Stacks are cut at the Flask entry point; the server frames above it are
+# the same for every request
+_ROOT_CODE = Flask.wsgi_app.__code__
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_STDLIB_DIR = sysconfig.get_paths()['stdlib'] + os.sep
+
+_active = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_sampler = None
+_labels = {}
+
+
+class Profile:
+    def __init__(self, reason):
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.queries = 0
+
+    def count_query(self, sql):
+        self.queries += 1
+
+    @property
+    def elapsed_ms(self):
+        return int((time.perf_counter() - self.started) * 1000)
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if 'site-packages' + os.sep in path:
+            path = path.split('site-packages' + os.sep, 1)[1]
+        elif path.startswith(_PROJECT_DIR):
+            path = path[len(_PROJECT_DIR):]
+        elif path.startswith(_STDLIB_DIR):
+            path = path[len(_STDLIB_DIR):]
+        label = _labels[code] = f'{code.co_name} ({path}:{code.co_firstlineno})'.replace(';', ',')
+    return label
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        if frame.f_code is _ROOT_CODE:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return ';'.join(stack)
+
+
+def _sample_forever():
+    interval = PROFILE_INTERVAL_MS / 1000
+    while True:
+        if not _active:
+            _wakeup.wait()
+            _wakeup.clear()
+            continue
+        time.sleep(interval)
+        frames = sys._current_frames()
+        with _lock:
+            for ident, profile in _active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    profile.stacks[_collapse(frame)] += 1
+        del frames
+
+
+def _ensure_sampler():
+    global _sampler
+    with _lock:
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = threading.Thread(target=_sample_forever, name='babygrow-profiler', daemon=True)
+            _sampler.start()
+    _wakeup.set()
+
+
+def _reason():
+    token = request.headers.get(PROFILE_HEADER)
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return 'header'
+    if PROFILE_SAMPLE_RATE and request.endpoint != 'static' and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+
+def start():
+    """before_request: begin profiling this request if it asked for it or was sampled."""
+    reason = _reason()
+    if reason is None:
+        return
+    profile = Profile(reason)
+    with _lock:
+        if len(_active) >= PROFILE_MAX_ACTIVE:
+            return
+        _active[threading.get_ident()] = profile
+    g._profile = profile
+    # get_db() installs it on connections opened later in the request
+    g._query_trace = profile.count_query
+    for name in ('_database', '_catalog'):
+        db = g.get(name)
+        if db is not None:
+            db.set_trace_callback(profile.count_query)
+    _ensure_sampler()
+
+
+def _stop():
+    profile = g.pop('_profile', None)
+    if profile is not None:
+        with _lock:
+            _active.pop(threading.get_ident(), None)
+    return profile
+
+
+def user_bucket(user_id):
+    if not user_id:
+        return 'anon'
+    digest = hashlib.sha256(str(user_id).encode()).digest()
+    return f'u{int.from_bytes(digest[:4], "big") % PROFILE_USER_BUCKETS:02d}'
+
+
+def _write(profile, status):
+    elapsed = profile.elapsed_ms
+    if profile.reason == 'sampled' and elapsed < PROFILE_MIN_MS:
+        return None
+    if not profile.stacks:
+        return None
+    endpoint = re.sub(r'[^A-Za-z0-9_]', '_', request.endpoint or 'unknown')
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ')
+    name = (f"{stamp}-{endpoint}-{user_bucket(session.get('user_id'))}-{status}"
+            f"-{elapsed}ms-q{profile.queries}{SUFFIX}")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, name)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        for stack, count in profile.stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    os.replace(path + '.tmp', path)
+    prune()
+    logger.info('Profiled %s %s in %dms (%d samples, %d queries): %s', request.method,
+                request.path, elapsed, sum(profile.stacks.values()), profile.queries, name)
+    return name
+
+
+def finish(response):
+    """after_request: write the profile; the requester gets its file name back."""
+    profile = _stop()
+    if profile is not None:
+        try:
+            name = _write(profile, response.status_code)
+        except OSError:
+            logger.exception('Writing profile failed')
+            name = None
+        if name and profile.reason == 'header':
+            response.headers['X-Profile-File'] = name
+    return response
+
+
+def abandon(exception):
+    """teardown_request: profiles of requests that raised are still written."""
+    profile = _stop()
+    if profile is not None:
+        try:
+            _write(profile, 500)
+        except OSError:
+            logger.exception('Writing profile failed')
+
+
+def profiles():
+    """Profile file names, oldest first (the timestamp prefix sorts)."""
+    try:
+        return sorted(n for n in os.listdir(PROFILE_DIR) if n.endswith(SUFFIX))
+    except FileNotFoundError:
+        return []
+
+
+def prune():
+    """Delete the oldest profiles beyond PROFILE_KEEP files or PROFILE_MAX_MB."""
+    names = profiles()
+    sizes = {}
+    for name in names:
+        try:
+            sizes[name] = os.path.getsize(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+    names = [n for n in names if n in sizes]
+    total = sum(sizes.values())
+    limit = PROFILE_MAX_MB * 1024 * 1024
+    while names and (len(names) > PROFILE_KEEP or total > limit):
+        name = names.pop(0)
+        total -= sizes[name]
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def load(patterns):
+    """Merged stack counts of the profiles matching the glob patterns."""
+    stacks = Counter()
+    files = sorted({path for pattern in patterns
+                    for path in glob.glob(os.path.join(PROFILE_DIR, pattern))})
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack and count.isdigit():
+                    stacks[stack] += int(count)
+    return stacks, files
+
+
+def flamegraph_svg(stacks, title='BabyGrow profile', width=1200, row=16):
+    """Render collapsed stacks as a self-contained SVG flame graph."""
+    root = {'value': 0, 'children': {}}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for frame in stack.split(';'):
+            node = node['children'].setdefault(frame, {'value': 0, 'children': {}})
+            node['value'] += count
+
+    def depth(node):
+        return 1 + max((depth(c) for c in node['children'].values()), default=0)
+
+    rows = depth(root)
+    height = (rows + 2) * row
+    total = root['value'] or 1
+    scale = (width - 20) / total
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+           f'font-family="monospace" font-size="11">',
+           f'<text x="10" y="{row - 3}">{html.escape(title)} ({total} samples)</text>']
+
+    def draw(name, node, x, level):
+        w = node['value'] * scale
+        if w < 0.5:
+            return
+        y = height - (level + 1) * row
+        hue = int(hashlib.md5(name.encode()).hexdigest()[:2], 16) % 50
+        label = html.escape(name)
+        pct = 100 * node['value'] / total
+        out.append(f'<g><title>{label} ({node["value"]} samples, {pct:.1f}%)</title>'
+                   f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" '
+                   f'fill="hsl({hue}, 85%, 60%)"/>')
+        chars = int(w / 7)
+        if chars >= 3:
+            text = name if len(name) <= chars else name[:chars - 2] + '..'
+            out.append(f'<text x="{x + 2:.1f}" y="{y + row - 4}">{html.escape(text)}</text>')
+        out.append('</g>')
+        for child_name, child in sorted(node['children'].items()):
+            draw(child_name, child, x, level + 1)
+            x += child['value'] * scale
+
+    draw('all', root, 10, 0)
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+def init_app(app):
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+        if PROFILE_TOKEN or PROFILE_SAMPLE_RATE:
+            logger.warning('Profiling is not available with gevent workers')
+        return
+    if not (PROFILE_TOKEN or PROFILE_SAMPLE_RATE):
+        return
+    app.before_request(start)
+    app.after_request(finish)
+    app.teardown_request(abandon)
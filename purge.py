@@ -0,0 +1,247 @@
+"""
+Deleting children and capsules together with everything that hangs off them.
+
+purge_child() removes the child and all dependent rows (growth, milestones,
+immunizations, capsules and their media, archived or not, letters, family
+access, insights) in one transaction. Uploaded files cannot take part in a
+database transaction, so their URLs are written to `media_purge_queue` in
+that same transaction and a background janitor deletes the files in batches. A
+rollback therefore never loses a file that is still referenced, and a crash
+after the commit never leaves a file behind for good.
+
+reconcile() cleans up what older versions left behind: dependent rows whose
+child or capsule no longer exists, and files under static/uploads that no
+row references.
+"""
+import logging
+import os
+import time
+from datetime import datetime
+
+from db import each_database, get_catalog_db, get_db
+from media_store import get_store, key_to_url, url_to_key, url_to_path
+from migrations import CHILD_TABLES
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+MEDIA_PURGE_BATCH = int(os.environ.get('MEDIA_PURGE_BATCH', '200'))
+MEDIA_PURGE_MAX_ATTEMPTS = 5
+# Files younger than this are never treated as orphans: the upload handler
+# saves the file before inserting its row
+ORPHAN_GRACE_SECONDS = int(os.environ.get('ORPHAN_GRACE_SECONDS', '3600'))
+
+
+def enqueue_files(db, urls):
+    """Queue upload files for deletion by the janitor (caller commits)."""
+    now = datetime.now().isoformat()
+    queued = 0
+    for url in set(u for u in urls if url_to_path(u)):
+        if db.execute('SELECT id FROM media_purge_queue WHERE file_url=?', (url,)).fetchone():
+            continue
+        db.execute('INSERT INTO media_purge_queue (file_url, attempts, enqueued_at) VALUES (?, 0, ?)',
+                   (url, now))
+        queued += 1
+    return queued
+
+
+def _media_urls(db, where, params):
+    cur = db.execute(f'''
+        SELECT cm.file_url, cm.thumbnail_url FROM capsule_media cm
+        JOIN time_capsules tc ON tc.id = cm.capsule_id
+        WHERE {where}
+    ''', params)
+    urls = []
+    for row in cur.fetchall():
+        urls.extend(u for u in (row['file_url'], row['thumbnail_url']) if u)
+    return urls
+
+
+def purge_child(db, child_id):
+    """Delete a child and every dependent row in one transaction.
+
+    Returns {table: rows_deleted, 'files_queued': n}.
+    """
+    counts = {}
+    try:
+        row = db.execute('SELECT photo_url FROM children WHERE id=?', (child_id,)).fetchone()
+        urls = _media_urls(db, 'tc.child_id = ?', (child_id,))
+        if row and row['photo_url']:
+            urls.append(row['photo_url'])
+        counts['files_queued'] = enqueue_files(db, urls)
+
+        cur = db.execute('''
+            DELETE FROM capsule_media
+            WHERE capsule_id IN (SELECT id FROM time_capsules WHERE child_id = ?)
+        ''', (child_id,))
+        counts['capsule_media'] = cur.rowcount
+        # Archived copies go too; the emptied packs are removed by cold_storage
+        cur = db.execute('''
+            DELETE FROM cold_media
+            WHERE capsule_id IN (SELECT id FROM time_capsules WHERE child_id = ?)
+        ''', (child_id,))
+        counts['cold_media'] = cur.rowcount
+        for table in CHILD_TABLES:
+            cur = db.execute(f'DELETE FROM {table} WHERE child_id = ?', (child_id,))
+            counts[table] = cur.rowcount
+        cur = db.execute('DELETE FROM children WHERE id = ?', (child_id,))
+        counts['children'] = cur.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return counts
+
+
+def purge_capsule(db, capsule_id):
+    """Delete one capsule, its media rows and (asynchronously) its files."""
+    try:
+        queued = enqueue_files(db, _media_urls(db, 'tc.id = ?', (capsule_id,)))
+        db.execute('DELETE FROM capsule_media WHERE capsule_id = ?', (capsule_id,))
+        db.execute('DELETE FROM cold_media WHERE capsule_id = ?', (capsule_id,))
+        db.execute('DELETE FROM time_capsules WHERE id = ?', (capsule_id,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return queued
+
+
+def _referenced(db, urls):
+    """Subset of urls that some row still points at."""
+    urls = list(urls)
+    if not urls:
+        return set()
+    marks = ','.join('?' * len(urls))
+    cur = db.execute(f'''
+        SELECT file_url AS url FROM capsule_media WHERE file_url IN ({marks})
+        UNION SELECT thumbnail_url FROM capsule_media WHERE thumbnail_url IN ({marks})
+        UNION SELECT photo_url FROM children WHERE photo_url IN ({marks})
+    ''', tuple(urls) * 3)
+    return {row['url'] for row in cur.fetchall()}
+
+
+def run_janitor(db, batch_size=None):
+    """Delete one batch of queued files. Returns (processed, deleted, failed)."""
+    batch_size = batch_size or MEDIA_PURGE_BATCH
+    rows = db.execute('''
+        SELECT id, file_url, attempts FROM media_purge_queue
+        WHERE attempts < ? ORDER BY id LIMIT ?
+    ''', (MEDIA_PURGE_MAX_ATTEMPTS, batch_size)).fetchall()
+    if not rows:
+        return 0, 0, 0
+
+    # A file can be queued and then referenced again (e.g. a restore);
+    # never delete a file that is still in use
+    in_use = _referenced(db, [r['file_url'] for r in rows])
+    store = get_store()
+    done, deleted, failed = [], 0, 0
+    for row in rows:
+        if row['file_url'] not in in_use:
+            try:
+                store.delete(url_to_key(row['file_url']))
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                failed += 1
+                db.execute('UPDATE media_purge_queue SET attempts=?, last_error=? WHERE id=?',
+                           (row['attempts'] + 1, str(e)[:500], row['id']))
+                continue
+        done.append((row['id'],))
+    if done:
+        db.executemany('DELETE FROM media_purge_queue WHERE id=?', done)
+    db.commit()
+    return len(rows), deleted, failed
+
+
+def reconcile_rows(db, dry_run=False):
+    """Delete dependent rows whose child or capsule no longer exists."""
+    report = {}
+    orphan_media = 'capsule_id NOT IN (SELECT id FROM time_capsules)'
+    orphan_child = 'child_id NOT IN (SELECT id FROM children)'
+    try:
+        row = db.execute(f'SELECT COUNT(*) AS n FROM capsule_media WHERE {orphan_media}').fetchone()
+        report['capsule_media'] = row['n']
+        for table in CHILD_TABLES:
+            row = db.execute(f'SELECT COUNT(*) AS n FROM {table} WHERE {orphan_child}').fetchone()
+            report[table] = row['n']
+        # Files of media rows removed here stay on disk until the file scan
+        # sees that nothing references them any more
+        if not dry_run:
+            # time_capsules first, so their media become orphans in this pass
+            db.execute(f'DELETE FROM time_capsules WHERE {orphan_child}')
+            db.execute(f'DELETE FROM capsule_media WHERE {orphan_media}')
+            for table in CHILD_TABLES:
+                db.execute(f'DELETE FROM {table} WHERE {orphan_child}')
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return report
+
+
+def referenced_urls(db):
+    referenced = set()
+    for sql in ('SELECT file_url AS url FROM capsule_media',
+                'SELECT thumbnail_url AS url FROM capsule_media WHERE thumbnail_url IS NOT NULL',
+                'SELECT photo_url AS url FROM children WHERE photo_url IS NOT NULL',
+                'SELECT file_url AS url FROM media_purge_queue'):
+        referenced.update(row['url'] for row in db.execute(sql).fetchall())
+    return referenced
+
+
+def orphan_files(referenced, grace_seconds=None):
+    """Upload URLs older than the grace period that nothing references."""
+    grace_seconds = ORPHAN_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = time.time() - grace_seconds
+    orphans = []
+    for key, _, mtime in get_store().list():
+        url = key_to_url(key)
+        if url not in referenced and mtime < cutoff:
+            orphans.append(url)
+    return orphans
+
+
+def reconcile(dry_run=False, grace_seconds=None):
+    """Find orphaned rows and files left by older delete paths.
+
+    Covers every database (all shards with DB_SHARDING): orphan rows are
+    deleted in each, and a file only counts as orphaned when no database
+    references it. Orphan files are queued in the main database for the
+    janitor. With dry_run nothing is changed. Returns a report of counts.
+    """
+    report = {}
+    referenced = set()
+    for db in each_database():
+        for name, count in reconcile_rows(db, dry_run).items():
+            report[name] = report.get(name, 0) + count
+        referenced |= referenced_urls(db)
+    orphans = orphan_files(referenced, grace_seconds)
+    report['orphan_files'] = len(orphans)
+    if not dry_run and orphans:
+        catalog = get_catalog_db()
+        enqueue_files(catalog, orphans)
+        catalog.commit()
+    return report
+
+
+@job('media-janitor', every=300)
+def janitor_job():
+    db = get_db()
+    total = 0
+    while True:
+        processed, deleted, failed = run_janitor(db)
+        total += deleted
+        # Failures are retried on the next run, not in a tight loop
+        if processed < MEDIA_PURGE_BATCH or failed:
+            break
+    if total:
+        logger.info('Deleted %d purged media files', total)
+
+
+@job('purge-reconcile', every=86400, per_database=False)
+def reconcile_job():
+    report = reconcile()
+    if any(report.values()):
+        logger.info('Reconciliation cleaned up: %s', report)
@@ -0,0 +1,248 @@
+"""
+Posyandu groups and the coordinator roster.
+
+A coordinator oversees a posyandu group; parents put a child in the group by
+entering its join code on the child's edit page (children.posyandu_id). The
+roster lists every child of the group with their age, latest measurement and
+its WHO status band (see growth_report.py), overdue vaccines and milestone
+progress.
+
+Each page is computed with a fixed number of set-based queries per
+database, however many children the group has: one keyset-paginated scan
+of the group's children, then one query each for the latest measurements,
+the overdue doses and the milestone counts of just those children, plus two
+group-wide counts for the summary. Every sort order is an index scan over
+(posyandu_id, key, id) (migration 13); children.last_growth_day is kept by
+triggers so "longest since last weighing" is one of them. With sharding the
+same queries run in every shard and the pages are merged.
+"""
+import os
+import secrets
+
+import dates
+import growth_report
+from db import each_database
+
+ROSTER_PAGE_SIZE = int(os.environ.get('ROSTER_PAGE_SIZE', '50'))
+ROSTER_PAGE_MAX = 200
+# A child not weighed for this long is flagged (posyandu weigh monthly)
+ROSTER_STALE_DAYS = int(os.environ.get('ROSTER_STALE_DAYS', '35'))
+
+# Unambiguous characters, as parents type the code at the posyandu
+JOIN_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+JOIN_CODE_LENGTH = 6
+
+# sort -> (column, descending, label); each has a (posyandu_id, column, id) index
+SORTS = {
+    'name': ('name', False, 'Nama (A-Z)'),
+    'stale': ('last_growth_day', False, 'Paling lama belum ditimbang'),
+    'recent': ('last_growth_day', True, 'Baru ditimbang'),
+    'youngest': ('dob_day', True, 'Termuda'),
+    'oldest': ('dob_day', False, 'Tertua'),
+}
+DEFAULT_SORT = 'name'
+
+
+def create_group(catalog, name, coordinator_id):
+    """Create a group coordinated by `coordinator_id`; returns (id, join_code). Commits."""
+    while True:
+        code = ''.join(secrets.choice(JOIN_CODE_ALPHABET) for _ in range(JOIN_CODE_LENGTH))
+        if not catalog.execute('SELECT 1 FROM posyandu_groups WHERE join_code=?', (code,)).fetchone():
+            break
+    cur = catalog.execute('INSERT INTO posyandu_groups (name, coordinator_id, join_code) VALUES (?, ?, ?)',
+                          (name, coordinator_id, code))
+    catalog.commit()
+    return cur.lastrowid, code
+
+
+def group_by_code(catalog, code):
+    return catalog.execute('SELECT id, name FROM posyandu_groups WHERE join_code=?',
+                           (str(code or '').strip().upper(),)).fetchone()
+
+
+def group_name(catalog, group_id):
+    if group_id is None:
+        return None
+    row = catalog.execute('SELECT name FROM posyandu_groups WHERE id=?', (group_id,)).fetchone()
+    return row['name'] if row else None
+
+
+def coordinated_groups(catalog, user_id):
+    return catalog.execute('''
+        SELECT id, name, join_code FROM posyandu_groups WHERE coordinator_id=? ORDER BY name
+    ''', (user_id,)).fetchall()
+
+
+def coordinated_group(catalog, group_id, user_id):
+    """The group if `user_id` coordinates it, else None."""
+    return catalog.execute('''
+        SELECT id, name, join_code FROM posyandu_groups WHERE id=? AND coordinator_id=?
+    ''', (group_id, user_id)).fetchone()
+
+
+# -- pagination
+
+def encode_cursor(row, sort):
+    key = row[SORTS[sort][0]]
+    return f"{row['id']}:{'' if key is None else key}"
+
+
+def decode_cursor(cursor, sort):
+    """(key, id) from a cursor; None if it is malformed."""
+    child_id, _, key = str(cursor).partition(':')
+    try:
+        child_id = int(child_id)
+        if SORTS[sort][0] != 'name':
+            key = int(key) if key != '' else None
+    except ValueError:
+        return None
+    return key, child_id
+
+
+def _after(column, descending, key, child_id):
+    """WHERE clause for the rows after (key, child_id) in sort order.
+
+    NULL keys sort first ascending and last descending, in SQLite and MySQL
+    alike; spelled out rather than a row-value comparison so MySQL keeps
+    using the index.
+    """
+    op = '<' if descending else '>'
+    if key is None:
+        if descending:
+            return f'(c.{column} IS NULL AND c.id {op} ?)', (child_id,)
+        return f'((c.{column} IS NULL AND c.id {op} ?) OR c.{column} IS NOT NULL)', (child_id,)
+    clause = f'(c.{column} {op} ? OR (c.{column} = ? AND c.id {op} ?))'
+    if descending:
+        clause = f'({clause} OR c.{column} IS NULL)'
+    return clause, (key, key, child_id)
+
+
+def _sort_key(column, descending):
+    def key(row):
+        value = row[column]
+        # NULLs first ascending (and so last descending), as the database does
+        return (value is not None, value if value is not None else 0, row['id'])
+    return key
+
+
+# -- queries
+
+def _page_rows(db, group_id, sort, after, limit):
+    column, descending, _ = SORTS[sort]
+    where, params = 'c.posyandu_id = ?', [group_id]
+    if after is not None:
+        clause, extra = _after(column, descending, *after)
+        where += f' AND {clause}'
+        params.extend(extra)
+    direction = 'DESC' if descending else 'ASC'
+    return db.execute(f'''
+        SELECT c.id, c.user_id, c.name, c.dob, c.dob_day, c.gender, c.last_growth_day
+        FROM children c WHERE {where}
+        ORDER BY c.{column} {direction}, c.id {direction} LIMIT ?
+    ''', (*params, limit)).fetchall()
+
+
+def _details(db, child_ids, today):
+    """Latest measurement, overdue doses and milestone counts of `child_ids`."""
+    marks = ','.join('?' * len(child_ids))
+    latest, overdue, milestones = {}, {}, {}
+    # Rows of the latest record day; ordered by id so the last entered wins
+    for row in db.execute(f'''
+        SELECT g.child_id, g.record_date, g.age_days, g.weight, g.height FROM growth g
+        JOIN children c ON c.id = g.child_id AND g.record_day = c.last_growth_day
+        WHERE g.child_id IN ({marks}) ORDER BY g.id
+    ''', tuple(child_ids)):
+        latest[row['child_id']] = row
+    for row in db.execute(f'''
+        SELECT child_id, vaccine FROM immunization
+        WHERE child_id IN ({marks}) AND status = 'pending' AND scheduled_day < ?
+        ORDER BY scheduled_day
+    ''', (*child_ids, today)):
+        overdue.setdefault(row['child_id'], []).append(row['vaccine'])
+    for row in db.execute(f'''
+        SELECT child_id, COUNT(*) AS total,
+               SUM(CASE WHEN status = 'done' THEN 1 ELSE 0 END) AS done
+        FROM development WHERE child_id IN ({marks}) GROUP BY child_id
+    ''', tuple(child_ids)):
+        milestones[row['child_id']] = (row['done'] or 0, row['total'])
+    return latest, overdue, milestones
+
+
+def _summary(db, group_id, today):
+    row = db.execute('''
+        SELECT COUNT(*) AS children,
+               SUM(CASE WHEN last_growth_day < ? THEN 1 ELSE 0 END) AS stale
+        FROM children WHERE posyandu_id = ?
+    ''', (today - ROSTER_STALE_DAYS, group_id)).fetchone()
+    overdue = db.execute('''
+        SELECT COUNT(DISTINCT i.child_id) AS n FROM immunization i
+        JOIN children c ON c.id = i.child_id
+        WHERE c.posyandu_id = ? AND i.status = 'pending' AND i.scheduled_day < ?
+    ''', (group_id, today)).fetchone()
+    return {'children': row['children'] or 0, 'stale': row['stale'] or 0, 'overdue': overdue['n'] or 0}
+
+
+def _entry(child, latest, overdue, milestones, today):
+    sex = growth_report.sex_key(child['gender'])
+    measurement = None
+    if latest is not None:
+        weight = growth_report.to_number(latest['weight'])
+        height = growth_report.to_number(latest['height'])
+        month = latest['age_days'] / growth_report.DAYS_PER_MONTH if latest['age_days'] is not None else None
+        measurement = {
+            'date': latest['record_date'], 'weight': weight, 'height': height,
+            'weight_status': sex and growth_report.status(growth_report.WEIGHT_FOR_AGE[sex],
+                                                          growth_report.WEIGHT_STATUS, month, weight),
+            'height_status': sex and growth_report.status(growth_report.HEIGHT_FOR_AGE[sex],
+                                                          growth_report.HEIGHT_STATUS, month, height),
+        }
+    done, total = milestones or (0, 0)
+    measured = child['last_growth_day'] or None
+    return {
+        'id': child['id'], 'name': child['name'], 'gender': child['gender'], 'dob': child['dob'],
+        'age': growth_report.age_text(today - child['dob_day']) if child['dob_day'] is not None else '-',
+        'latest': measurement,
+        'days_since_measured': today - measured if measured else None,
+        'stale': not measured or today - measured > ROSTER_STALE_DAYS,
+        'overdue': overdue or [],
+        'milestones_done': done, 'milestones_total': total,
+    }
+
+
+def page(group_id, sort=DEFAULT_SORT, after=None, size=None):
+    """One page of a group's roster: (entries, next cursor or None, summary).
+
+    `after` is a cursor from a previous page. Six queries per database,
+    independent of the group and page size.
+    """
+    sort = sort if sort in SORTS else DEFAULT_SORT
+    size = min(max(size or ROSTER_PAGE_SIZE, 1), ROSTER_PAGE_MAX)
+    after = decode_cursor(after, sort) if after else None
+    column, descending, _ = SORTS[sort]
+    today = dates.today_day()
+
+    rows, details = [], {}
+    summary = {'children': 0, 'stale': 0, 'overdue': 0}
+    for db in each_database():
+        found = _page_rows(db, group_id, sort, after, size + 1)
+        if found:
+            rows.extend(found)
+            latest, overdue, milestones = _details(db, [r['id'] for r in found], today)
+            for r in found:
+                details[r['id']] = (latest.get(r['id']), overdue.get(r['id']), milestones.get(r['id']))
+        for name, count in _summary(db, group_id, today).items():
+            summary[name] += count
+
+    # One database already returns them in order; shards are merged here
+    rows.sort(key=_sort_key(column, descending), reverse=descending)
+    more = len(rows) > size
+    rows = rows[:size]
+    entries = [_entry(r, *details[r['id']], today) for r in rows]
+    return entries, (encode_cursor(rows[-1], sort) if more else None), summary
+
+
+def enroll_family(db, group_id, user_id):
+    """Put every child of a family in a group (e.g. a posyandu's own account). Commits."""
+    cur = db.execute('UPDATE children SET posyandu_id=? WHERE user_id=?', (group_id, user_id))
+    db.commit()
+    return max(cur.rowcount, 0)
@@ -10,151 +10,9 @@ from datetime import datetime, timedelta
 import random
 import secrets
 
-# Path database - sama dengan db.py
-DATABASE_DIR = os.path.join(os.path.dirname(__file__), 'database')
-DATABASE = os.path.join(DATABASE_DIR, 'balita.db')
-
-def init_tables(cur):
-    """Create tables if not exist."""
-    # Users
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            email TEXT UNIQUE,
-            password TEXT,
-            full_name TEXT,
-            avatar_url TEXT,
-            preferred_theme TEXT DEFAULT 'peach',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Children
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS children (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            name TEXT,
-            dob TEXT,
-            gender TEXT,
-            photo_url TEXT,
-            blood_type TEXT,
-            allergies TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Growth
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS growth (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            child_id INTEGER,
-            record_date TEXT,
-            weight REAL,
-            height REAL,
-            head_circ REAL,
-            notes TEXT
-        )
-    """)
-    
-    # Development/Milestones
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS development (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            child_id INTEGER,
-            category TEXT DEFAULT 'general',
-            milestone TEXT,
-            status TEXT DEFAULT 'pending',
-            achieved_date TEXT,
-            noted TEXT
-        )
-    """)
-    
-    # Immunization
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS immunization (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            child_id INTEGER,
-            vaccine TEXT,
-            scheduled_date TEXT,
-            date_given TEXT,
-            status TEXT DEFAULT 'pending',
-            location TEXT,
-            notes TEXT
-        )
-    """)
-    
-    # Time Capsules
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS time_capsules (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            child_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            letter_content TEXT,
-            unlock_date TEXT NOT NULL,
-            unlock_occasion TEXT,
-            is_sealed INTEGER DEFAULT 0,
-            sealed_at TIMESTAMP,
-            opened_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Capsule Media
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS capsule_media (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            capsule_id INTEGER NOT NULL,
-            media_type TEXT NOT NULL,
-            file_url TEXT NOT NULL,
-            thumbnail_url TEXT,
-            caption TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Family Access (Phase 3)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS family_access (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            child_id INTEGER NOT NULL,
-            user_id INTEGER,
-            invite_code TEXT UNIQUE,
-            invite_email TEXT,
-            role TEXT DEFAULT 'viewer',
-            status TEXT DEFAULT 'pending',
-            invited_by INTEGER NOT NULL,
-            accepted_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Scheduled Letters (Phase 3)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS scheduled_letters (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            child_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            content TEXT,
-            unlock_date TEXT NOT NULL,
-            unlock_occasion TEXT,
-            is_sent INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Health Insights (Phase 3)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS health_insights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            child_id INTEGER NOT NULL,
-            insight_type TEXT NOT NULL,
-            insight_data TEXT,
-            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+from db import DATABASE_DIR, DATABASE
+from migrations import migrate
+from immunization_schedule import schedule_for
 
 def seed_database():
     """Insert dummy data into database."""
@@ -163,9 +21,8 @@ def seed_database():
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     
-    # Create tables first
-    init_tables(cur)
-    conn.commit()
+    # Create tables first (same migrations as the app, so schemas can't drift)
+    migrate(conn, 'sqlite')
     
     print("🌱 Seeding database for BabyGrow...")
     print("=" * 50)
@@ -264,18 +121,11 @@ def seed_database():
     print(f"✅ Added milestones")
     
     # ======== 5. Add Immunization ========
-    vaccines = [
-        ("Hepatitis B (HB-0)", 0), ("BCG", 1), ("Polio 1", 2), ("DPT-HB-Hib 1", 2),
-        ("Polio 2", 3), ("DPT-HB-Hib 2", 3), ("Campak/MR 1", 9),
-    ]
-    
+    today = datetime.now().strftime("%Y-%m-%d")
     for i, child_id in enumerate(child_ids):
-        dob = datetime.strptime(children_data[i]['dob'], "%Y-%m-%d")
-        child_age_months = (datetime.now() - dob).days // 30
-        
-        for vaccine_name, vaccine_month in vaccines:
-            scheduled_date = (dob + timedelta(days=vaccine_month * 30)).strftime("%Y-%m-%d")
-            if vaccine_month <= child_age_months:
+        # Same national schedule the app materializes for new children
+        for vaccine_name, scheduled_date in schedule_for(children_data[i]['dob']):
+            if scheduled_date <= today:
                 status = "done"
                 date_given = scheduled_date
             else:
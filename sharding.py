@@ -0,0 +1,424 @@
+"""
+Optional per-family SQLite sharding (DB_SHARDING=1).
+
+Each family's rows live in one shard file, database/shards/shard_NN.db, so
+one family's bulk import only locks its own file. balita.db remains the
+catalog. It holds:
+- the authoritative `users` table, used by login and register,
+- `shard_map` (user_id -> shard),
+- `invite_routes` (invite code -> shard),
+- families created before sharding was enabled, as the "main" shard.
+
+New users are placed in a hash bucket (user_id % DB_SHARD_COUNT), and their
+user row is copied into the shard so joins on `users` keep working.
+
+Every shard reserves its own id range: AUTOINCREMENT counters start at
+(index + 1) * SHARD_ID_SPAN. Ids stay globally unique, so rows keep their
+ids when a family moves between shards.
+
+move_user() relocates one family online. Every request (or job) that opens
+a family's shard through connect_for_user() holds a shared lock on that
+family until its app context ends; the lock is a flock on a file under
+SHARD_DIR/locks, so it spans all worker processes and is freed if one dies.
+A move marks the family as moving, so that family's new requests wait,
+then takes the lock exclusively, which waits until every request already
+using the old shard has finished. It then copies the rows while holding the
+source shard's write lock, flips the catalog, and finally deletes the source
+rows. Other families are only blocked for the copy itself.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from db import DATABASE, DATABASE_DIR, _connect_sqlite
+from migrations import CHILD_TABLES, migrate
+
+logger = logging.getLogger(__name__)
+
+DB_SHARD_COUNT = int(os.environ.get('DB_SHARD_COUNT', '8'))
+SHARD_DIR = os.environ.get('DB_SHARD_DIR', os.path.join(DATABASE_DIR, 'shards'))
+MAIN_SHARD = 'main'
+SHARD_ID_SPAN = 10 ** 12
+
+# How long a request for a family that is being moved waits for the move
+MOVE_WAIT_SECONDS = float(os.environ.get('SHARD_MOVE_WAIT_SECONDS', '10'))
+# Longest a move waits for requests already using the old shard (longer
+# than the gunicorn timeout, so a slow upload is never cut off)
+MOVE_DRAIN_SECONDS = float(os.environ.get('SHARD_MOVE_DRAIN_SECONDS', '90'))
+LOCK_DIR = os.path.join(SHARD_DIR, 'locks')
+# Families share lock files by user_id modulo this; a collision only makes a
+# move wait for an unrelated request as well
+LOCK_BUCKETS = 1024
+
+# Tables keyed by user_id that move with the family
+USER_TABLES = ('push_subscriptions', 'notification_queue')
+
+_ready = set()
+_ready_lock = threading.Lock()
+
+
+class ShardError(Exception):
+    pass
+
+
+def shard_names():
+    return [f'shard_{i:02d}' for i in range(DB_SHARD_COUNT)]
+
+
+def shard_path(name):
+    if name == MAIN_SHARD:
+        return DATABASE
+    if name not in shard_names():
+        raise ShardError(f'Unknown shard: {name}')
+    return os.path.join(SHARD_DIR, f'{name}.db')
+
+
+def existing_shards():
+    """The main database plus every shard file created so far."""
+    return [MAIN_SHARD] + [n for n in shard_names() if os.path.exists(shard_path(n))]
+
+
+def bucket_for(user_id):
+    return f'shard_{int(user_id) % DB_SHARD_COUNT:02d}'
+
+
+def id_range(name):
+    """[low, high) of the ids a shard allocates itself."""
+    if name == MAIN_SHARD:
+        return 0, SHARD_ID_SPAN
+    low = (shard_names().index(name) + 1) * SHARD_ID_SPAN
+    return low, low + SHARD_ID_SPAN
+
+
+def _seed_id_ranges(conn, name):
+    """Start every AUTOINCREMENT counter of a shard in its own id range."""
+    offset = id_range(name)[0]
+    tables = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND sql LIKE '%AUTOINCREMENT%'").fetchall()
+    for row in tables:
+        conn.execute('''
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+        ''', (row['name'], offset, row['name']))
+    conn.commit()
+
+
+def _restore_id_range(conn, name):
+    """Pull counters back into the shard's own range after importing rows.
+
+    Inserting a moved row with a foreign id bumps sqlite_sequence past it,
+    which would make this shard allocate ids from another shard's range.
+    """
+    low, high = id_range(name)
+    for row in conn.execute('SELECT name FROM sqlite_sequence').fetchall():
+        table = row['name']
+        top = conn.execute(f'SELECT MAX(id) AS top FROM {table} WHERE id >= ? AND id < ?',
+                           (low, high)).fetchone()['top']
+        conn.execute('UPDATE sqlite_sequence SET seq=? WHERE name=?',
+                     (top if top is not None else low, table))
+
+
+def _prepare(conn, name, target=None, log=logger.info):
+    migrate(conn, 'sqlite', target=target, log=log)
+    if name != MAIN_SHARD:
+        _seed_id_ranges(conn, name)
+
+
+def connect(name):
+    """Open a shard, migrating it the first time this process sees it."""
+    conn = _connect_sqlite(shard_path(name))
+    if name not in _ready:
+        with _ready_lock:
+            if name not in _ready:
+                _prepare(conn, name, log=logger.debug)
+                _ready.add(name)
+    return conn
+
+
+def migrate_shards(target=None, log=print):
+    for name in existing_shards():
+        if name == MAIN_SHARD:
+            continue
+        log(f'Shard {name}:')
+        conn = _connect_sqlite(shard_path(name))
+        try:
+            _prepare(conn, name, target=target, log=log)
+        finally:
+            conn.close()
+
+
+def lookup(catalog, user_id):
+    """(shard, moving) for a user; families without a row are in main."""
+    row = catalog.execute('SELECT shard, moving FROM shard_map WHERE user_id=?', (user_id,)).fetchone()
+    if not row:
+        return MAIN_SHARD, False
+    return row['shard'], bool(row['moving'])
+
+
+class FamilyHold:
+    """A shared lock on a family's lock file; move_user() waits for release()."""
+
+    def __init__(self, handle):
+        self.handle = handle
+
+    def release(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+def _lock_handle(user_id):
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    return open(os.path.join(LOCK_DIR, f'family-{int(user_id) % LOCK_BUCKETS:04d}.lock'), 'a')
+
+
+def _flock(handle, mode, deadline):
+    """flock `handle`, retrying until `deadline` (time.monotonic()); False if it ran out."""
+    import fcntl
+    while True:
+        try:
+            fcntl.flock(handle, mode | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+
+def connect_for_user(user_id):
+    """(connection to the shard holding `user_id`, FamilyHold), waiting out a move.
+
+    The caller keeps the hold until it is done with the connection (db.py
+    releases it when the app context ends); a move of the family waits for it.
+    """
+    import fcntl
+    handle = _lock_handle(user_id)
+    catalog = _connect_sqlite(DATABASE)
+    try:
+        deadline = time.monotonic() + MOVE_WAIT_SECONDS
+        while True:
+            if not _flock(handle, fcntl.LOCK_SH, deadline):
+                raise ShardError(f'Family of user {user_id} is being moved, try again')
+            # Looked up under the lock, so the shard cannot change until release
+            shard, moving = lookup(catalog, user_id)
+            if not moving:
+                break
+            # Let the move take the lock
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            if time.monotonic() >= deadline:
+                raise ShardError(f'Family of user {user_id} is being moved, try again')
+            time.sleep(0.05)
+    except Exception:
+        handle.close()
+        raise
+    finally:
+        catalog.close()
+    return connect(shard), FamilyHold(handle)
+
+
+def _copy_user_row(catalog, target, user_id):
+    row = catalog.execute('SELECT * FROM users WHERE id=?', (user_id,)).fetchone()
+    if row:
+        columns = row.keys()
+        target.execute(
+            f"INSERT OR REPLACE INTO users ({','.join(columns)}) VALUES ({','.join('?' * len(columns))})",
+            tuple(row))
+
+
+def assign_new_user(catalog, user_id):
+    """Place a freshly registered user in their hash bucket."""
+    shard = bucket_for(user_id)
+    target = connect(shard)
+    try:
+        _copy_user_row(catalog, target, user_id)
+        target.commit()
+    finally:
+        target.close()
+    catalog.execute('''
+        INSERT INTO shard_map (user_id, shard, moving, updated_at) VALUES (?, ?, 0, ?)
+    ''', (user_id, shard, datetime.now().isoformat()))
+    catalog.commit()
+    return shard
+
+
+def share_user_row(catalog, db, user_id):
+    """Copy a user's profile into another family's shard (family members)."""
+    _copy_user_row(catalog, db, user_id)
+
+
+def route_invite(catalog, invite_code, shard):
+    catalog.execute('INSERT OR REPLACE INTO invite_routes (invite_code, shard) VALUES (?, ?)',
+                    (invite_code, shard))
+    catalog.commit()
+
+
+def connect_for_invite(catalog, invite_code):
+    """Connection to the shard holding an invite, or None if unknown."""
+    row = catalog.execute('SELECT shard FROM invite_routes WHERE invite_code=?',
+                          (invite_code,)).fetchone()
+    return connect(row['shard']) if row else None
+
+
+def _family_rows(conn, user_id):
+    """{table: [rows]} of everything that belongs to a user's family."""
+    rows = {'users': conn.execute('SELECT * FROM users WHERE id=?', (user_id,)).fetchall(),
+            'children': conn.execute('SELECT * FROM children WHERE user_id=?', (user_id,)).fetchall()}
+    child_ids = [r['id'] for r in rows['children']]
+    marks = ','.join('?' * len(child_ids))
+    for table in CHILD_TABLES:
+        rows[table] = conn.execute(f'SELECT * FROM {table} WHERE child_id IN ({marks})',
+                                   child_ids).fetchall() if child_ids else []
+    capsule_ids = [r['id'] for r in rows['time_capsules']]
+    rows['capsule_media'] = conn.execute(
+        f"SELECT * FROM capsule_media WHERE capsule_id IN ({','.join('?' * len(capsule_ids))})",
+        capsule_ids).fetchall() if capsule_ids else []
+    # Archived capsule media and the packs holding them (a pack can be shared
+    # with other families, so the source keeps its row while others use it)
+    rows['cold_media'] = conn.execute(
+        f"SELECT * FROM cold_media WHERE capsule_id IN ({','.join('?' * len(capsule_ids))})",
+        capsule_ids).fetchall() if capsule_ids else []
+    pack_ids = sorted({r['pack_id'] for r in rows['cold_media']})
+    rows['media_packs'] = conn.execute(
+        f"SELECT * FROM media_packs WHERE id IN ({','.join('?' * len(pack_ids))})",
+        pack_ids).fetchall() if pack_ids else []
+    for table in USER_TABLES:
+        rows[table] = conn.execute(f'SELECT * FROM {table} WHERE user_id=?', (user_id,)).fetchall()
+    return rows
+
+
+def _write_rows(conn, table, rows):
+    if not rows:
+        return
+    columns = rows[0].keys()
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({','.join(columns)}) VALUES ({','.join('?' * len(columns))})",
+        [tuple(r) for r in rows])
+
+
+def _delete_rows(conn, table, rows):
+    if rows:
+        conn.executemany(f'DELETE FROM {table} WHERE id=?', [(r['id'],) for r in rows])
+
+
+def move_user(user_id, target, log=print):
+    """Move one family to `target` while the app keeps serving.
+
+    Returns the number of rows moved. Source rows are deleted last, so an
+    interrupted move leaves the family readable in its old shard and can
+    simply be run again.
+    """
+    import fcntl
+    shard_path(target)  # validates the name
+    catalog = _connect_sqlite(DATABASE)
+    try:
+        source, moving = lookup(catalog, user_id)
+        if source == target:
+            log(f'User {user_id} is already on {target}')
+            return 0
+        now = datetime.now().isoformat()
+        catalog.execute('''
+            INSERT OR REPLACE INTO shard_map (user_id, shard, moving, updated_at) VALUES (?, ?, 1, ?)
+        ''', (user_id, source, now))
+        catalog.commit()
+        # Wait until no request is using the family's old shard any more
+        drain = _lock_handle(user_id)
+        if not _flock(drain, fcntl.LOCK_EX, time.monotonic() + MOVE_DRAIN_SECONDS):
+            drain.close()
+            catalog.execute('UPDATE shard_map SET moving=0 WHERE user_id=?', (user_id,))
+            catalog.commit()
+            raise ShardError(f'Requests of user {user_id} still running after '
+                             f'{MOVE_DRAIN_SECONDS:g}s, try again')
+
+        src = catalog if source == MAIN_SHARD else connect(source)
+        dst = catalog if target == MAIN_SHARD else connect(target)
+        try:
+            started = time.perf_counter()
+            # Writers to the source shard wait (busy timeout) during the copy
+            src.execute('BEGIN IMMEDIATE')
+            rows = _family_rows(src, user_id)
+            if not rows['users']:
+                _copy_user_row(catalog, dst, user_id)
+            # Parents before children so the cascade triggers never fire
+            for table in (('users', 'children') + CHILD_TABLES + ('capsule_media', 'media_packs', 'cold_media')
+                          + USER_TABLES):
+                _write_rows(dst, table, rows[table])
+            _restore_id_range(dst, target)
+            if dst is not catalog:
+                dst.commit()
+
+            codes = [r['invite_code'] for r in rows['family_access'] if r['invite_code']]
+            catalog.executemany('INSERT OR REPLACE INTO invite_routes (invite_code, shard) VALUES (?, ?)',
+                                [(c, target) for c in codes])
+            catalog.execute('UPDATE shard_map SET shard=?, moving=0, updated_at=? WHERE user_id=?',
+                            (target, datetime.now().isoformat(), user_id))
+            catalog.commit()
+
+            # Source cleanup; the catalog keeps its users row
+            for table in ('capsule_media',) + CHILD_TABLES + ('children',) + USER_TABLES:
+                _delete_rows(src, table, rows[table])
+            if source != MAIN_SHARD:
+                _delete_rows(src, 'users', rows['users'])
+            src.executemany('DELETE FROM cold_media WHERE file_url=?',
+                            [(r['file_url'],) for r in rows['cold_media']])
+            # Only the row: the pack file is now referenced from the target
+            src.executemany('DELETE FROM media_packs WHERE id=? AND id NOT IN (SELECT pack_id FROM cold_media)',
+                            [(r['id'],) for r in rows['media_packs']])
+            src.commit()
+        except Exception:
+            src.rollback()
+            catalog.execute('UPDATE shard_map SET moving=0 WHERE user_id=?', (user_id,))
+            catalog.commit()
+            raise
+        finally:
+            for conn in {src, dst} - {catalog}:
+                conn.close()
+            drain.close()
+        moved = sum(len(v) for v in rows.values())
+        log(f'Moved user {user_id} ({moved} rows) from {source} to {target} '
+            f'in {time.perf_counter() - started:.2f}s')
+        return moved
+    finally:
+        catalog.close()
+
+
+def shard_stats():
+    """[(shard, families, children)] for every existing shard."""
+    catalog = _connect_sqlite(DATABASE)
+    try:
+        mapped = {row['shard']: row['n'] for row in catalog.execute(
+            'SELECT shard, COUNT(*) AS n FROM shard_map GROUP BY shard').fetchall()}
+        unmapped = catalog.execute('''
+            SELECT COUNT(*) AS n FROM users
+            WHERE id NOT IN (SELECT user_id FROM shard_map)
+        ''').fetchone()['n']
+    finally:
+        catalog.close()
+    stats = []
+    for name in existing_shards():
+        conn = connect(name)
+        try:
+            children = conn.execute('SELECT COUNT(*) AS n FROM children').fetchone()['n']
+        finally:
+            conn.close()
+        families = mapped.get(name, 0) + (unmapped if name == MAIN_SHARD else 0)
+        stats.append((name, families, children))
+    return stats
+
+
+def rebalance(limit=None, log=print):
+    """Move families from the main database to their hash bucket."""
+    catalog = _connect_sqlite(DATABASE)
+    try:
+        rows = catalog.execute('''
+            SELECT u.id FROM users u LEFT JOIN shard_map m ON m.user_id = u.id
+            WHERE m.user_id IS NULL OR m.shard = ?
+            ORDER BY u.id
+        ''', (MAIN_SHARD,)).fetchall()
+    finally:
+        catalog.close()
+    user_ids = [r['id'] for r in rows][:limit]
+    for user_id in user_ids:
+        move_user(user_id, bucket_for(user_id), log=log)
+    return len(user_ids)
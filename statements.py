@@ -0,0 +1,284 @@
+"""
+SQL statements as executed by the MySQL backend.
+
+The app writes SQLite-style `?` placeholders everywhere. Each distinct SQL
+string is analysed once per process by parse() and the result cached: whether
+it may run on a replica, whether it writes, and its `%s` form for
+mysql-connector's text protocol. The translation tokenizes the statement, so a
+`?` inside a string literal, a quoted identifier or a comment is left alone.
+
+Statements with parameters run as server-side prepared statements. Every
+connection keeps up to MYSQL_STATEMENT_CACHE idle prepared cursors, at most
+CURSORS_PER_STATEMENT per SQL string, evicting (and deallocating on the
+server) the least recently used, so MySQL parses and plans a statement once
+per connection and afterwards only its parameters travel. A cursor stays
+out of the cache for as long as the result it produced is referenced, so two
+live results never share one. With MYSQL_POOL_SIZE the connections, and with
+them the prepared statements, outlive the request; without a pool the cache
+only helps within one request. Statements without parameters (DDL in migrations, fixed
+reports) and the few that MySQL cannot prepare use the text protocol.
+
+STATEMENT_STATS counts, per process, how often a statement was prepared or
+found ready, and the time spent in each kind of execution; stats() turns
+that into hit rates and an estimate of the time the cache saved. Per request,
+the same numbers go into the Server-Timing header (SERVER_TIMING=1).
+"""
+import functools
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# MYSQL_PREPARED=0 sends every statement through the text protocol
+MYSQL_PREPARED = os.environ.get('MYSQL_PREPARED', '1') == '1'
+# Prepared statements kept per connection (the server's limit is
+# max_prepared_stmt_count, 16382 by default, across all connections)
+MYSQL_STATEMENT_CACHE = int(os.environ.get('MYSQL_STATEMENT_CACHE', '64'))
+# Distinct SQL strings remembered per process
+SQL_CACHE_SIZE = 1024
+# Idle prepared cursors kept per SQL string; two cover a loop that holds on
+# to the previous result while executing the next
+CURSORS_PER_STATEMENT = 2
+
+# Statements that may run on a replica; locking reads must see the primary
+READ_RE = re.compile(r'\s*(SELECT|WITH|SHOW)\b', re.IGNORECASE)
+LOCKING_READ_RE = re.compile(r'\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bFOR\s+SHARE\b',
+                             re.IGNORECASE)
+
+# Everything a `?` may hide in, and the placeholder itself
+_TOKEN_RE = re.compile(r"""
+      '(?:[^'\\]|\\.|'')*'
+    | "(?:[^"\\]|\\.|"")*"
+    | `(?:[^`]|``)*`
+    | --(?=\s|$)[^\n]*
+    | \#[^\n]*
+    | /\*.*?\*/
+    | \?
+""", re.VERBOSE | re.DOTALL)
+
+# MySQL error numbers handled below
+ER_UNKNOWN_STMT_HANDLER = 1243
+ER_UNSUPPORTED_PS = 1295
+ER_MAX_PREPARED_STMT_COUNT_REACHED = 1461
+
+STATEMENT_STATS = {'prepared': 0, 'reused': 0, 'text': 0, 'evicted': 0, 'unpreparable': 0,
+                   'prepare_seconds': 0.0, 'reuse_seconds': 0.0}
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+class Statement:
+    """What parse() knows about one SQL string."""
+    __slots__ = ('sql', 'pyformat', 'placeholders', 'replica_ok', 'writes', 'preparable')
+
+    def __init__(self, sql):
+        self.sql = sql
+        placeholders = 0
+
+        def replace(match):
+            nonlocal placeholders
+            if match.group() != '?':
+                return match.group()
+            placeholders += 1
+            return '%s'
+
+        self.pyformat = _TOKEN_RE.sub(replace, sql)
+        self.placeholders = placeholders
+        read = READ_RE.match(sql) is not None
+        self.replica_ok = read and LOCKING_READ_RE.search(sql) is None
+        self.writes = not read
+        self.preparable = MYSQL_PREPARED
+
+
+@functools.lru_cache(maxsize=SQL_CACHE_SIZE)
+def parse(sql):
+    return Statement(sql)
+
+
+def translate(sql):
+    """`sql` with its `?` placeholders as `%s` (mysql-connector's text protocol)."""
+    return parse(sql).pyformat
+
+
+class _PreparedCursors:
+    """Idle prepared cursors of one connection session, least recently used first.
+
+    A cursor is taken out while a caller holds its result (see execute())
+    and put back afterwards, so two live results never share a cursor.
+    """
+    __slots__ = ('connection_id', 'cursors', 'size', 'lock', 'retired')
+
+    def __init__(self, connection_id):
+        self.connection_id = connection_id
+        # sql -> [cursor, ...]; the key is the very string the cursors
+        # prepared, which mysql-connector compares by identity to skip
+        # preparing again
+        self.cursors = OrderedDict()
+        self.size = 0
+        # Put back from whichever thread drops the last reference to a result
+        self.lock = threading.Lock()
+        # Set once the connection reconnected and a new cache replaced this one
+        self.retired = False
+
+    def take(self, sql):
+        with self.lock:
+            idle = self.cursors.get(sql)
+            if not idle:
+                return None
+            self.size -= 1
+            cursor = idle.pop()
+            if not idle:
+                del self.cursors[sql]
+            return cursor
+
+    def put(self, sql, cursor):
+        with self.lock:
+            idle = self.cursors.setdefault(sql, [])
+            self.cursors.move_to_end(sql)
+            if len(idle) >= CURSORS_PER_STATEMENT:
+                _close(cursor)
+                return
+            idle.append(cursor)
+            self.size += 1
+            while self.size > MYSQL_STATEMENT_CACHE:
+                _, evicted = self.cursors.popitem(last=False)
+                self.size -= len(evicted)
+                for stale in evicted:
+                    _close(stale)
+                    STATEMENT_STATS['evicted'] += 1
+
+    def clear(self):
+        with self.lock:
+            for idle in self.cursors.values():
+                for stale in idle:
+                    _close(stale)
+            self.cursors.clear()
+            self.size = 0
+
+
+def _close(cursor):
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
+def _prepared_cursors(conn):
+    # The pool hands out every connection in a new wrapper; the statements
+    # belong to the session of the connection inside it
+    raw = getattr(conn, '_cnx', None) or conn
+    connection_id = raw.connection_id
+    cache = _caches.get(raw)
+    if cache is None or cache.connection_id != connection_id:
+        # New, or reconnected: the old session took its statements with it
+        if cache is not None:
+            cache.retired = True
+        cache = _PreparedCursors(connection_id)
+        with _caches_lock:
+            _caches[raw] = cache
+    return cache
+
+
+def execute(conn, stmt, params, timing=None, wrap=None):
+    """Run `stmt` (from parse()) on a mysql-connector connection.
+
+    Returns wrap(cursor), or the cursor itself without `wrap`. A prepared
+    cursor is only reused once that result is no longer referenced, so
+    execute() never hands out a cursor whose rows someone may still read;
+    without `wrap` there is nothing to watch and the cursor is not cached.
+    """
+    if params and stmt.preparable:
+        result = _execute_prepared(conn, stmt, params, timing, wrap)
+        if result is not None:
+            return result
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(stmt.pyformat, params)
+    else:
+        # No parameters, so nothing is substituted and `%` needs no care
+        cursor.execute(stmt.sql)
+    STATEMENT_STATS['text'] += 1
+    return wrap(cursor) if wrap else cursor
+
+
+def _put_back(cache, sql, cursor):
+    # After a reconnect the statement died with the old session; closing it
+    # would deallocate whatever has its id in the new one
+    if not cache.retired:
+        cache.put(sql, cursor)
+
+
+def _execute_prepared(conn, stmt, params, timing, wrap, retry=True):
+    cache = _prepared_cursors(conn)
+    cursor = cache.take(stmt.sql)
+    reused = cursor is not None
+    if not reused:
+        cursor = conn.cursor(prepared=True)
+    started = time.perf_counter()
+    try:
+        cursor.execute(stmt.sql, params)
+    except Exception as e:
+        _close(cursor)
+        errno = getattr(e, 'errno', None)
+        if errno == ER_UNSUPPORTED_PS:
+            stmt.preparable = False
+            STATEMENT_STATS['unpreparable'] += 1
+            return None
+        if errno == ER_MAX_PREPARED_STMT_COUNT_REACHED:
+            logger.warning('max_prepared_stmt_count reached; lower MYSQL_STATEMENT_CACHE')
+            return None
+        if errno == ER_UNKNOWN_STMT_HANDLER and reused and retry:
+            # The session lost its statements (e.g. a reset); start over
+            cache.clear()
+            return _execute_prepared(conn, stmt, params, timing, wrap, retry=False)
+        raise
+    elapsed = time.perf_counter() - started
+    kind = 'reused' if reused else 'prepared'
+    STATEMENT_STATS[kind] += 1
+    STATEMENT_STATS['reuse_seconds' if reused else 'prepare_seconds'] += elapsed
+    if timing is not None:
+        timing[kind] += 1
+        if not reused:
+            timing['prepare'] += elapsed
+    if wrap is None:
+        # Nothing tells us when the caller is done with it
+        return cursor
+    result = wrap(cursor)
+    weakref.finalize(result, _put_back, cache, stmt.sql, cursor)
+    return result
+
+
+def release(conn):
+    """Make a pooled connection safe to hand to the next request.
+
+    The pool is created without session reset, which would deallocate the
+    prepared statements, so unread rows and an open transaction are cleared
+    here instead.
+    """
+    conn.consume_results()
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def stats():
+    """STATEMENT_STATS plus hit rates and the estimated time saved."""
+    result = dict(STATEMENT_STATS)
+    info = parse.cache_info()
+    result['sql_cache_hit_rate'] = info.hits / max(1, info.hits + info.misses)
+    executed = result['prepared'] + result['reused']
+    result['prepared_hit_rate'] = result['reused'] / executed if executed else 0.0
+    # A first execution also sends the statement and has it parsed and
+    # planned; every reuse saves the difference in average time
+    saved = 0.0
+    if result['prepared'] and result['reused']:
+        per_prepare = result['prepare_seconds'] / result['prepared']
+        per_reuse = result['reuse_seconds'] / result['reused']
+        saved = result['reused'] * max(0.0, per_prepare - per_reuse)
+    result['estimated_saved_seconds'] = saved
+    return result
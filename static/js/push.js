@@ -0,0 +1,65 @@
+/**
+ * BabyGrow Push Notifications
+ * Subscribes this device to reminders (imunisasi, kapsul waktu, surat)
+ */
+
+function urlBase64ToUint8Array(base64String) {
+    const padding = '='.repeat((4 - base64String.length % 4) % 4);
+    const base64 = (base64String + padding).replace(/-/g, '+').replace(/_/g, '/');
+    const raw = window.atob(base64);
+    return Uint8Array.from([...raw].map(char => char.charCodeAt(0)));
+}
+
+/**
+ * Ask for permission and register this device with the server
+ * @returns {Promise<boolean>} true when the device is subscribed
+ */
+async function enablePushNotifications() {
+    if (!('serviceWorker' in navigator) || !('PushManager' in window)) {
+        alert('Browser ini belum mendukung notifikasi push.');
+        return false;
+    }
+
+    const permission = await Notification.requestPermission();
+    if (permission !== 'granted') {
+        return false;
+    }
+
+    const registration = await navigator.serviceWorker.register('/static/js/sw.js');
+    await navigator.serviceWorker.ready;
+
+    const keyResponse = await fetch('/push/vapid-public-key');
+    const { publicKey } = await keyResponse.json();
+
+    let subscription = await registration.pushManager.getSubscription();
+    if (!subscription) {
+        subscription = await registration.pushManager.subscribe({
+            userVisibleOnly: true,
+            applicationServerKey: urlBase64ToUint8Array(publicKey)
+        });
+    }
+
+    const response = await fetch('/push/subscribe', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(subscription)
+    });
+    return response.ok;
+}
+
+/**
+ * Remove this device's subscription
+ */
+async function disablePushNotifications() {
+    const registration = await navigator.serviceWorker.getRegistration('/static/js/sw.js');
+    const subscription = registration && await registration.pushManager.getSubscription();
+    if (!subscription) {
+        return;
+    }
+    await fetch('/push/unsubscribe', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ endpoint: subscription.endpoint })
+    });
+    await subscription.unsubscribe();
+}
@@ -3,14 +3,20 @@
  * Enables offline functionality and caching
  */
 
-const CACHE_NAME = 'babygrow-cache-v1';
+// Fingerprinted asset list written by `flask build-assets`; missing in dev
+try {
+    importScripts('/static/dist/sw-assets.js');
+} catch (e) {
+    self.BABYGROW_ASSETS = ['/static/css/style.css', '/static/js/celebrations.js'];
+}
+
+const CACHE_NAME = 'babygrow-cache-' + (self.BABYGROW_ASSETS_VERSION || 'v1');
 const OFFLINE_URL = '/';
 
 // Assets to cache immediately
 const PRECACHE_ASSETS = [
     '/',
-    '/static/css/style.css',
-    '/static/js/celebrations.js',
+    ...self.BABYGROW_ASSETS,
     '/static/manifest.json',
     'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&family=Quicksand:wght@500;600;700&display=swap',
     'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/bootstrap-icons.css',
@@ -61,6 +67,14 @@ self.addEventListener('fetch', event => {
         return;
     }
     
+    // Fingerprinted assets never change, so the cached copy is always valid
+    if (new URL(event.request.url).pathname.startsWith('/assets/')) {
+        event.respondWith(
+            caches.match(event.request).then(cached => cached || fetch(event.request))
+        );
+        return;
+    }
+
     event.respondWith(
         caches.match(event.request)
             .then(cachedResponse => {
@@ -0,0 +1,244 @@
+"""
+Disk space used by each family, and the upload quota.
+
+Every capsule_media row records the size of its files (size_bytes: the file
+plus its thumbnail), and database triggers (migration 10) keep a running
+total per child in storage_usage on every insert, update and delete, whatever
+code path does it: uploads, the audio transcoder, purges, shard moves. A
+family's usage is the sum over its children, so checking a quota or listing
+the largest families never walks static/uploads.
+
+Media moved to cold storage keep counting: the quota is about what a family
+has stored, not which disk it is on.
+
+The `storage-reconcile` job re-measures the files in batches of
+STORAGE_SCAN_BATCH rows with STORAGE_SCAN_PAUSE seconds in between, fixes
+sizes that differ or were never recorded (media uploaded before the
+counters existed), and recomputes any child total that drifted, e.g. after a
+MySQL foreign-key cascade, which does not fire triggers.
+"""
+import heapq
+import logging
+import os
+import shutil
+import time
+
+from db import each_database, get_catalog_db, get_db
+from media_store import UPLOADS_DIR, get_store, url_to_key
+from worker import job
+
+logger = logging.getLogger(__name__)
+
+# Per family (all children of one account); 0 disables the quota
+STORAGE_QUOTA_MB = int(os.environ.get('STORAGE_QUOTA_MB', '100'))
+STORAGE_SCAN_BATCH = int(os.environ.get('STORAGE_SCAN_BATCH', '200'))
+STORAGE_SCAN_PAUSE = float(os.environ.get('STORAGE_SCAN_PAUSE', '0.2'))
+
+MB = 1024 * 1024
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, used, incoming):
+        self.used = used
+        self.incoming = incoming
+        super().__init__(f'Ruang penyimpanan keluarga tidak cukup: terpakai {format_size(used)} '
+                         f'dari {STORAGE_QUOTA_MB} MB, file ini {format_size(incoming)}.')
+
+
+def format_size(size):
+    if size >= 1024 * MB:
+        return f'{size / 1024 / MB:.1f} GB'
+    if size >= MB:
+        return f'{size / MB:.1f} MB'
+    return f'{size / 1024:.0f} KB'
+
+
+def upload_size(file):
+    """Size of an uploaded file (werkzeug FileStorage) without reading it."""
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def measure(db, urls):
+    """(bytes, missing urls) of upload files, in the media store or a cold-storage pack."""
+    store = get_store()
+    total, missing = 0, []
+    for url in urls:
+        key = url_to_key(url)
+        if key is None:
+            continue
+        size = store.size(key)
+        if size is not None:
+            total += size
+            continue
+        row = db.execute('SELECT size FROM cold_media WHERE file_url=?', (url,)).fetchone()
+        if row:
+            total += row['size']
+        else:
+            missing.append(url)
+    return total, missing
+
+
+def usage(db, user_id):
+    """Bytes and files of a family."""
+    return db.execute('''
+        SELECT COALESCE(SUM(bytes), 0) AS bytes, COALESCE(SUM(files), 0) AS files
+        FROM storage_usage WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+
+
+def check_quota(db, user_id, incoming):
+    """Raise QuotaExceeded if `incoming` more bytes would exceed STORAGE_QUOTA_MB.
+
+    Concurrent uploads of one family can each pass the check, so the quota
+    may be exceeded by about one file.
+    """
+    if not STORAGE_QUOTA_MB:
+        return
+    used = usage(db, user_id)['bytes']
+    if used + incoming > STORAGE_QUOTA_MB * MB:
+        raise QuotaExceeded(used, incoming)
+
+
+def top_families(limit=20):
+    """Largest families across every database: (user_id, username, bytes, files, children)."""
+    rows = []
+    for db in each_database():
+        # A family lives in one database, so each one's top `limit` suffices
+        rows.extend(db.execute('''
+            SELECT user_id, SUM(bytes) AS bytes, SUM(files) AS files, COUNT(*) AS children
+            FROM storage_usage GROUP BY user_id ORDER BY bytes DESC LIMIT ?
+        ''', (limit,)).fetchall())
+    top = heapq.nlargest(limit, rows, key=lambda r: r['bytes'])
+    catalog = get_catalog_db()
+    names = {}
+    if top:
+        marks = ','.join('?' * len(top))
+        names = {r['id']: r['username'] for r in catalog.execute(
+            f'SELECT id, username FROM users WHERE id IN ({marks})', [r['user_id'] for r in top])}
+    return [(r['user_id'], names.get(r['user_id'], '?'), r['bytes'], r['files'], r['children'])
+            for r in top]
+
+
+def top_children(limit=20):
+    """Children with the most media: (child_id, name, user_id, bytes, files)."""
+    rows = []
+    for db in each_database():
+        rows.extend(db.execute('''
+            SELECT su.child_id, c.name, su.user_id, su.bytes, su.files
+            FROM storage_usage su JOIN children c ON c.id = su.child_id
+            ORDER BY su.bytes DESC LIMIT ?
+        ''', (limit,)).fetchall())
+    return [tuple(r) for r in heapq.nlargest(limit, rows, key=lambda r: r['bytes'])]
+
+
+def totals():
+    """Counted bytes and files over every database, plus the upload disk's usage.
+
+    The disk figures are None when media are kept in an S3 bucket.
+    """
+    counted = files = 0
+    for db in each_database():
+        row = db.execute('SELECT COALESCE(SUM(bytes), 0) AS bytes, '
+                         'COALESCE(SUM(files), 0) AS files FROM storage_usage').fetchone()
+        counted += row['bytes']
+        files += row['files']
+    if get_store().name != 'local':
+        return {'bytes': counted, 'files': files, 'disk_used': None, 'disk_total': None}
+    disk = shutil.disk_usage(UPLOADS_DIR if os.path.isdir(UPLOADS_DIR) else os.path.dirname(UPLOADS_DIR))
+    return {'bytes': counted, 'files': files, 'disk_used': disk.used, 'disk_total': disk.total}
+
+
+def _remeasure(db, batch_size, pause, report):
+    last_id = 0
+    while True:
+        rows = db.execute('''
+            SELECT id, file_url, thumbnail_url, size_bytes FROM capsule_media
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        changes = []
+        for row in rows:
+            size, missing = measure(db, (row['file_url'], row['thumbnail_url']))
+            report['files'] += 1
+            if missing:
+                report['missing'] += 1
+                # A file that vanished is the purge janitor's business; keep
+                # the recorded size unless there never was one
+                if row['size_bytes'] is not None:
+                    continue
+            if size != row['size_bytes']:
+                changes.append((size, row['id'], row['file_url']))
+        if changes:
+            # Skip rows whose file was replaced meanwhile (audio transcoding)
+            db.executemany('UPDATE capsule_media SET size_bytes=? WHERE id=? AND file_url=?', changes)
+            report['resized'] += len(changes)
+        db.commit()
+        last_id = rows[-1]['id']
+        if pause:
+            time.sleep(pause)
+
+
+_CHILD_BYTES = '''(SELECT COALESCE(SUM(cm.size_bytes), 0) FROM capsule_media cm
+                   JOIN time_capsules tc ON tc.id = cm.capsule_id WHERE tc.child_id = ?)'''
+_CHILD_FILES = '''(SELECT COUNT(*) FROM capsule_media cm
+                   JOIN time_capsules tc ON tc.id = cm.capsule_id WHERE tc.child_id = ?)'''
+
+
+def _recount(db, report):
+    drifted = db.execute('''
+        SELECT c.id AS child_id, c.user_id,
+               COALESCE(SUM(cm.size_bytes), 0) AS bytes, COUNT(cm.id) AS files,
+               su.bytes AS counted_bytes, su.files AS counted_files
+        FROM children c
+        LEFT JOIN time_capsules tc ON tc.child_id = c.id
+        LEFT JOIN capsule_media cm ON cm.capsule_id = tc.id
+        LEFT JOIN storage_usage su ON su.child_id = c.id
+        GROUP BY c.id, c.user_id, su.bytes, su.files
+        HAVING COALESCE(su.bytes, 0) <> COALESCE(SUM(cm.size_bytes), 0)
+            OR COALESCE(su.files, 0) <> COUNT(cm.id)
+    ''').fetchall()
+    for row in drifted:
+        logger.warning('Storage counter of child %s drifted: %s bytes/%s files counted, %s/%s actual',
+                       row['child_id'], row['counted_bytes'], row['counted_files'],
+                       row['bytes'], row['files'])
+        # Recomputed inside the statement, so an upload in between is not lost
+        cur = db.execute(f'UPDATE storage_usage SET bytes = {_CHILD_BYTES}, files = {_CHILD_FILES} '
+                         f'WHERE child_id = ?', (row['child_id'],) * 3)
+        if not cur.rowcount:
+            db.execute(f'INSERT INTO storage_usage (child_id, user_id, bytes, files) '
+                       f'VALUES (?, ?, {_CHILD_BYTES}, {_CHILD_FILES})',
+                       (row['child_id'], row['user_id'], row['child_id'], row['child_id']))
+        db.commit()
+    report['children_fixed'] = len(drifted)
+    cur = db.execute('DELETE FROM storage_usage WHERE child_id NOT IN (SELECT id FROM children)')
+    report['stale_rows'] = max(cur.rowcount, 0)
+    db.commit()
+
+
+def reconcile(db, batch_size=None, pause=None):
+    """Re-measure media files and repair the counters of one database.
+
+    Returns {'files', 'resized', 'missing', 'children_fixed', 'stale_rows'}.
+    """
+    report = {'files': 0, 'resized': 0, 'missing': 0}
+    try:
+        _remeasure(db, batch_size or STORAGE_SCAN_BATCH,
+                   STORAGE_SCAN_PAUSE if pause is None else pause, report)
+        _recount(db, report)
+    except Exception:
+        db.rollback()
+        raise
+    return report
+
+
+@job('storage-reconcile', every=86400)
+def reconcile_job():
+    report = reconcile(get_db())
+    if report['resized'] or report['children_fixed'] or report['stale_rows'] or report['missing']:
+        logger.info('Storage reconciliation: %s', report)
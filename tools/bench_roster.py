@@ -0,0 +1,168 @@
+"""
+Check the posyandu roster at scale: query count, ordering and latency.
+
+Builds a temporary database with one posyandu group of --children children
+(spread over families of one to three, each with a monthly growth history,
+the national immunization schedule with some doses left overdue, and a few
+milestones), then for every sort order walks the whole roster page by page
+through roster.page() and checks that
+
+- every page issues the same number of statements, whatever the group and
+  page size (no per-child queries),
+- each child appears exactly once and in sort order across pages,
+
+and reports page latency percentiles. Finally the roster page itself is
+requested through the app as the coordinator.
+
+Usage:
+    python tools/bench_roster.py --children 10000 --page-size 50
+"""
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'password123'
+MILESTONES = ['Tengkurap', 'Duduk sendiri', 'Merangkak', 'Berdiri', 'Berjalan', 'Bicara 2 kata']
+
+
+def generate_database(db_dir, children, seed=1):
+    """balita.db with one group of `children`; returns the group id."""
+    from immunization_schedule import schedule_for
+    from migrations import migrate
+
+    rng = random.Random(seed)
+    os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(db_dir, 'balita.db'))
+    conn.row_factory = sqlite3.Row
+    migrate(conn, 'sqlite', log=lambda *a: None)
+    pw_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    coordinator = conn.execute('INSERT INTO users (username, password, full_name) VALUES (?, ?, ?)',
+                               ('kader', pw_hash, 'Kader Posyandu')).lastrowid
+    group_id = conn.execute('INSERT INTO posyandu_groups (name, coordinator_id, join_code) VALUES (?, ?, ?)',
+                            ('Posyandu Uji', coordinator, 'BENCH1')).lastrowid
+    today = date.today()
+    made = family = 0
+    while made < children:
+        user_id = conn.execute('INSERT INTO users (username, password) VALUES (?, ?)',
+                               (f'parent{family:05d}', pw_hash)).lastrowid
+        family += 1
+        for _ in range(min(rng.choice((1, 1, 2, 3)), children - made)):
+            dob = today - timedelta(days=rng.randint(0, 5 * 365))
+            # Some children have no date of birth, some were never weighed
+            known_dob = rng.random() > 0.02
+            child_id = conn.execute('''
+                INSERT INTO children (user_id, name, dob, gender, posyandu_id) VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, f'Anak {rng.randint(0, 99999):05d}', dob.isoformat() if known_dob else None,
+                  rng.choice(('Laki-laki', 'Perempuan')), group_id)).lastrowid
+            made += 1
+            months = (today - dob).days // 30
+            if rng.random() > 0.05:
+                last = months - rng.choice((0, 0, 1, 2, 6))
+                conn.executemany('INSERT INTO growth (child_id, record_date, weight, height) VALUES (?, ?, ?, ?)',
+                                 [(child_id, (dob + timedelta(days=30 * m)).isoformat(),
+                                   round(3.2 + 0.45 * min(m, 24) + 0.2 * max(m - 24, 0) + rng.gauss(0, 0.8), 1),
+                                   round(50 + 2 * min(m, 24) + 0.7 * max(m - 24, 0) + rng.gauss(0, 2), 1))
+                                  for m in range(max(0, last - 24), last + 1)])
+            if known_dob:
+                conn.executemany('''
+                    INSERT INTO immunization (child_id, vaccine, scheduled_date, status) VALUES (?, ?, ?, ?)
+                ''', [(child_id, vaccine, scheduled,
+                       'done' if scheduled < today.isoformat() and rng.random() > 0.03 else 'pending')
+                      for vaccine, scheduled in schedule_for(dob.isoformat())])
+            conn.executemany('INSERT INTO development (child_id, milestone, status) VALUES (?, ?, ?)',
+                             [(child_id, m, rng.choice(('done', 'pending'))) for m in MILESTONES])
+        if family % 500 == 0:
+            conn.commit()
+    conn.commit()
+    conn.close()
+    return group_id
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--children', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--db-dir', help='Keep the generated database here (default: a temp dir).')
+    args = parser.parse_args()
+
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix='babygrow-roster-')
+    os.environ['DATABASE_DIR'] = db_dir
+    os.environ.setdefault('DB_TYPE', 'sqlite')
+    started = time.perf_counter()
+    group_id = generate_database(db_dir, args.children)
+    print(f'Generated {args.children} children in {time.perf_counter() - started:.1f}s ({db_dir})')
+
+    from flask import g
+    import app as babygrow
+    import roster
+
+    failures = 0
+    statements = []
+    with babygrow.app.app_context():
+        g._query_trace = lambda sql: statements.append(sql)
+        for sort, (column, descending, label) in roster.SORTS.items():
+            seen, keys, latencies, per_page = set(), [], [], set()
+            cursor = None
+            while True:
+                statements.clear()
+                t = time.perf_counter()
+                entries, cursor, summary = roster.page(group_id, sort, cursor, args.page_size)
+                latencies.append(time.perf_counter() - t)
+                per_page.add(len(statements))
+                for e in entries:
+                    if e['id'] in seen:
+                        failures += 1
+                    seen.add(e['id'])
+                keys.extend(entries)
+                if not cursor:
+                    break
+            # Order check against a full sort of what came back
+            rows = babygrow.get_db().execute(f'SELECT id, {column} FROM children WHERE posyandu_id=?',
+                                             (group_id,)).fetchall()
+            expected = [r['id'] for r in sorted(rows, key=roster._sort_key(column, descending),
+                                                reverse=descending)]
+            in_order = [e['id'] for e in keys] == expected
+            complete = len(seen) == summary['children'] == args.children
+            failures += (not in_order) + (not complete) + (len(per_page) != 1)
+            print(f'{sort:<9} {len(latencies):>4} pages  statements/page {sorted(per_page)}  '
+                  f'p50 {statistics.median(latencies) * 1000:6.1f} ms  '
+                  f'p95 {percentile(latencies, 0.95) * 1000:6.1f} ms  '
+                  f'max {max(latencies) * 1000:6.1f} ms  '
+                  f'{"ok" if in_order and complete else "WRONG ORDER/COUNT"}')
+        print(f"Summary: {summary['children']} children, {summary['stale']} not weighed for "
+              f"{roster.ROSTER_STALE_DAYS} days, {summary['overdue']} with overdue vaccines")
+
+    client = babygrow.app.test_client()
+    client.post('/login', data={'username': 'kader', 'password': PASSWORD})
+    for sort in roster.SORTS:
+        t = time.perf_counter()
+        response = client.get(f'/posyandu/{group_id}?sort={sort}')
+        elapsed = time.perf_counter() - t
+        failures += response.status_code != 200
+        print(f'GET /posyandu/{group_id}?sort={sort:<9} {response.status_code}  {elapsed * 1000:6.1f} ms  '
+              f'{len(response.data) // 1024} KB')
+
+    if failures:
+        print(f'{failures} checks FAILED')
+        sys.exit(1)
+    print('All checks passed')
+
+
+if __name__ == '__main__':
+    main()
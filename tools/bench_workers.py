@@ -0,0 +1,152 @@
+"""
+Benchmark BabyGrow under the gunicorn serving profiles in gunicorn.conf.py.
+
+For each profile a fresh gunicorn is started against a seeded temporary
+database, the demo user logs in once, and N concurrent clients hammer the
+same read routes for a fixed duration. Prints throughput, latency
+percentiles and error counts per profile.
+
+Usage:
+    python tools/bench_workers.py --profiles sync,gthread --clients 500 --duration 30
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROUTES = '/dashboard,/children,/capsule,/children/1/growth'
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def login(port):
+    """Log in as the seeded demo user and return the session cookie."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    body = urllib.parse.urlencode({'username': 'ibu_sarah', 'password': 'password123'})
+    conn.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader('Set-Cookie', '')
+    conn.close()
+    if resp.status != 302 or not cookie:
+        raise RuntimeError('Login failed; was the database seeded?')
+    return cookie.split(';', 1)[0]
+
+
+def client_loop(port, cookie, routes, stop_at, latencies, errors, lock):
+    i = 0
+    local_latencies = []
+    local_errors = 0
+    while time.monotonic() < stop_at:
+        path = routes[i % len(routes)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            conn.request('GET', path, headers={'Cookie': cookie})
+            resp = conn.getresponse()
+            resp.read()
+            conn.close()
+            if resp.status >= 400:
+                local_errors += 1
+                continue
+        except OSError:
+            local_errors += 1
+            continue
+        local_latencies.append(time.perf_counter() - started)
+    with lock:
+        latencies.extend(local_latencies)
+        errors[0] += local_errors
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_profile(profile, args, db_dir):
+    env = dict(os.environ,
+               GUNICORN_PROFILE=profile,
+               DATABASE_DIR=db_dir,
+               PORT=str(args.port),
+               WEB_CONCURRENCY=str(args.workers))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+        cookie = login(args.port)
+        routes = args.routes.split(',')
+        latencies, errors, lock = [], [0], threading.Lock()
+        stop_at = time.monotonic() + args.duration
+        threads = [threading.Thread(target=client_loop,
+                                    args=(args.port, cookie, routes, stop_at, latencies, errors, lock))
+                   for _ in range(args.clients)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'profile': profile,
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'mean': (statistics.mean(latencies) * 1000) if latencies else 0.0,
+        'errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default='sync,gthread,gevent')
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--duration', type=int, default=30, help='seconds per profile')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--routes', default=DEFAULT_ROUTES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        subprocess.run([sys.executable, 'seed.py'], cwd=ROOT, check=True,
+                       env=dict(os.environ, DATABASE_DIR=db_dir), stdout=subprocess.DEVNULL)
+        results = [run_profile(p, args, db_dir) for p in args.profiles.split(',')]
+
+    print(f"\n{args.clients} clients, {args.duration}s per profile, {args.workers} workers")
+    print(f"{'profile':<10}{'requests':>10}{'req/s':>10}{'mean ms':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for r in results:
+        print(f"{r['profile']:<10}{r['requests']:>10}{r['rps']:>10.1f}{r['mean']:>10.1f}"
+              f"{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
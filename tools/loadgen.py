@@ -0,0 +1,344 @@
+"""
+Scenario-driven load generator for capacity planning.
+
+Unlike tools/bench_workers.py, which hammers a few read routes with one
+user, this replays whole parent sessions against a local gunicorn running
+on a generated database of --families families (each with children, a
+growth history, the national immunization schedule and an open capsule).
+
+Sessions arrive as a Poisson process at --rate per second for --duration
+seconds, e.g. the rush after a posyandu day. Each session logs in as a
+random family, follows one of the JOURNEYS (picked by weight) and waits an
+exponentially distributed think time (mean --think seconds) between steps.
+At most --max-sessions run at once; arrivals beyond that are counted as
+rejected, which is the point where the server can no longer keep up.
+
+The server runs with SERVER_TIMING=1, so every response reports its time in
+the database and, separately, in writes and commits, where SQLite requests
+queue for the write lock. Per journey step the report shows requests,
+throughput, error rate, latency percentiles and those DB times.
+
+Files uploaded by the run are removed from static/uploads afterwards
+unless --keep-uploads is given.
+
+Usage:
+    python tools/loadgen.py --families 2000 --rate 20 --duration 60 --profile gthread
+"""
+import argparse
+import base64
+import hashlib
+import http.client
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from immunization_schedule import schedule_for  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+PASSWORD = 'password123'
+UPLOAD_DIRS = [os.path.join(ROOT, 'static', 'uploads', name) for name in ('capsules', 'audio')]
+
+# name: (weight, steps); every journey starts with a login
+JOURNEYS = {
+    'posyandu': (6, ['dashboard', 'growth', 'add_growth', 'immunization', 'toggle_immunization']),
+    'capsule': (2, ['dashboard', 'capsules', 'capsule', 'upload_photo', 'record_audio']),
+    'calendar': (1, ['dashboard', 'immunization', 'export_ics']),
+    'browse': (3, ['dashboard', 'children', 'growth', 'insights']),
+}
+
+_SERVER_TIMING_RE = re.compile(r'([\w-]+);dur=([\d.]+)')
+
+
+def generate_database(db_dir, families, seed=1):
+    """Create balita.db with `families` parents; returns [(username, child_ids, vacc_ids, capsule_id)]."""
+    rng = random.Random(seed)
+    os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(db_dir, 'balita.db'))
+    conn.row_factory = sqlite3.Row
+    migrate(conn, 'sqlite', log=lambda *a: None)
+    pw_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    today = date.today()
+    result = []
+    for i in range(families):
+        username = f'parent{i:05d}'
+        user_id = conn.execute('INSERT INTO users (username, email, password, full_name) VALUES (?, ?, ?, ?)',
+                               (username, f'{username}@example.test', pw_hash, f'Orang Tua {i}')).lastrowid
+        child_ids, vacc_ids = [], []
+        for c in range(rng.choice((1, 1, 2, 3))):
+            dob = today - timedelta(days=rng.randint(30, 5 * 365))
+            child_id = conn.execute('INSERT INTO children (user_id, name, dob, gender) VALUES (?, ?, ?, ?)',
+                                    (user_id, f'Anak {i}-{c}', dob.isoformat(), rng.choice('LP'))).lastrowid
+            child_ids.append(child_id)
+            months = min(24, (today - dob).days // 30)
+            conn.executemany('INSERT INTO growth (child_id, record_date, weight, height) VALUES (?, ?, ?, ?)',
+                             [(child_id, (dob + timedelta(days=30 * m)).isoformat(),
+                               round(3.2 + 0.45 * m + rng.random(), 1), round(50 + 2 * m + rng.random() * 2, 1))
+                              for m in range(months + 1)])
+            for vaccine, scheduled in schedule_for(dob.isoformat()):
+                status = 'done' if scheduled < today.isoformat() else 'pending'
+                vacc_ids.append(conn.execute(
+                    'INSERT INTO immunization (child_id, vaccine, scheduled_date, status) VALUES (?, ?, ?, ?)',
+                    (child_id, vaccine, scheduled, status)).lastrowid)
+        capsule_id = conn.execute('''
+            INSERT INTO time_capsules (child_id, title, letter_content, unlock_date)
+            VALUES (?, ?, ?, ?)
+        ''', (child_ids[0], 'Untuk ulang tahunmu', 'Sayang, ...',
+              (today + timedelta(days=365 * 17)).isoformat())).lastrowid
+        result.append((username, child_ids, vacc_ids, capsule_id))
+        if i % 500 == 0:
+            conn.commit()
+    conn.commit()
+    conn.close()
+    return result
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = defaultdict(lambda: {'latency': [], 'db': [], 'write': [], 'errors': 0})
+        self.sessions = {'started': 0, 'completed': 0, 'rejected': 0, 'failed': 0}
+
+    def record(self, step, latency, timing, error):
+        with self.lock:
+            s = self.steps[step]
+            if error:
+                s['errors'] += 1
+                return
+            s['latency'].append(latency)
+            if 'db' in timing:
+                s['db'].append(timing['db'])
+                s['write'].append(timing.get('db-write', 0.0))
+
+    def session(self, outcome):
+        with self.lock:
+            self.sessions[outcome] += 1
+
+
+class Session:
+    """One parent's visit: a cookie jar of one and the ids it may touch."""
+
+    def __init__(self, port, family, stats, journey):
+        self.port = port
+        self.username, self.child_ids, self.vacc_ids, self.capsule_id = family
+        self.stats = stats
+        self.journey = journey
+        self.cookie = ''
+
+    def request(self, step, method, path, body=None, content_type=None, expect=(200,)):
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        started = time.perf_counter()
+        error = True
+        timing = {}
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            resp.read()
+            conn.close()
+            cookie = resp.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            # A redirect to the login page means the session was lost
+            location = resp.getheader('Location', '')
+            error = resp.status not in expect or '/login' in location
+            for name, dur in _SERVER_TIMING_RE.findall(resp.getheader('Server-Timing', '')):
+                timing[name] = float(dur)
+        except OSError:
+            pass
+        self.stats.record(f'{self.journey}/{step}', (time.perf_counter() - started) * 1000, timing, error)
+        return not error
+
+    def form(self, step, path, fields, expect=(302,)):
+        return self.request(step, 'POST', path, urllib.parse.urlencode(fields),
+                            'application/x-www-form-urlencoded', expect)
+
+    def login(self):
+        return self.form('login', '/login', {'username': self.username, 'password': PASSWORD})
+
+    def run_step(self, step):
+        child = random.choice(self.child_ids)
+        if step == 'dashboard':
+            return self.request(step, 'GET', '/dashboard')
+        if step == 'children':
+            return self.request(step, 'GET', '/children')
+        if step == 'growth':
+            return self.request(step, 'GET', f'/children/{child}/growth')
+        if step == 'insights':
+            return self.request(step, 'GET', f'/child/{child}/insights')
+        if step == 'add_growth':
+            return self.form(step, f'/children/{child}/growth/add', {
+                'record_date': date.today().isoformat(),
+                'weight': f'{random.uniform(4, 18):.1f}', 'height': f'{random.uniform(55, 110):.1f}'})
+        if step == 'immunization':
+            return self.request(step, 'GET', f'/children/{child}/immunization')
+        if step == 'toggle_immunization':
+            # vacc_ids start with the first child's schedule
+            return self.form(step, f'/children/{self.child_ids[0]}/immunization/{self.vacc_ids[0]}/toggle', {})
+        if step == 'export_ics':
+            return self.request(step, 'GET', f'/immunization/{child}/export.ics')
+        if step == 'capsules':
+            return self.request(step, 'GET', '/capsule')
+        if step == 'capsule':
+            return self.request(step, 'GET', f'/capsule/{self.capsule_id}')
+        if step == 'upload_photo':
+            boundary = f'----loadgen{random.getrandbits(64):016x}'
+            photo = b'\xff\xd8\xff\xe0' + os.urandom(random.randint(50_000, 200_000)) + b'\xff\xd9'
+            body = (f'--{boundary}\r\nContent-Disposition: form-data; name="caption"\r\n\r\nloadgen\r\n'
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="photo"; filename="foto.jpg"\r\n'
+                    f'Content-Type: image/jpeg\r\n\r\n').encode() + photo + f'\r\n--{boundary}--\r\n'.encode()
+            return self.request(step, 'POST', f'/capsule/{self.capsule_id}/upload', body,
+                                f'multipart/form-data; boundary={boundary}', expect=(302,))
+        if step == 'record_audio':
+            audio = base64.b64encode(os.urandom(random.randint(30_000, 120_000))).decode()
+            return self.form(step, f'/capsule/{self.capsule_id}/audio', {
+                'audio_data': f'data:audio/webm;base64,{audio}', 'audio_title': 'loadgen'})
+        raise ValueError(step)
+
+    def run(self, think):
+        steps = JOURNEYS[self.journey][1]
+        if not self.login():
+            return False
+        for step in steps:
+            time.sleep(random.expovariate(1 / think) if think else 0)
+            self.run_step(step)
+        return True
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def drive(args, port, families, stats):
+    """Start sessions at the arrival rate until --duration is over; wait for them."""
+    names = list(JOURNEYS)
+    weights = [JOURNEYS[n][0] for n in names]
+    slots = threading.BoundedSemaphore(args.max_sessions)
+    threads = []
+
+    def run_session(session):
+        try:
+            stats.session('completed' if session.run(args.think) else 'failed')
+        finally:
+            slots.release()
+
+    stop_at = time.monotonic() + args.duration
+    next_arrival = time.monotonic()
+    while next_arrival < stop_at:
+        time.sleep(max(0.0, next_arrival - time.monotonic()))
+        next_arrival += random.expovariate(args.rate)
+        if not slots.acquire(blocking=False):
+            stats.session('rejected')
+            continue
+        stats.session('started')
+        session = Session(port, random.choice(families), stats,
+                          random.choices(names, weights)[0])
+        t = threading.Thread(target=run_session, args=(session,), daemon=True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+
+
+def report(args, stats, elapsed):
+    s = stats.sessions
+    print(f"\n{args.families} families, {args.rate}/s arrivals for {args.duration}s, think {args.think}s, "
+          f"{args.profile} x{args.workers}")
+    print(f"sessions: {s['started']} started, {s['completed']} completed, {s['failed']} failed login, "
+          f"{s['rejected']} rejected (over --max-sessions {args.max_sessions}); {elapsed:.0f}s wall\n")
+    print(f"{'step':<32}{'reqs':>7}{'req/s':>8}{'err%':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'db p50':>8}{'db p95':>8}{'wr p95':>8}{'wr max':>8}")
+    total = errors = 0
+    for step in sorted(stats.steps):
+        st = stats.steps[step]
+        n = len(st['latency']) + st['errors']
+        total += n
+        errors += st['errors']
+        print(f"{step:<32}{n:>7}{n / elapsed:>8.1f}{100 * st['errors'] / n:>7.1f}"
+              f"{percentile(st['latency'], 50):>9.1f}{percentile(st['latency'], 95):>9.1f}"
+              f"{percentile(st['latency'], 99):>9.1f}{percentile(st['db'], 50):>8.1f}"
+              f"{percentile(st['db'], 95):>8.1f}{percentile(st['write'], 95):>8.1f}"
+              f"{max(st['write'], default=0):>8.1f}")
+    print(f"\n{total} requests, {total / elapsed:.1f} req/s, {100 * errors / max(total, 1):.2f}% errors")
+    if not any(stats.steps[step]['db'] for step in stats.steps):
+        print('(no Server-Timing headers: DB columns are empty)')
+
+
+def _upload_files():
+    found = set()
+    for folder in UPLOAD_DIRS:
+        if os.path.isdir(folder):
+            found.update(os.path.join(folder, name) for name in os.listdir(folder))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--families', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=5, help='new sessions per second')
+    parser.add_argument('--duration', type=int, default=60, help='seconds of arrivals')
+    parser.add_argument('--think', type=float, default=2.0, help='mean seconds between steps')
+    parser.add_argument('--max-sessions', type=int, default=500)
+    parser.add_argument('--profile', default='gthread', help='GUNICORN_PROFILE')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--db-dir', default=None, help='keep the generated database here')
+    parser.add_argument('--keep-uploads', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = args.db_dir or tmp
+        started = time.monotonic()
+        families = generate_database(db_dir, args.families)
+        print(f'Generated {len(families)} families in {time.monotonic() - started:.1f}s ({db_dir})')
+        env = dict(os.environ, GUNICORN_PROFILE=args.profile, DATABASE_DIR=db_dir, PORT=str(args.port),
+                   WEB_CONCURRENCY=str(args.workers), SERVER_TIMING='1', BACKGROUND_WORKER='0')
+        before = _upload_files()
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        stats = Stats()
+        try:
+            wait_for_port(args.port)
+            started = time.monotonic()
+            drive(args, args.port, families, stats)
+            elapsed = time.monotonic() - started
+        finally:
+            server.terminate()
+            server.wait()
+            if not args.keep_uploads:
+                for path in _upload_files() - before:
+                    os.remove(path)
+    report(args, stats, elapsed)
+
+
+if __name__ == '__main__':
+    main()
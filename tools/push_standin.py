@@ -0,0 +1,67 @@
+"""
+Local stand-in for a Web Push service, for testing notification delivery.
+
+Accepts POST /push/<name> and prints the JSON payload. The name controls the
+response so every delivery path can be exercised:
+    gone-*   -> 410 Gone (subscription is pruned)
+    flaky-*  -> 503 on odd requests, 201 on even ones (retry/backoff)
+    slow-*   -> waits 2s before answering 201 (concurrency limit)
+    anything else -> 201 Created
+
+Usage:
+    python tools/push_standin.py --port 9099
+    PUSH_SENDER=plain flask --app app push-deliver
+and subscribe with endpoints like http://127.0.0.1:9099/push/phone-1.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_counts = {}
+_lock = threading.Lock()
+
+
+class PushHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        name = self.path.rsplit('/', 1)[-1]
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        with _lock:
+            _counts[name] = _counts.get(name, 0) + 1
+            count = _counts[name]
+
+        if name.startswith('gone-'):
+            status = 410
+        elif name.startswith('flaky-'):
+            status = 503 if count % 2 else 201
+        else:
+            if name.startswith('slow-'):
+                time.sleep(2)
+            status = 201
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = body[:80]
+        print(f'{status} {name} #{count}: {payload}', flush=True)
+        self.send_response(status)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9099)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), PushHandler)
+    print(f'Push stand-in listening on http://127.0.0.1:{args.port}/push/<name>')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Check MySQL read/write splitting against a primary and one or more replicas.
+
+Each step runs in its own fake request and asks the server that answered
+for its port, so routing is visible even with two independent local
+instances instead of real replication:
+
+    docker run -d -p 3306:3306 -e MYSQL_ALLOW_EMPTY_PASSWORD=1 -e MYSQL_DATABASE=balita_db mysql:8
+    docker run -d -p 3307:3306 -e MYSQL_ALLOW_EMPTY_PASSWORD=1 -e MYSQL_DATABASE=balita_db mysql:8
+    DB_TYPE=mysql MYSQL_REPLICAS=127.0.0.1:3307 MYSQL_REPLICA_LAG_CHECK=off \\
+        python tools/rw_split_check.py
+
+Against a real replica leave MYSQL_REPLICA_LAG_CHECK at its default so the
+lag of every replica is reported and checked too.
+
+Usage:
+    python tools/rw_split_check.py [--reads 20]
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db as dbmod  # noqa: E402
+import statements  # noqa: E402
+from app import app  # noqa: E402
+
+
+def served_by(db):
+    return db.execute('SELECT @@hostname AS host, @@port AS port').fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--reads', type=int, default=20)
+    args = parser.parse_args()
+
+    if dbmod.DB_TYPE != 'mysql' or not dbmod._replica_configs():
+        sys.exit('Set DB_TYPE=mysql and MYSQL_REPLICAS first')
+
+    primary = dbmod._connect_mysql()
+    cur = primary.cursor(dictionary=True)
+    cur.execute('SELECT @@hostname AS host, @@port AS port')
+    expected_primary = cur.fetchone()
+    primary.close()
+    print(f"primary   {expected_primary['host']}:{expected_primary['port']}")
+    for index, config in enumerate(dbmod._replica_configs()):
+        conn = dbmod._connect_mysql(config)
+        lag = 'unchecked'
+        if dbmod.MYSQL_REPLICA_LAG_CHECK != 'off':
+            lag = dbmod.replica_lag(conn)
+        print(f"replica {index} {config['host']}:{config['port']} lag={lag}")
+        conn.close()
+
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    # 1. A read-only request never touches the primary
+    with app.test_request_context('/'):
+        db = dbmod.get_db()
+        answers = [served_by(db) for _ in range(args.reads)]
+        check('reads go to a replica', all(a['port'] != expected_primary['port'] or
+                                            a['host'] != expected_primary['host'] for a in answers))
+        check('primary connection not opened', db._conn is None)
+        dbmod.close_connection(None)
+
+    # 2. Within a request, reads after a write see the primary
+    with app.test_request_context('/') as ctx:
+        db = dbmod.get_db()
+        db.execute('DO 1')
+        answer = served_by(db)
+        check('read after write goes to the primary', answer == expected_primary)
+        sticky = ctx.session.get('_primary_until')
+        check('session pinned to the primary', sticky is not None)
+        dbmod.close_connection(None)
+
+    # 3. The next request of the same session (the redirect) stays pinned
+    with app.test_request_context('/') as ctx:
+        ctx.session['_primary_until'] = sticky
+        db = dbmod.get_db()
+        check('next request reads the primary', served_by(db) == expected_primary)
+        dbmod.close_connection(None)
+
+    # 4. Locking reads always go to the primary
+    with app.test_request_context('/'):
+        db = dbmod.get_db()
+        answer = db.execute('SELECT @@hostname AS host, @@port AS port FROM DUAL FOR UPDATE').fetchone()
+        check('SELECT ... FOR UPDATE goes to the primary', answer == expected_primary)
+        dbmod.close_connection(None)
+
+    print('routing:', dbmod.ROUTING_STATS)
+    print('statements:', statements.stats())
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Local stand-in for an S3-compatible bucket (MinIO-style), for testing
+MEDIA_STORE=s3 without cloud credentials.
+
+Serves path-style requests (http://127.0.0.1:9000/<bucket>/<key>) from a
+directory: PUT/GET/HEAD/DELETE of objects, multipart uploads, and
+ListObjectsV2. Every request must carry a valid Signature Version 4, either
+in the Authorization header or as a presigned URL that has not expired, so
+the app's signing is exercised as well. Buckets are created on first use.
+
+Usage:
+    python tools/s3_standin.py --port 9000 --dir /tmp/s3
+    MEDIA_STORE=s3 S3_ENDPOINT=http://127.0.0.1:9000 S3_BUCKET=babygrow \\
+        S3_ACCESS_KEY=minioadmin S3_SECRET_KEY=minioadmin flask --app app run
+"""
+import argparse
+import calendar
+import hashlib
+import hmac
+import os
+import secrets
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+NS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+_lock = threading.Lock()
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def _signature(secret, amz_date, scope, canonical):
+    region = scope.split('/')[1]
+    key = _hmac(_hmac(_hmac(_hmac(('AWS4' + secret).encode(), amz_date[:8]), region), 's3'),
+                'aws4_request')
+    to_sign = f'AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n{hashlib.sha256(canonical.encode()).hexdigest()}'
+    return hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def _canonical(method, path, query, headers, signed, payload):
+    q = '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query))
+    h = ''.join(f'{name}:{" ".join(headers.get(name, "").split())}\n' for name in signed)
+    return f'{method}\n{path}\n{q}\n{h}\n{";".join(signed)}\n{payload}'
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # -- helpers
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        body = f'<?xml version="1.0"?><Error><Code>{code}</Code></Error>'.encode()
+        self._reply(status, body, {'Content-Type': 'application/xml'})
+
+    def _authorized(self, parts, query, body):
+        secret = self.server.secret_key
+        params = dict(query)
+        if 'X-Amz-Signature' in params:
+            amz_date = params['X-Amz-Date']
+            issued = calendar.timegm(time.strptime(amz_date, '%Y%m%dT%H%M%SZ'))
+            if time.time() > issued + int(params['X-Amz-Expires']):
+                return False
+            access, scope = params['X-Amz-Credential'].split('/', 1)
+            signed = params['X-Amz-SignedHeaders'].split(';')
+            unsigned = [(k, v) for k, v in query if k != 'X-Amz-Signature']
+            canonical = _canonical(self.command, parts.path, unsigned, self._headers(), signed,
+                                   'UNSIGNED-PAYLOAD')
+            given = params['X-Amz-Signature']
+        else:
+            auth = self.headers.get('Authorization', '')
+            if not auth.startswith('AWS4-HMAC-SHA256 '):
+                return False
+            fields = dict(f.strip().split('=', 1) for f in auth[len('AWS4-HMAC-SHA256 '):].split(','))
+            access, scope = fields['Credential'].split('/', 1)
+            signed = fields['SignedHeaders'].split(';')
+            amz_date = self.headers['x-amz-date']
+            payload = self.headers['x-amz-content-sha256']
+            if payload != 'UNSIGNED-PAYLOAD' and payload != hashlib.sha256(body).hexdigest():
+                return False
+            canonical = _canonical(self.command, parts.path, query, self._headers(), signed, payload)
+            given = fields['Signature']
+        return (access == self.server.access_key
+                and hmac.compare_digest(given, _signature(secret, amz_date, scope, canonical)))
+
+    def _headers(self):
+        return {k.lower(): v for k, v in self.headers.items()}
+
+    def _handle(self):
+        parts = urlsplit(self.path)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not self._authorized(parts, query, body):
+            return self._error(403, 'SignatureDoesNotMatch')
+        bucket, _, key = unquote(parts.path).lstrip('/').partition('/')
+        root = os.path.join(self.server.directory, bucket)
+        path = os.path.normpath(os.path.join(root, 'objects', key))
+        if key and not path.startswith(os.path.join(root, 'objects') + os.sep):
+            return self._error(400, 'InvalidObjectName')
+        params = dict(query)
+        method = self.command
+
+        if not key and method == 'GET':
+            return self._list(root, params)
+        if method == 'POST' and 'uploads' in params:
+            upload_id = secrets.token_hex(8)
+            os.makedirs(os.path.join(root, 'uploads', upload_id))
+            return self._reply(200, (f'<InitiateMultipartUploadResult xmlns="{NS}">'
+                                     f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>').encode())
+        if 'uploadId' in params:
+            upload_dir = os.path.join(root, 'uploads', os.path.basename(params['uploadId']))
+            if not os.path.isdir(upload_dir):
+                return self._error(404, 'NoSuchUpload')
+            if method == 'PUT':
+                with open(os.path.join(upload_dir, '%05d' % int(params['partNumber'])), 'wb') as f:
+                    f.write(body)
+                return self._reply(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+            if method == 'POST':
+                self._write(path, b''.join(open(os.path.join(upload_dir, name), 'rb').read()
+                                           for name in sorted(os.listdir(upload_dir))))
+            shutil.rmtree(upload_dir)
+            return self._reply(200 if method == 'POST' else 204,
+                               f'<CompleteMultipartUploadResult xmlns="{NS}"/>'.encode()
+                               if method == 'POST' else b'')
+        if method == 'PUT':
+            self._write(path, body)
+            return self._reply(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+        if method == 'DELETE':
+            if os.path.isfile(path):
+                os.remove(path)
+            return self._reply(204)
+        if method in ('GET', 'HEAD'):
+            if not os.path.isfile(path):
+                return self._error(404, 'NoSuchKey')
+            with open(path, 'rb') as f:
+                data = f.read()
+            return self._reply(200, data, {'Content-Length': str(len(data)),
+                                           'Content-Type': 'application/octet-stream'})
+        return self._error(405, 'MethodNotAllowed')
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _lock:
+            with open(path + '.part', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.part', path)
+
+    def _list(self, root, params):
+        objects = os.path.join(root, 'objects')
+        keys = []
+        for top, _, files in os.walk(objects):
+            for name in files:
+                key = os.path.relpath(os.path.join(top, name), objects).replace(os.sep, '/')
+                if key.startswith(params.get('prefix', '')) and not key.endswith('.part'):
+                    keys.append(key)
+        keys.sort()
+        start = int(params.get('continuation-token') or 0)
+        page = keys[start:start + 1000]
+        items = ''.join(
+            f'<Contents><Key>{escape(key)}</Key><Size>{os.path.getsize(os.path.join(objects, key))}</Size>'
+            f'<LastModified>{datetime.fromtimestamp(os.path.getmtime(os.path.join(objects, key)), timezone.utc).isoformat()}'
+            f'</LastModified></Contents>' for key in page)
+        more = start + 1000 < len(keys)
+        token = f'<NextContinuationToken>{start + 1000}</NextContinuationToken>' if more else ''
+        body = (f'<ListBucketResult xmlns="{NS}"><IsTruncated>{"true" if more else "false"}</IsTruncated>'
+                f'{token}{items}</ListBucketResult>').encode()
+        self._reply(200, body, {'Content-Type': 'application/xml'})
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--dir', default='/tmp/s3-standin')
+    parser.add_argument('--access-key', default='minioadmin')
+    parser.add_argument('--secret-key', default='minioadmin')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), S3Handler)
+    server.directory = args.dir
+    server.access_key = args.access_key
+    server.secret_key = args.secret_key
+    server.verbose = args.verbose
+    os.makedirs(args.dir, exist_ok=True)
+    print(f'S3 stand-in listening on http://127.0.0.1:{args.port}/<bucket>/<key>, data in {args.dir}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
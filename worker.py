@@ -0,0 +1,101 @@
+"""
+Background job scheduler for BabyGrow.
+
+Modules register periodic jobs with @job; the scheduler runs each one inside
+an app context at its interval. It runs either as its own process
+(`flask --app app worker`) or, on single-instance deployments where the web
+service owns the disk, as a daemon thread in the web process
+(BACKGROUND_WORKER=1). A lock file next to the database makes sure only one
+process runs jobs even with several gunicorn workers.
+"""
+import logging
+import os
+import threading
+import time
+
+from db import each_database
+
+logger = logging.getLogger(__name__)
+
+JOBS = {}
+
+# Poll granularity of the scheduler loop, in seconds
+TICK_SECONDS = 5
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def job(name, every, per_database=True):
+    """Register `fn` to run every `every` seconds.
+
+    With DB_SHARDING the job runs once per shard (get_db() pointing at it),
+    unless per_database is False.
+    """
+    def decorator(fn):
+        JOBS[name] = {'fn': fn, 'every': every, 'per_database': per_database}
+        return fn
+    return decorator
+
+
+def run_job(app, name):
+    """Run one registered job now, inside an app context."""
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            if JOBS[name]['per_database']:
+                for _ in each_database():
+                    JOBS[name]['fn']()
+            else:
+                JOBS[name]['fn']()
+        except Exception:
+            logger.exception('Job %s failed', name)
+            return False
+        logger.info('Job %s finished in %.2fs', name, time.perf_counter() - started)
+        return True
+
+
+def _acquire_lock(lock_dir):
+    """Take an exclusive, non-blocking lock; None if another process holds it."""
+    import fcntl
+    os.makedirs(lock_dir, exist_ok=True)
+    handle = open(os.path.join(lock_dir, 'worker.lock'), 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def run_forever(app, lock_dir, stop_event=None):
+    """Scheduler loop. Returns immediately if another process holds the lock."""
+    lock = _acquire_lock(lock_dir)
+    if lock is None:
+        logger.info('Another process is running background jobs')
+        return
+    stop_event = stop_event or threading.Event()
+    last_run = {}
+    logger.info('Background worker started with jobs: %s', ', '.join(sorted(JOBS)))
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            for name, spec in list(JOBS.items()):
+                if now - last_run.get(name, float('-inf')) >= spec['every']:
+                    last_run[name] = now
+                    run_job(app, name)
+            stop_event.wait(TICK_SECONDS)
+    finally:
+        lock.close()
+
+
+def start_background(app, lock_dir):
+    """Start the scheduler as a daemon thread (once per process)."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    thread = threading.Thread(target=run_forever, args=(app, lock_dir),
+                              name='babygrow-worker', daemon=True)
+    thread.start()